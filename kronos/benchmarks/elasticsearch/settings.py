@@ -25,6 +25,10 @@ storage = {
 node = {
   'id': hex(getnode()),
   'flush_size': 131072,
+  'put_read_size': 131072,
+  'put_chunk_size': 1000,
+  'compression_level': 6,
+  'get_multi_batch_size': 1000,
   'greenlet_pool_size': 50,
   'gipc_pool_size': 2,
   'log_directory': 'logs',
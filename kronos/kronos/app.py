@@ -19,10 +19,13 @@ os.environ['PYTHON_EGG_CACHE'] = _KRONOS_EGG_CACHE
 if 'gevent.monkey' not in sys.modules:
   import gevent.monkey; gevent.monkey.patch_all()
 
+import heapq
+import itertools
 import logging
 
-from collections import defaultdict
 from cStringIO import StringIO
+from timeuuid import TimeUUID
+from urlparse import parse_qs
 
 import kronos
 
@@ -34,15 +37,26 @@ from kronos.conf import logging as klogging; klogging.configure()
 from kronos.conf.constants import ERRORS_FIELD
 from kronos.conf.constants import MAX_LIMIT
 from kronos.conf.constants import ResultOrder
+from kronos.conf.constants import STREAM_FIELD
 from kronos.conf.constants import SUCCESS_FIELD
-from kronos.core import marshal
+from kronos.core import marshal; json = marshal.get_marshaler('json')
 from kronos.core.executor import execute_greenlet_async
+from kronos.core.executor import prefetch
 from kronos.core.executor import wait
+from kronos.core.inserter import ChunkedInserter
 from kronos.core.validator import validate_event_and_assign_id
 from kronos.core.validator import validate_stream
 from kronos.storage.router import router
+from kronos.utils import msgpack_stream
+from kronos.utils.aggregate import parse_aggregates
+from kronos.utils.compression import get_response_encoding
+from kronos.utils.compression import StreamCompressor
 from kronos.utils.decorators import endpoint
 from kronos.utils.decorators import ENDPOINTS
+from kronos.utils.filter import parse_condition
+from kronos.utils.filter import parse_properties
+from kronos.utils.json_stream import iter_lines
+from kronos.utils.json_stream import iter_put_request
 from kronos.utils.streams import infer_schema as _infer_schema
 
 log = logging.getLogger(__name__)
@@ -69,7 +83,33 @@ def index(environment, start_response, headers):
   return response
 
 
-@endpoint('/1.0/events/put', methods=['POST'])
+def _validate_stream_and_event(stream, event, stream_statuses, errors):
+  """
+  Validate `stream` and `event` and return the (TimeUUID, event) pair to insert,
+  or None if either of them is invalid. Validation errors are appended to
+  `errors`. `stream_statuses` maps streams seen so far in the request to
+  whether they are valid, so each stream is validated (and reported) once.
+  """
+  if stream not in stream_statuses:
+    try:
+      validate_stream(stream)
+      stream_statuses[stream] = True
+    except Exception, e:
+      log.exception('put_events: stream validation failed for `%s`', stream)
+      errors.append(repr(e))
+      stream_statuses[stream] = False
+  if not stream_statuses[stream]:
+    return None
+
+  try:
+    return validate_event_and_assign_id(event)
+  except Exception, e:
+    log.exception('put_events: event validation failed for `%s`', event)
+    errors.append(repr(e))
+    return None
+
+
+@endpoint('/1.0/events/put', methods=['POST'], decode_body=False)
 def put_events(environment, start_response, headers):
   """
   Store events in backends
@@ -80,50 +120,128 @@ def put_events(environment, start_response, headers):
                 ... }
     }
   Where each event is a dictionary of keys and values.
+
+  The body can also be msgpack encoded, in which case the `Content-Type` header
+  must be `application/x-msgpack`. The body is decoded incrementally and events
+  are inserted into backends in chunks of `settings.node.put_chunk_size` as they
+  are decoded. `namespace` should precede `events` in the body; events seen
+  before it are buffered till the namespace is known. A null `namespace` stands
+  for the default namespace, so clients can always lead with it.
   """
   errors = []
-  events_to_insert = defaultdict(list)
-  request_json = environment['json']
-  namespace = request_json.get('namespace', settings.default_namespace)
+  namespace = None
+  inserter = None
+  buffered_events = []
+  stream_statuses = {}
+  request_marshaler = environment['request_marshaler']
+  if request_marshaler is marshal.msgpack:
+    decode_request = msgpack_stream.iter_put_request
+  else:
+    decode_request = iter_put_request
 
-  # Validate streams and events
-  for stream, events in request_json.get('events', {}).iteritems():
-    try:
-      validate_stream(stream)
-    except Exception, e:
-      log.exception('put_events: stream validation failed for `%s`', stream)
-      errors.append(repr(e))
-      continue
+  try:
+    for key, value in decode_request(environment['wsgi.input'],
+                                     settings.node.put_read_size):
+      if key == 'namespace':
+        namespace = value or settings.default_namespace
+        continue
+      stream, event = value
+      event = _validate_stream_and_event(stream, event, stream_statuses,
+                                         errors)
+      if event is None:
+        continue
+
+      if inserter is None:
+        if namespace is None:
+          buffered_events.append((stream, event))
+          continue
+        inserter = ChunkedInserter(namespace, settings.node.put_chunk_size)
+        for buffered_stream, buffered_event in buffered_events:
+          inserter.add(buffered_stream, buffered_event)
+        buffered_events = []
+      inserter.add(stream, event)
+  except ValueError:
+    log.exception('put_events: request body is not valid %s.',
+                  request_marshaler.name)
+    error = 'Request body must be valid %s.' % request_marshaler.name
+    if inserter is None:
+      start_response('400 Bad Request', headers)
+      return {ERRORS_FIELD: [error],
+              SUCCESS_FIELD: False}
+    # Some events have already been inserted, so report what was inserted
+    # along with the error.
+    errors.append(error)
+    inserter.discard()
+
+  if inserter is None:
+    inserter = ChunkedInserter(namespace or settings.default_namespace,
+                               settings.node.put_chunk_size)
+  for stream, event in buffered_events:
+    inserter.add(stream, event)
+  success, response = inserter.finish()
+
+  response[SUCCESS_FIELD] = success and not errors
+  if errors:
+    response[ERRORS_FIELD] = errors
 
-    for event in events:
+  start_response('200 OK', headers)
+  return response
+
+
+@endpoint('/1.0/events/put_ndjson', methods=['POST'], decode_body=False)
+def put_ndjson_events(environment, start_response, headers):
+  """
+  Store newline-delimited events in backends
+  URL parameters:
+    namespace: namespace_name (optional)
+    stream: stream_name (optional)
+  POST body should contain one JSON encoded event per line. Each event is
+  stored in the stream named by its `@stream` key, or in `stream` if it doesn't
+  have one. Lines are decoded as they are read and events are inserted into
+  backends in chunks of `settings.node.put_chunk_size`.
+  """
+  params = parse_qs(environment.get('QUERY_STRING', ''))
+  namespace = params.get('namespace', [settings.default_namespace])[0]
+  default_stream = params.get('stream', [None])[0]
+
+  errors = []
+  stream_statuses = {}
+  inserter = ChunkedInserter(namespace, settings.node.put_chunk_size)
+  try:
+    for i, line in enumerate(iter_lines(environment['wsgi.input'],
+                                        settings.node.put_read_size)):
+      if not line.strip():
+        continue
       try:
-        events_to_insert[stream].append(validate_event_and_assign_id(event))
-      except Exception, e:
-        log.exception('put_events: event validation failed for `%s`', event)
-        errors.append(repr(e))
-
-  results = {}
-  for stream, events in events_to_insert.iteritems():
-    backends = router.backends_to_mutate(namespace, stream)
-    for backend, configuration in backends.iteritems():
-      results[(stream, backend.name)] = execute_greenlet_async(
-        backend.insert, namespace, stream, events, configuration)
-  wait(results.values())
-
-  # Did any insertion fail?
-  success = True
-  response = defaultdict(dict)
-  for (stream, backend), result in results.iteritems():
-    try:
-      result.get()
-      response[stream][backend] = {
-        'num_inserted': len(events_to_insert[stream])
-      }
-    except Exception, e:
-      log.exception('put_events: insertion to backend `%s` failed.', backend)
-      success = False
-      response[stream][backend] = {'num_inserted': -1,
-                                   ERRORS_FIELD: [repr(e)]}
+        event = json.loads(line)
+      except ValueError:
+        event = None
+      if not isinstance(event, dict):
+        log.error('put_ndjson_events: line %d is not a valid event.', i + 1)
+        errors.append('Line %d must be a JSON encoded event.' % (i + 1))
+        continue
+      stream = event.pop(STREAM_FIELD, default_stream)
+      if stream is None:
+        errors.append('Line %d has no `%s` and no `stream` was specified.' %
+                      (i + 1, STREAM_FIELD))
+        continue
+      event = _validate_stream_and_event(stream, event, stream_statuses, errors)
+      if event is not None:
+        inserter.add(stream, event)
+  except ValueError:
+    # The body couldn't be read, e.g., because its compressed encoding is
+    # corrupt.
+    log.exception('put_ndjson_events: request body could not be read.')
+    error = 'Request body could not be read.'
+    inserter.discard()
+    if not inserter.num_inserted:
+      start_response('400 Bad Request', headers)
+      return {ERRORS_FIELD: [error],
+              SUCCESS_FIELD: False}
+    # Some events have already been inserted, so report what was inserted
+    # along with the error.
+    errors.append(error)
+  success, response = inserter.finish()
 
   response[SUCCESS_FIELD] = success and not errors
   if errors:
@@ -133,7 +251,69 @@ def put_events(environment, start_response, headers):
   return response
 
 
-# TODO(usmanm): gzip compress response stream?
+def _parse_filter_and_properties(request_json):
+  """
+  Validate the optional `filter` and `properties` of a retrieval request.
+  """
+  condition = request_json.get('filter')
+  if condition is not None:
+    condition = parse_condition(condition)
+  properties = request_json.get('properties')
+  if properties is not None:
+    properties = parse_properties(properties)
+  return condition, properties
+
+
+def _stream_events(environment, start_response, headers, events):
+  """
+  Start a 200 response and yield the response body for `events`, an iterator
+  over JSON encoded events, in the format and content coding the client asked
+  for.
+  """
+  # Compress the response if the client accepts it. The compressor is flushed
+  # along with every chunk so clients can decode events as they arrive.
+  compressor = None
+  if settings.node.compression_level:
+    encoding = get_response_encoding(environment.get('HTTP_ACCEPT_ENCODING'))
+    if encoding:
+      compressor = StreamCompressor(encoding,
+                                    settings.node.compression_level)
+      headers.append(('Content-Encoding', encoding))
+  headers.append(('Vary', 'Accept-Encoding'))
+
+  start_response('200 OK', headers)
+
+  # Backends return JSON encoded events, which are passed through untouched to
+  # JSON clients. If the client asked for another format, every event is decoded
+  # and re-encoded, and the results are written back to back, since binary
+  # formats like msgpack are self-delimiting. That costs the server a decode and
+  # an encode per event, so msgpack trades server CPU for smaller responses and
+  # cheaper decoding on the client.
+  response_marshaler = environment['response_marshaler']
+  transcode = response_marshaler is not json
+
+  string_buffer = StringIO()
+  for event in events:
+    if string_buffer.tell() >= settings.node.flush_size:
+      if compressor:
+        yield compressor.compress(string_buffer.getvalue())
+      else:
+        yield string_buffer.getvalue()
+      string_buffer.close()
+      string_buffer = StringIO()
+    if transcode:
+      string_buffer.write(response_marshaler.dumps(json.loads(event)))
+    else:
+      string_buffer.write(event)
+      string_buffer.write('\r\n')
+  if compressor:
+    yield compressor.compress(string_buffer.getvalue()) + compressor.finish()
+  elif string_buffer.tell():
+    yield string_buffer.getvalue()
+  string_buffer.close()
+  yield ''
+
+
 @endpoint('/1.0/events/get', methods=['POST'])
 def get_events(environment, start_response, headers):
   """
@@ -146,23 +326,29 @@ def get_events(environment, start_response, headers):
       start_id : only_return_events_with_id_greater_than_me,
       limit: optional_maximum_number_of_events,
       order: ResultOrder.ASCENDING or ResultOrder.DESCENDING (default
-             ResultOrder.ASCENDING)
+             ResultOrder.ASCENDING),
+      filter: condition_in_metis_condition_format (optional),
+      properties: [property1, property2, ...] (optional)
     }
   Either start_time or start_id should be specified. If a retrieval breaks
   while returning results, you can send another retrieval request and specify
   start_id as the last id that you saw. Kronos will only return events that
-  occurred after the event with that id.
+  occurred after the event with that id. If `filter` is specified, only events
+  that satisfy it are returned (and counted against `limit`). If `properties`
+  is specified, events only contain those properties along with their id and
+  time.
   """
   request_json = environment['json']
   try:
     stream = request_json['stream']
     validate_stream(stream)
+    condition, properties = _parse_filter_and_properties(request_json)
   except Exception, e:
-    log.exception('get_events: stream validation failed for `%s`',
+    log.exception('get_events: invalid request for stream `%s`',
                   request_json.get('stream'))
     start_response('400 Bad Request', headers)
-    yield marshal.dumps({ERRORS_FIELD: [repr(e)],
-                         SUCCESS_FIELD: False})
+    yield environment['response_marshaler'].dumps({ERRORS_FIELD: [repr(e)],
+                                                   SUCCESS_FIELD: False})
     return
 
   namespace = request_json.get('namespace', settings.default_namespace)
@@ -179,26 +365,203 @@ def get_events(environment, start_response, headers):
       request_json.get('start_id'),
       configuration,
       order=request_json.get('order', ResultOrder.ASCENDING),
-      limit=limit)
+      limit=limit,
+      condition=condition,
+      properties=properties)
 
-  start_response('200 OK', headers)
+  # TODO(usmanm): Once all backends start respecting limit, remove the islice.
+  for chunk in _stream_events(environment, start_response, headers,
+                              itertools.islice(events, max(limit, 0))):
+    yield chunk
 
-  string_buffer = StringIO()
+
+def _tag_events(stream, events):
+  """
+  Add `STREAM_FIELD` to the JSON encoded `events` of `stream` without decoding
+  them.
+  """
+  prefix = '{"%s": %s, ' % (STREAM_FIELD, json.dumps(stream))
   for event in events:
-    # TODO(usmanm): Once all backends start respecting limit, remove this check.
-    if limit <= 0:
-      break
-    if string_buffer.tell() >= settings.node.flush_size:
-      yield string_buffer.getvalue()
-      string_buffer.close()
-      string_buffer = StringIO()
-    string_buffer.write(event)
-    string_buffer.write('\r\n')
-    limit -= 1
-  if string_buffer.tell():
-    yield string_buffer.getvalue()
-  string_buffer.close()
-  yield ''
+    yield prefix + event[1:]
+
+
+def _tag_and_key_events(stream, events, descending):
+  """
+  Like `_tag_events`, for the (id, event) pairs `events`, yielding
+  (TimeUUID, event) pairs so events of several streams can be merged by id
+  without decoding them. Backends set `descending` on ids differently, so
+  keys are rebuilt from their bytes.
+  """
+  prefix = '{"%s": %s, ' % (STREAM_FIELD, json.dumps(stream))
+  for _id, event in events:
+    yield (TimeUUID(bytes=_id.bytes, descending=descending),
+           prefix + event[1:])
+
+
+@endpoint('/1.0/events/get_multi', methods=['POST'])
+def get_multi_events(environment, start_response, headers):
+  """
+  Retrieve events from several streams at once
+  POST body should contain a JSON encoded version of:
+    { namespace: namespace_name (optional),
+      streams : [stream_name1, stream_name2, ...],
+      start_time : starting_time_as_kronos_time,
+      end_time : ending_time_as_kronos_time,
+      start_id : only_return_events_with_id_greater_than_me,
+      limit: optional_maximum_number_of_events_per_stream,
+      order: ResultOrder.ASCENDING or ResultOrder.DESCENDING (default
+             ResultOrder.ASCENDING),
+      filter: condition_in_metis_condition_format (optional),
+      properties: [property1, property2, ...] (optional),
+      merge: true or false (default false)
+    }
+  Streams are read concurrently, and each event returned has its stream in
+  `STREAM_FIELD`. By default, all events of a stream are returned before the
+  events of the next stream, in the order the streams were requested. If
+  `merge` is true, the events of all streams are merged into a single stream
+  ordered by id. The other parameters behave as in `get_events`.
+  """
+  request_json = environment['json']
+  try:
+    streams = request_json['streams']
+    if not isinstance(streams, list) or not streams:
+      raise ValueError('`streams` must be a non-empty list.')
+    for stream in streams:
+      validate_stream(stream)
+    condition, properties = _parse_filter_and_properties(request_json)
+  except Exception, e:
+    log.exception('get_multi_events: invalid request for streams `%s`',
+                  request_json.get('streams'))
+    start_response('400 Bad Request', headers)
+    yield environment['response_marshaler'].dumps({ERRORS_FIELD: [repr(e)],
+                                                   SUCCESS_FIELD: False})
+    return
+
+  namespace = request_json.get('namespace', settings.default_namespace)
+  limit = max(int(request_json.get('limit', MAX_LIMIT)), 0)
+  order = request_json.get('order', ResultOrder.ASCENDING)
+  descending = order == ResultOrder.DESCENDING
+  merge = bool(request_json.get('merge'))
+
+  # Start reading every stream before returning any events, so that backend
+  # I/O for all streams overlaps.
+  stream_events = []
+  for stream in sorted(set(streams), key=streams.index):
+    if limit == 0:
+      events = []
+    else:
+      backend, configuration = router.backend_to_retrieve(namespace, stream)
+      events = backend.retrieve(
+        namespace,
+        stream,
+        long(request_json.get('start_time', 0)),
+        long(request_json['end_time']),
+        request_json.get('start_id'),
+        configuration,
+        order=order,
+        limit=limit,
+        condition=condition,
+        properties=properties,
+        with_ids=merge)
+    events = itertools.islice(events, limit)
+    if merge:
+      events = _tag_and_key_events(stream, events, descending)
+    else:
+      events = _tag_events(stream, events)
+    stream_events.append(prefetch(events, settings.node.get_multi_batch_size))
+
+  if merge:
+    events = (event for _, event in heapq.merge(*stream_events))
+  else:
+    events = itertools.chain.from_iterable(stream_events)
+
+  for chunk in _stream_events(environment, start_response, headers, events):
+    yield chunk
+
+
+@endpoint('/1.0/events/count', methods=['POST'])
+def count_events(environment, start_response, headers):
+  """
+  Count events without retrieving them.
+  POST body should contain a JSON encoded version of:
+    { namespace: namespace_name (optional),
+      stream : stream_name,
+      start_time : starting_time_as_kronos_time,
+      end_time : ending_time_as_kronos_time,
+      start_id : only_count_events_with_id_greater_than_me,
+      limit: optional_maximum_count
+    }
+  Either start_time or start_id should be specified. The response contains
+  the `count` of events that `get_events` would return, up to `limit`. A
+  `limit` of 1 checks whether there are any events.
+  """
+  request_json = environment['json']
+  try:
+    stream = request_json['stream']
+    validate_stream(stream)
+    start_time = long(request_json.get('start_time', 0))
+    end_time = long(request_json['end_time'])
+    limit = int(request_json.get('limit', MAX_LIMIT))
+  except Exception, e:
+    log.exception('count_events: invalid request.')
+    start_response('400 Bad Request', headers)
+    return {ERRORS_FIELD: [repr(e)], SUCCESS_FIELD: False}
+
+  namespace = request_json.get('namespace', settings.default_namespace)
+  backend, configuration = router.backend_to_retrieve(namespace, stream)
+  count = backend.count(namespace, stream, start_time, end_time,
+                        request_json.get('start_id'), configuration,
+                        limit=limit)
+  start_response('200 OK', headers)
+  return {'count': count, SUCCESS_FIELD: True}
+
+
+@endpoint('/1.0/events/aggregate', methods=['POST'])
+def aggregate_events(environment, start_response, headers):
+  """
+  Compute aggregates over events in time buckets.
+  POST body should contain a JSON encoded version of:
+    { namespace: namespace_name (optional),
+      stream : stream_name,
+      start_time : starting_time_as_kronos_time,
+      end_time : ending_time_as_kronos_time,
+      bucket_width : bucket_width_as_kronos_time (optional),
+      group_by : [property1, property2, ...] (optional),
+      aggregates : [{op: count|sum|min|max|avg,
+                     property: property_name (optional for count),
+                     alias: output_name (optional)}, ...]
+    }
+  The response contains a list of `buckets`, each with the start time of the
+  bucket, the values of the `group_by` properties and the value of each
+  aggregate.
+  """
+  request_json = environment['json']
+  try:
+    stream = request_json['stream']
+    validate_stream(stream)
+    start_time = long(request_json['start_time'])
+    end_time = long(request_json['end_time'])
+    bucket_width = request_json.get('bucket_width')
+    if bucket_width is not None:
+      bucket_width = long(bucket_width)
+      if bucket_width <= 0:
+        raise ValueError('`bucket_width` must be positive.')
+    group_by = request_json.get('group_by') or []
+    if not isinstance(group_by, list):
+      group_by = [group_by]
+    aggregates = parse_aggregates(request_json.get('aggregates'))
+  except Exception, e:
+    log.exception('aggregate_events: invalid request.')
+    start_response('400 Bad Request', headers)
+    return {ERRORS_FIELD: [repr(e)], SUCCESS_FIELD: False}
+
+  namespace = request_json.get('namespace', settings.default_namespace)
+  backend, configuration = router.backend_to_retrieve(namespace, stream)
+  buckets = backend.aggregate(namespace, stream, start_time, end_time,
+                              bucket_width, group_by, aggregates,
+                              configuration)
+  start_response('200 OK', headers)
+  return {'buckets': buckets, SUCCESS_FIELD: True}
 
 
 @endpoint('/1.0/events/delete', methods=['POST'])
@@ -212,7 +575,9 @@ def delete_events(environment, start_response, headers):
       end_time : ending_time_as_kronos_time,
       start_id : only_delete_events_with_id_gte_me,
     }
-  Either start_time or start_id should be specified.
+  Either start_time or start_id should be specified. The response maps each
+  backend to its `num_deleted`, which is only a lower bound for backends that
+  delete events without reading them (see `Stream.delete` for Cassandra).
   """
   request_json = environment['json']
   try:
@@ -269,13 +634,17 @@ def get_streams(environment, start_response, headers):
     }
   """
   start_response('200 OK', headers)
+  response_marshaler = environment['response_marshaler']
   streams_seen_so_far = set()
   namespace = environment['json'].get('namespace', settings.default_namespace)
   for prefix, backend in router.get_read_backends(namespace):
     for stream in backend.streams(namespace):
       if stream.startswith(prefix) and stream not in streams_seen_so_far:
         streams_seen_so_far.add(stream)
-        yield '{0}\r\n'.format(stream)
+        if response_marshaler is json:
+          yield '{0}\r\n'.format(stream)
+        else:
+          yield response_marshaler.dumps(stream)
   yield ''
 
 
@@ -1,5 +1,6 @@
 ERRORS_FIELD = '@errors'
 ID_FIELD = '@id'
+STREAM_FIELD = '@stream'
 SUCCESS_FIELD = '@success'
 TIMESTAMP_FIELD = '@time'
 TOOK_FIELD = '@took'
@@ -8,6 +9,14 @@ MAX_LIMIT = 2 ** 31 - 1  # Max 32-bit signed int.
 SETTINGS_PATH = '/etc/kronos/settings.py'
 
 
+class AggregateOp(object):
+  AVG = 'avg'
+  COUNT = 'count'
+  MAX = 'max'
+  MIN = 'min'
+  SUM = 'sum'
+
+
 class ResultOrder(object):
   ASCENDING = 'ascending'
   DESCENDING = 'descending'
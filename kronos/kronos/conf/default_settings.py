@@ -97,10 +97,27 @@ namespace_to_streams_configuration = {
 node = {
   'id': hex(getnode()),  # Unique ID for this Kronos server.
   'flush_size': 131072,  # Number of bytes to flush at a time for /get endpoint.
+  'put_read_size': 131072,  # Number of bytes of a /put request body to read
+                            # at a time.
+  'put_chunk_size': 1000,  # Number of events from a /put request to buffer
+                           # before inserting them into backends.
+  'compression_level': 6,  # zlib level (1-9) used to compress /get responses
+                           # for clients that accept gzip or deflate; 0
+                           # disables compression.
+  'get_multi_batch_size': 1000,  # Number of events of each stream that a
+                                 # /get_multi request reads ahead at a time.
   'greenlet_pool_size': 500,  # Greenlet poolsize per process.  Balance against
                               # the parallelism of upstream processes, like
                               # uWSGI.
   'gipc_pool_size': multiprocessing.cpu_count(),
+  # Set to a dictionary to coalesce the events of many /put requests into
+  # fewer backend insertions with a per-process write-behind buffer (see
+  # `kronos.storage.buffer.WriteBehindBuffer`), e.g. {'flush_size': 5000,
+  # 'flush_interval_seconds': 0.5, 'max_events': 100000, 'ack': 'buffer'}.
+  # With `ack` set to 'buffer', /put requests succeed as soon as their events
+  # are buffered, and buffered events are lost if the process dies. With
+  # 'flush', they succeed once their events are inserted.
+  'write_buffer': None,
   'log_directory': 'logs',
   'cors_whitelist_domains': map(re.compile, [
     # Domains that match any regex in this list will be allowed to
@@ -6,6 +6,16 @@ class ConnectionFailure(Exception):
   pass
 
 
+class InsertFailure(Exception):
+  """
+  Raised by a backend when some of the writes of an insertion fail. `errors`
+  describes each failed write.
+  """
+  def __init__(self, errors):
+    super(InsertFailure, self).__init__('%d writes failed.' % len(errors))
+    self.errors = errors
+
+
 class InvalidRequest(Exception):
   pass
 
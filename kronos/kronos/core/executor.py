@@ -1,3 +1,5 @@
+import itertools
+
 from kronos.common.concurrent import AbstractExecutor
 from kronos.common.concurrent import GIPCExecutor
 from kronos.common.concurrent import GreenletExecutor
@@ -20,6 +22,31 @@ def execute_greenlet_async(func, *args, **kwargs):
   return _GREENLET_EXECUTOR.submit(func, *args, **kwargs)
 
 
+def prefetch(iterator, batch_size):
+  """
+  Returns an iterator over the items of `iterator` that reads them in batches
+  of `batch_size` items using `execute_greenlet_async`. The first batch starts
+  being read right away and each subsequent batch while the previous one is
+  consumed, so the I/O behind several prefetched iterators overlaps.
+  """
+  iterator = iter(iterator)
+
+  def read_batch():
+    return list(itertools.islice(iterator, batch_size))
+
+  def iterate(result):
+    while True:
+      batch = result.get()
+      if len(batch) == batch_size:
+        result = execute_greenlet_async(read_batch)
+      for item in batch:
+        yield item
+      if len(batch) < batch_size:
+        return
+
+  return iterate(execute_greenlet_async(read_batch))
+
+
 def execute_process_async(func, *args, **kwargs):
   """
   Executes `func` in a separate process. Memory and other resources are not
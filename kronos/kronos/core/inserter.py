@@ -0,0 +1,112 @@
+import logging
+
+from collections import defaultdict
+
+from kronos.conf.constants import ERRORS_FIELD
+from kronos.core.errors import InsertFailure
+from kronos.core.executor import execute_greenlet_async
+from kronos.core.executor import wait
+from kronos.storage.buffer import get_write_buffer
+from kronos.storage.router import router
+
+log = logging.getLogger(__name__)
+
+
+class ChunkedInserter(object):
+  """
+  Inserts validated (TimeUUID, event) pairs into every backend configured for
+  their streams in `namespace`, `chunk_size` events at a time. A chunk is handed
+  to the backends as soon as it fills up, so the caller can keep decoding
+  events while the previous chunk is being written. At most one chunk is in
+  flight at any time, which bounds the memory used by a single request. If a
+  write buffer is configured (see `get_write_buffer`), chunks are handed to it
+  instead, to be inserted along with the events of other requests. The buffer
+  bounds the events it holds itself, so chunks are handed over without waiting
+  for earlier ones, which with `ACK_ON_FLUSH` would wait for a flush per chunk,
+  and are only waited for in `finish`.
+  """
+
+  def __init__(self, namespace, chunk_size):
+    self.namespace = namespace
+    self.chunk_size = chunk_size
+    self.events = defaultdict(list)
+    self.num_events = 0
+    self.results = []
+    self.num_inserted = defaultdict(lambda: defaultdict(int))
+    self.errors = defaultdict(lambda: defaultdict(list))
+
+  def add(self, stream, event):
+    self.events[stream].append(event)
+    self.num_events += 1
+    if self.num_events >= self.chunk_size:
+      self.flush()
+
+  def _collect(self):
+    """
+    Wait for the chunk in flight to be inserted and record the outcome.
+    """
+    wait([result for _, _, _, result in self.results])
+    for stream, backend, num_events, result in self.results:
+      try:
+        result.get()
+        self.num_inserted[stream][backend] += num_events
+      except InsertFailure, e:
+        log.error('ChunkedInserter: %d writes to backend `%s` failed.',
+                  len(e.errors), backend)
+        self.errors[stream][backend].extend(e.errors)
+      except Exception, e:
+        log.exception('ChunkedInserter: insertion to backend `%s` failed.',
+                      backend)
+        self.errors[stream][backend].append(repr(e))
+    self.results = []
+
+  def flush(self):
+    """
+    Hand all buffered events to the backends without waiting for them to be
+    inserted.
+    """
+    write_buffer = get_write_buffer()
+    if write_buffer is None:
+      self._collect()
+    for stream, events in self.events.iteritems():
+      backends = router.backends_to_mutate(self.namespace, stream)
+      for backend, configuration in backends.iteritems():
+        self.num_inserted[stream][backend.name] += 0
+        if write_buffer is None:
+          result = execute_greenlet_async(backend.insert, self.namespace,
+                                          stream, events, configuration)
+        else:
+          result = write_buffer.add(self.namespace, stream, backend,
+                                    configuration, events)
+        self.results.append((stream, backend.name, len(events), result))
+    self.events = defaultdict(list)
+    self.num_events = 0
+
+  def discard(self):
+    """
+    Drop all buffered events and wait for the chunk in flight.
+    """
+    self.events = defaultdict(list)
+    self.num_events = 0
+    self._collect()
+
+  def finish(self):
+    """
+    Insert all buffered events and wait till every chunk is inserted. Returns
+    a tuple of (success, response) where response maps each stream to the
+    insertion status for each of its backends.
+    """
+    self.flush()
+    self._collect()
+    success = True
+    response = defaultdict(dict)
+    for stream, backends in self.num_inserted.iteritems():
+      for backend, num_inserted in backends.iteritems():
+        errors = self.errors[stream][backend]
+        if errors:
+          success = False
+          response[stream][backend] = {'num_inserted': -1,
+                                       ERRORS_FIELD: errors}
+        else:
+          response[stream][backend] = {'num_inserted': num_inserted}
+    return success, response
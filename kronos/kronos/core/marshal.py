@@ -2,25 +2,82 @@ import json as _json
 import sys
 import ujson
 
+try:
+  import msgpack as _msgpack
+except ImportError:
+  _msgpack = None
+
 
 class json(object):
   # ujson has superior decoding performance and produces the same output as
   # json.loads would. We use it in pykronos to speed up event parsing, use it
   # here to speed up request body parsing.
+  name = 'JSON'
+  content_type = 'application/json'
   loads = staticmethod(lambda s: ujson.loads(s, precise_float=True))
   dumps = staticmethod(_json.dumps)
 
 
+class msgpack(object):
+  # A compact binary alternative to JSON that clients can opt into with the
+  # `Content-Type` and `Accept` headers. Requires the msgpack-python package.
+  name = 'msgpack'
+  content_type = 'application/x-msgpack'
+  loads = staticmethod(lambda s: _msgpack.unpackb(s, encoding='utf-8'))
+  dumps = staticmethod(lambda o: _msgpack.packb(o))
+
+
+# Maps content types to the names of marshalers that can handle them. Only
+# marshalers whose dependencies are installed are listed.
+CONTENT_TYPES = {json.content_type: 'json'}
+if _msgpack is not None:
+  CONTENT_TYPES[msgpack.content_type] = 'msgpack'
+
+
+class SerializedEvent(dict):
+  """
+  An event along with its JSON serialization in `json`. Events are serialized
+  once when they are validated; storage backends write (and the memory backend
+  also serves) those bytes rather than serializing the event again. `json` is
+  not updated if the event is modified, so don't modify it.
+  """
+  __slots__ = ('json', )
+
+  def __init__(self, event):
+    super(SerializedEvent, self).__init__(event)
+    self.json = json.dumps(event)
+
+
 def get_marshaler(name):
   # This is convenient because to support other marshaling libraries, we mostly
   # will just have to add an import statement for them at the top. This is
   # because most Python marshaling libraries support the loads/dumps calls.
-  # For example if we want to support msgpack, all we need to do is add an
-  # `import msgpack` statement at the top and then call
-  # `set_marshaler('msgpack') below.
+  # For example, msgpack support above is an import statement, a thin class
+  # wrapping its loads/dumps calls and an entry in `CONTENT_TYPES`.
   return globals()[name]
 
 
+def get_marshaler_for_content_type(content_type):
+  """
+  Return the marshaler for a `Content-Type` header. Bodies with a missing or
+  unknown content type are assumed to be JSON.
+  """
+  content_type = (content_type or '').split(';', 1)[0].strip().lower()
+  return get_marshaler(CONTENT_TYPES.get(content_type, 'json'))
+
+
+def get_marshaler_for_accept(accept):
+  """
+  Return the marshaler for the first content type listed in an `Accept` header
+  that we can produce. Defaults to JSON.
+  """
+  for content_type in (accept or '').split(','):
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+      return get_marshaler(CONTENT_TYPES[content_type])
+  return json
+
+
 def set_marshaler(name):
   marshaler = get_marshaler(name)
   setattr(sys.modules[__name__], 'loads', marshaler.loads)
@@ -9,11 +9,26 @@ from kronos.conf.constants import TIMESTAMP_FIELD
 from kronos.core.errors import ImproperlyConfigured
 from kronos.core.errors import InvalidEventTime
 from kronos.core.errors import InvalidStreamName
+from kronos.core.marshal import SerializedEvent
+from kronos.storage.buffer import ACK_ON_BUFFER
+from kronos.storage.buffer import ACK_ON_FLUSH
 from kronos.utils.uuid import uuid_from_kronos_time
 
 MAX_STREAM_LENGTH = 2048
 STREAM_REGEX = re.compile(r'^[\w\-\.]+$', re.I)
 
+# Values for `node` settings that settings files written before the settings
+# existed don't have.
+NODE_SETTINGS_DEFAULTS = {
+  'put_read_size': 131072,
+  'put_chunk_size': 1000,
+  'get_multi_batch_size': 1000,
+  'compression_level': 6,
+}
+
+WRITE_BUFFER_SETTINGS = ('flush_size', 'flush_interval_seconds', 'max_events',
+                         'ack')
+
 
 def _validate_and_get_value(options, options_name, key, _type):
   """
@@ -46,7 +61,8 @@ def _validate_and_get_value(options, options_name, key, _type):
 def validate_event_and_assign_id(event):
   """
   Ensure that the event has a valid time. Assign a random UUID based on the
-  event time.
+  event time. The event is returned as a `SerializedEvent`, so it is only
+  serialized once no matter how many backends it is written to.
   """
   event_time = event.get(TIMESTAMP_FIELD)
 
@@ -59,7 +75,7 @@ def validate_event_and_assign_id(event):
   # set to random values.
   _id = uuid_from_kronos_time(event_time)
   event[ID_FIELD] = str(_id)
-  return _id, event
+  return _id, SerializedEvent(event)
 
 
 def validate_stream(stream):
@@ -102,7 +118,8 @@ def validate_settings(settings):
   """
   `settings` is either a dictionary or an object containing Kronos settings
   (e.g., the contents of conf/settings.py). This function checks that all
-  required settings are present and valid.
+  required settings are present and valid, and sets missing optional `node`
+  settings to their defaults (see `NODE_SETTINGS_DEFAULTS`).
   """
 
   # Validate `storage`
@@ -162,4 +179,38 @@ def validate_settings(settings):
   # Validate `node`
   node = getattr(settings, 'node', dict)
   _validate_and_get_value(node, 'node', 'greenlet_pool_size', int)
+  for key, value in NODE_SETTINGS_DEFAULTS.iteritems():
+    node.setdefault(key, value)
+  for key in ('put_read_size', 'put_chunk_size', 'get_multi_batch_size'):
+    if _validate_and_get_value(node, 'node', key, int) <= 0:
+      raise ImproperlyConfigured('`{}` in `node` must be positive'.format(key))
+  compression_level = _validate_and_get_value(node, 'node',
+                                              'compression_level', int)
+  if not 0 <= compression_level <= 9:
+    raise ImproperlyConfigured(
+        '`compression_level` in `node` must be between 0 and 9')
   _validate_and_get_value(node, 'node', 'id', str)
+
+  # Validate `node.write_buffer`, which is optional.
+  write_buffer = node.get('write_buffer')
+  if write_buffer:
+    if not isinstance(write_buffer, dict):
+      raise ImproperlyConfigured('`write_buffer` in `node` must be a dict')
+    for key in write_buffer:
+      if key not in WRITE_BUFFER_SETTINGS:
+        raise ImproperlyConfigured(
+            'Unknown setting `{}` in `node.write_buffer`'.format(key))
+    for key in ('flush_size', 'max_events'):
+      if _validate_and_get_value(write_buffer, 'node.write_buffer', key,
+                                 int) <= 0:
+        raise ImproperlyConfigured(
+            '`{}` in `node.write_buffer` must be positive'.format(key))
+    if _validate_and_get_value(write_buffer, 'node.write_buffer',
+                               'flush_interval_seconds', (int, float)) < 0:
+      raise ImproperlyConfigured('`flush_interval_seconds` in '
+                                 '`node.write_buffer` must not be negative')
+    if write_buffer.get('ack', ACK_ON_BUFFER) not in (ACK_ON_BUFFER,
+                                                      ACK_ON_FLUSH):
+      raise ImproperlyConfigured(
+          '`ack` in `node.write_buffer` must be `{}` or `{}`'.format(
+            ACK_ON_BUFFER, ACK_ON_FLUSH))
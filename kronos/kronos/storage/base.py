@@ -1,13 +1,39 @@
+import itertools
 import sys
 
 from timeuuid import TimeUUID
 
 from kronos.conf.constants import ResultOrder
+from kronos.core import marshal
+from kronos.utils.aggregate import aggregate_events
+from kronos.utils.filter import generate_filter
+from kronos.utils.filter import project_event
 from kronos.utils.uuid import uuid_from_kronos_time
 from kronos.utils.uuid import uuid_to_kronos_time
 from kronos.utils.uuid import UUIDType
 
 
+def filter_events(events, condition, properties, limit):
+  """
+  Yield up to `limit` of the (id, JSON serialized event) pairs `events` whose
+  events satisfy `condition`, projected onto `properties`. Either of
+  `condition` and `properties` can be None.
+  """
+  if limit <= 0:
+    return
+  check = generate_filter(condition) if condition else None
+  for _id, event in events:
+    event = marshal.loads(event)
+    if check and not check(event):
+      continue
+    if properties:
+      event = project_event(event, properties)
+    yield _id, marshal.dumps(event)
+    limit -= 1
+    if limit <= 0:
+      break
+
+
 class BaseStorage(object):
   # All subclasses must define `SETTINGS_VALIDATORS` mapping option names to a
   # function that takes a value for that option and returns True if it is valid
@@ -15,12 +41,17 @@ class BaseStorage(object):
   # `max_size` that should be a nonnegative integer, we would have:
   # SETTINGS_VALIDATORS = { 'max_size': lambda x: int(x) >= 0 }
   SETTINGS_VALIDATORS = {}
+  # Subclasses can define `SETTINGS_DEFAULTS` mapping option names to the value
+  # to use when an option is missing from their settings, so that new options
+  # don't break existing settings files.
+  SETTINGS_DEFAULTS = {}
 
   def __init__(self, name, namespaces, **settings):
     """
     Subclasses can assume that `settings` only contains keys that are also in
     `SETTINGS_VALIDATORS` and that their values are valid.
     """
+    settings = dict(self.__class__.SETTINGS_DEFAULTS, **settings)
     self.name = name
     for setting in self.__class__.SETTINGS_VALIDATORS:
       setattr(self, setting, settings[setting])
@@ -55,7 +86,8 @@ class BaseStorage(object):
                               self.__class__.__name__)
 
   def retrieve(self, namespace, stream, start_time, end_time, start_id,
-               configuration, order=ResultOrder.ASCENDING, limit=sys.maxint):
+               configuration, order=ResultOrder.ASCENDING, limit=sys.maxint,
+               condition=None, properties=None, with_ids=False):
     """
     Retrieves all the events for `stream` from `start_time` (inclusive) till
     `end_time` (inclusive). Alternatively to `start_time`, `start_id` can be
@@ -63,9 +95,15 @@ class BaseStorage(object):
     (inclusive) are returned. `start_id` should be used in cases when the client
     got disconnected from the server before all the events in the requested
     time window had been returned. `order` can be one of ResultOrder.ASCENDING
-    or ResultOrder.DESCENDING.
-
-    Returns an iterator over all JSON serialized (strings) events.
+    or ResultOrder.DESCENDING. If `condition` (as validated by
+    `kronos.utils.filter.parse_condition`) is given, only events that satisfy
+    it are returned, and `limit` applies to those events. If `properties` (as
+    returned by `kronos.utils.filter.parse_properties`) is given, events only
+    contain those properties.
+
+    Returns an iterator over all JSON serialized (strings) events, or over
+    (TimeUUID, JSON serialized event) pairs if `with_ids` is True, so that
+    callers that order events by id don't have to decode them.
     """
     if not start_id:
       start_id = uuid_from_kronos_time(start_time, _type=UUIDType.LOWEST)
@@ -73,14 +111,88 @@ class BaseStorage(object):
       start_id = TimeUUID(start_id)
     if uuid_to_kronos_time(start_id) > end_time:
       return []
-    return self._retrieve(namespace, stream, start_id, end_time, order, limit,
-                          configuration)
+    if condition is None and properties is None:
+      events = self._retrieve(namespace, stream, start_id, end_time, order,
+                              limit, configuration)
+    else:
+      events = self._retrieve_filtered(namespace, stream, start_id, end_time,
+                                       order, limit, configuration, condition,
+                                       properties)
+    if with_ids:
+      return events
+    return (event for _, event in events)
 
   def _retrieve(self, namespace, stream, start_id, end_time, order, limit,
                 configuration):
+    """
+    Yields the events of `retrieve` as (TimeUUID, JSON serialized event)
+    pairs.
+    """
     raise NotImplementedError('Must implement `_retrieve` method for %s.' %
                               self.__class__.__name__)
 
+  def _retrieve_filtered(self, namespace, stream, start_id, end_time, order,
+                         limit, configuration, condition, properties):
+    """
+    Filters and projects events as they are retrieved. Backends that can
+    filter or project events themselves should override this.
+    """
+    events = self._retrieve(namespace, stream, start_id, end_time, order,
+                            sys.maxint if condition else limit, configuration)
+    return filter_events(events, condition, properties, limit)
+
+  def count(self, namespace, stream, start_time, end_time, start_id,
+            configuration, limit=sys.maxint):
+    """
+    Counts the events that `retrieve` would return for the same arguments, up
+    to `limit`. Passing a `limit` of 1 checks whether there are any events.
+    """
+    if not start_id:
+      start_id = uuid_from_kronos_time(start_time, _type=UUIDType.LOWEST)
+    else:
+      start_id = TimeUUID(start_id)
+    if uuid_to_kronos_time(start_id) > end_time or limit <= 0:
+      return 0
+    return self._count(namespace, stream, start_id, end_time, limit,
+                       configuration)
+
+  def _count(self, namespace, stream, start_id, end_time, limit,
+             configuration):
+    """
+    Counts events as they are retrieved. Backends that can count events
+    without retrieving them should override this.
+    """
+    events = self._retrieve(namespace, stream, start_id, end_time,
+                            ResultOrder.ASCENDING, limit, configuration)
+    return sum(1 for _ in itertools.islice(events, limit))
+
+  def aggregate(self, namespace, stream, start_time, end_time, bucket_width,
+                group_by, aggregates, configuration):
+    """
+    Computes `aggregates`, a list of (op, property, alias) tuples, over the
+    events for `stream` from `start_time` (inclusive) till `end_time`
+    (inclusive). Events are grouped into time buckets `bucket_width` wide (or
+    a single bucket if `bucket_width` is None) and by the values of the
+    properties in `group_by`.
+
+    Returns a list of buckets as built by `kronos.utils.aggregate.make_bucket`.
+    """
+    if start_time > end_time:
+      return []
+    return self._aggregate(namespace, stream, start_time, end_time,
+                           bucket_width, group_by, aggregates, configuration)
+
+  def _aggregate(self, namespace, stream, start_time, end_time, bucket_width,
+                 group_by, aggregates, configuration):
+    """
+    Aggregates events as they are retrieved. Backends that can compute
+    aggregates themselves should override this.
+    """
+    events = self.retrieve(namespace, stream, start_time, end_time, None,
+                           configuration)
+    return aggregate_events((marshal.loads(event) for event in events),
+                            start_time, bucket_width, group_by, aggregates)
+
   def streams(self, namespace):
     return self._streams(namespace)
 
@@ -0,0 +1,163 @@
+"""
+A per-process write-behind buffer that coalesces the events of many small put
+requests into fewer, bigger backend insertions.
+"""
+import atexit
+import gevent
+import logging
+import time
+
+from gevent.event import AsyncResult
+from gevent.event import Event
+
+from kronos.conf import settings
+from kronos.core.errors import InsertFailure
+from kronos.core.executor import execute_greenlet_async
+
+log = logging.getLogger(__name__)
+
+ACK_ON_BUFFER = 'buffer'
+ACK_ON_FLUSH = 'flush'
+
+_WRITE_BUFFER = None
+
+
+class _Batch(object):
+  __slots__ = ('backend', 'configuration', 'events', 'results', 'created_at')
+
+  def __init__(self, backend, configuration):
+    self.backend = backend
+    self.configuration = configuration
+    self.events = []
+    self.results = []
+    self.created_at = time.time()
+
+
+class WriteBehindBuffer(object):
+  """
+  Buffers the events inserted into each (namespace, stream, backend) across
+  requests, and inserts them into the backend once `flush_size` events are
+  buffered or the oldest of them has been buffered for `flush_interval_seconds`.
+
+  `add` returns an AsyncResult for the events it buffers. If `ack` is
+  `ACK_ON_BUFFER`, it is ready as soon as the events are buffered, and events
+  that fail to be inserted are only logged (and events still buffered when the
+  process dies are lost). If `ack` is `ACK_ON_FLUSH`, it is ready once the
+  events are inserted, and raises the backend's error if they couldn't be.
+  Once `max_events` events are buffered or being inserted, `add` blocks till
+  there is room for more.
+  """
+  def __init__(self, flush_size, flush_interval_seconds, max_events,
+               ack=ACK_ON_BUFFER):
+    if ack not in (ACK_ON_BUFFER, ACK_ON_FLUSH):
+      raise ValueError('Write buffer `ack` must be `%s` or `%s`.' %
+                       (ACK_ON_BUFFER, ACK_ON_FLUSH))
+    self.flush_size = flush_size
+    self.flush_interval_seconds = flush_interval_seconds
+    self.max_events = max_events
+    self.ack = ack
+    # Maps (namespace, stream, backend name) to the `_Batch` being buffered.
+    self.batches = {}
+    self.in_flight = []
+    # Events buffered or being inserted.
+    self.num_events = 0
+    self.has_room = Event()
+    self.has_room.set()
+    self.flush_worker = gevent.spawn(self.flush_periodic)
+
+  def add(self, namespace, stream, backend, configuration, events):
+    while self.num_events and self.num_events + len(events) > self.max_events:
+      self.has_room.clear()
+      self.has_room.wait()
+
+    key = (namespace, stream, backend.name)
+    batch = self.batches.get(key)
+    if batch is None:
+      batch = self.batches[key] = _Batch(backend, configuration)
+    batch.events.extend(events)
+    self.num_events += len(events)
+    result = AsyncResult()
+    if self.ack == ACK_ON_FLUSH:
+      batch.results.append(result)
+    else:
+      result.set()
+    if (len(batch.events) >= self.flush_size or
+        not self.flush_interval_seconds):
+      self._flush(key)
+    return result
+
+  def _flush(self, key):
+    namespace, stream, _ = key
+    batch = self.batches.pop(key)
+    insertion = execute_greenlet_async(batch.backend.insert, namespace, stream,
+                                       batch.events, batch.configuration)
+    self.in_flight.append(insertion)
+
+    def inserted(insertion):
+      self.in_flight.remove(insertion)
+      self.num_events -= len(batch.events)
+      self.has_room.set()
+      if insertion.successful():
+        for result in batch.results:
+          result.set()
+        return
+      e = insertion.exception
+      if isinstance(e, InsertFailure):
+        log.error('WriteBehindBuffer: %d writes of %d events to backend `%s` '
+                  'failed.', len(e.errors), len(batch.events),
+                  batch.backend.name)
+      else:
+        log.error('WriteBehindBuffer: insertion of %d events to backend `%s` '
+                  'failed: %r', len(batch.events), batch.backend.name, e)
+      for result in batch.results:
+        result.set_exception(e)
+    insertion.rawlink(inserted)
+
+  def flush(self, max_age_seconds=0):
+    """
+    Insert the batches that have been buffered for at least `max_age_seconds`
+    without waiting for them to be inserted.
+    """
+    now = time.time()
+    for key, batch in self.batches.items():
+      if now - batch.created_at >= max_age_seconds:
+        self._flush(key)
+
+  def flush_periodic(self):
+    # Batches are flushed as they are added if `flush_interval_seconds` is 0.
+    if not self.flush_interval_seconds:
+      return
+    # Check often enough that batches are flushed at most a tenth of
+    # `flush_interval_seconds` late.
+    while True:
+      try:
+        gevent.sleep(self.flush_interval_seconds / 10.0)
+        self.flush(self.flush_interval_seconds)
+      except gevent.GreenletExit:
+        return
+
+  def close(self):
+    """
+    Insert all buffered events and wait for them to be inserted.
+    """
+    if not self.flush_worker.ready():
+      self.flush_worker.kill()
+    self.flush()
+    for insertion in list(self.in_flight):
+      insertion.wait()
+
+
+def get_write_buffer():
+  """
+  Return this process' `WriteBehindBuffer`, or None if `settings.node` doesn't
+  configure one. The buffer is created on first use, so that each process of a
+  pre-forking server gets its own.
+  """
+  global _WRITE_BUFFER
+  if _WRITE_BUFFER is None:
+    write_buffer_settings = settings.node.get('write_buffer')
+    if not write_buffer_settings:
+      return None
+    _WRITE_BUFFER = WriteBehindBuffer(**write_buffer_settings)
+    atexit.register(_WRITE_BUFFER.close)
+  return _WRITE_BUFFER
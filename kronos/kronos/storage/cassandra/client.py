@@ -1,17 +1,26 @@
 import atexit
 import logging
 
+from cassandra import ConsistencyLevel
 from cassandra.cluster import Cluster
+from cassandra.connection import locally_supported_compressions
+from cassandra.policies import DCAwareRoundRobinPolicy
+from cassandra.policies import HostDistance
+from cassandra.policies import RoundRobinPolicy
+from cassandra.policies import TokenAwarePolicy
 
 from kronos.common.time import epoch_time_to_kronos_time
 from kronos.conf.constants import ResultOrder
 from kronos.storage.base import BaseStorage
+from kronos.storage.cassandra.internal import ExcludeHostsPolicy
 from kronos.storage.cassandra.internal import Namespace
 from kronos.storage.cassandra.internal import Stream
 from kronos.utils.uuid import uuid_from_kronos_time
 from kronos.utils.uuid import UUIDType
+from kronos.utils.validate import is_bool
 from kronos.utils.validate import is_list
 from kronos.utils.validate import is_non_empty_str
+from kronos.utils.validate import is_non_neg_int
 from kronos.utils.validate import is_pos_int
 
 log = logging.getLogger(__name__)
@@ -23,6 +32,29 @@ class CassandraStorageException(Exception):
   pass
 
 
+def is_consistency_level(x):
+  return x in ConsistencyLevel.name_to_value
+
+
+def is_percentile(x):
+  return isinstance(x, (int, long, float)) and 0 <= x < 100
+
+
+def is_pos_number(x):
+  return (isinstance(x, (int, long, float)) and not isinstance(x, bool) and
+          x > 0)
+
+
+def is_compression(x):
+  # True lets the driver pick lz4 or snappy, whichever is installed and
+  # supported by Cassandra.
+  return x is True or x is False or x in locally_supported_compressions
+
+
+def get_consistency_level(configuration, setting):
+  return ConsistencyLevel.name_to_value[configuration[setting]]
+
+
 class CassandraStorage(BaseStorage):
   SETTINGS_VALIDATORS = {
     'timewidth_seconds':
@@ -32,7 +64,51 @@ class CassandraStorage(BaseStorage):
     'hosts': is_list,
     'keyspace_prefix': is_non_empty_str,
     'replication_factor': is_pos_int,
-    'read_size': is_pos_int
+    'read_size': is_pos_int,
+    'index_cache_ttl_seconds': is_non_neg_int,
+    'stream_list_cache_ttl_seconds': is_non_neg_int,
+    'prefetch_shards': is_non_neg_int,
+    'prefetch_buffer_bytes': is_non_neg_int,
+    'max_batch_bytes': is_pos_int,
+    'max_concurrent_batches': is_pos_int,
+    'range_deletes': is_bool,
+    'compact_storage': is_bool,
+    'max_events_per_shard': is_non_neg_int,
+    'max_shards_per_bucket': is_non_neg_int,
+    'read_consistency': is_consistency_level,
+    'write_consistency': is_consistency_level,
+    'speculative_retry_percentile': is_percentile,
+    'protocol_version': lambda x: x in (1, 2, 3),
+    'token_aware': is_bool,
+    'local_dc': lambda x: x is None or is_non_empty_str(x),
+    'used_hosts_per_remote_dc': is_non_neg_int,
+    'core_connections_per_host': is_pos_int,
+    'max_connections_per_host': is_pos_int,
+    'compression': is_compression,
+    'request_timeout_seconds': is_pos_number
+  }
+  SETTINGS_DEFAULTS = {
+    'index_cache_ttl_seconds': 0,
+    'stream_list_cache_ttl_seconds': 10,
+    'prefetch_shards': 4,
+    'prefetch_buffer_bytes': 32 * 1024 * 1024,
+    'max_batch_bytes': 32 * 1024,
+    'max_concurrent_batches': 32,
+    'range_deletes': False,
+    'compact_storage': False,
+    'max_events_per_shard': 0,
+    'max_shards_per_bucket': 0,
+    'read_consistency': 'ONE',
+    'write_consistency': 'QUORUM',
+    'speculative_retry_percentile': 0,
+    'protocol_version': CASSANDRA_PROTOCOL_VERSION,
+    'token_aware': True,
+    'local_dc': None,
+    'used_hosts_per_remote_dc': 0,
+    'core_connections_per_host': 4,
+    'max_connections_per_host': 8,
+    'compression': True,
+    'request_timeout_seconds': 10
   }
 
   def __init__(self, name, namespaces, **settings):
@@ -49,13 +125,32 @@ class CassandraStorage(BaseStorage):
     Set up a connection to the specified Cassandra cluster and create the
     specified keyspaces if they dont exist.
     """
+    if self.core_connections_per_host > self.max_connections_per_host:
+      raise CassandraStorageException('`core_connections_per_host` must not '
+                                      'be greater than '
+                                      '`max_connections_per_host`.')
+
     connections_to_shutdown = []
-    self.cluster = Cluster(self.hosts)
+    self.cluster = Cluster(
+      self.hosts,
+      protocol_version=self.protocol_version,
+      compression=self.compression,
+      load_balancing_policy=self.get_load_balancing_policy())
+    # Protocol version 3 multiplexes requests over a single connection per
+    # host, so the driver doesn't let us size connection pools.
+    if self.protocol_version < 3:
+      self.cluster.set_max_connections_per_host(HostDistance.LOCAL,
+                                                self.max_connections_per_host)
+      self.cluster.set_core_connections_per_host(
+        HostDistance.LOCAL, self.core_connections_per_host)
 
     for namespace_name in namespaces:
       keyspace = '%s_%s' % (self.keyspace_prefix, namespace_name)
       namespace = Namespace(self.cluster, keyspace,
-                            self.replication_factor, self.read_size)
+                            self.replication_factor, self.read_size,
+                            self.index_cache_ttl_seconds,
+                            self.stream_list_cache_ttl_seconds)
+      namespace.session.default_timeout = self.request_timeout_seconds
       connections_to_shutdown.append(namespace.session)
       self.namespaces[namespace_name] = namespace
 
@@ -66,6 +161,24 @@ class CassandraStorage(BaseStorage):
     atexit.register(lambda: map(lambda c: c.shutdown(),
                                 connections_to_shutdown))
 
+  def get_load_balancing_policy(self):
+    """
+    Return the policy the driver uses to pick the nodes to send each request
+    to: round robin over all nodes, or over the nodes of `local_dc` (and
+    `used_hosts_per_remote_dc` nodes of each other data center) if it is set.
+    If `token_aware` is set, requests are sent to the replicas of the
+    partition they read or write first. Speculative reads skip the node that
+    serves the original read (see `StreamShard.speculate`).
+    """
+    if self.local_dc is None:
+      policy = RoundRobinPolicy()
+    else:
+      policy = DCAwareRoundRobinPolicy(self.local_dc,
+                                       self.used_hosts_per_remote_dc)
+    if self.token_aware:
+      policy = TokenAwarePolicy(policy)
+    return ExcludeHostsPolicy(policy)
+
   def is_alive(self):
     """
     Is our connection to Cassandra alive?
@@ -76,7 +189,9 @@ class CassandraStorage(BaseStorage):
     namespace = self.namespaces[namespace]
     width = epoch_time_to_kronos_time(configuration['timewidth_seconds'])
     return namespace.get_stream(stream, width,
-                                int(configuration['shards_per_bucket']))
+                                int(configuration['shards_per_bucket']),
+                                int(configuration['max_events_per_shard']),
+                                int(configuration['max_shards_per_bucket']))
 
   def _insert(self, namespace, stream, events, configuration):
     """
@@ -87,7 +202,10 @@ class CassandraStorage(BaseStorage):
                       such as number of shards or width of a time interval.
     """
     stream = self.get_stream(namespace, stream, configuration)
-    stream.insert(events)
+    stream.insert(events, int(configuration['max_batch_bytes']),
+                  int(configuration['max_concurrent_batches']),
+                  get_consistency_level(configuration, 'write_consistency'),
+                  configuration['compact_storage'])
 
   def _delete(self, namespace, stream, start_id, end_time, configuration):
     """
@@ -102,7 +220,14 @@ class CassandraStorage(BaseStorage):
     stream = self.get_stream(namespace, stream, configuration)
     return stream.delete(start_id,
                          uuid_from_kronos_time(end_time,
-                                               _type=UUIDType.HIGHEST))
+                                               _type=UUIDType.HIGHEST),
+                         int(configuration['max_batch_bytes']),
+                         int(configuration['max_concurrent_batches']),
+                         configuration['range_deletes'],
+                         get_consistency_level(configuration,
+                                               'read_consistency'),
+                         get_consistency_level(configuration,
+                                               'write_consistency'))
 
   def _retrieve(self, namespace, stream, start_id, end_time, order, limit,
                 configuration):
@@ -121,17 +246,39 @@ class CassandraStorage(BaseStorage):
     events = stream.iterator(start_id,
                              uuid_from_kronos_time(end_time,
                                                    _type=UUIDType.HIGHEST),
-                             order == ResultOrder.DESCENDING, limit)
+                             order == ResultOrder.DESCENDING, limit,
+                             int(configuration['prefetch_shards']),
+                             int(configuration['prefetch_buffer_bytes']),
+                             get_consistency_level(configuration,
+                                                   'read_consistency'),
+                             configuration['speculative_retry_percentile'])
     events = events.__iter__()
-    event = events.next()
+    _id, event_json = events.next()
     # If first event's ID is equal to `start_id`, skip it.
-    if event.id != start_id:
-      yield event.json
-    while True:
-      yield events.next().json
+    if _id != start_id:
+      yield _id, event_json
+    for event in events:
+      yield event
+
+  def _count(self, namespace, stream, start_id, end_time, limit,
+             configuration):
+    """
+    Count events for `stream` between `start_id` and `end_time` by scanning
+    their ids rather than retrieving them.
+    """
+    stream = self.get_stream(namespace, stream, configuration)
+    return stream.count(start_id,
+                        uuid_from_kronos_time(end_time,
+                                              _type=UUIDType.HIGHEST),
+                        limit,
+                        get_consistency_level(configuration,
+                                              'read_consistency'))
 
   def _streams(self, namespace):
-    for stream_name in self.namespaces[namespace].list_streams():
+    # Listing streams isn't specific to a stream prefix, so it uses the
+    # backend's own read consistency.
+    for stream_name in self.namespaces[namespace].list_streams(
+        ConsistencyLevel.name_to_value[self.read_consistency]):
       yield stream_name
 
   def _clear(self):
@@ -1,32 +1,44 @@
 import cassandra
 import heapq
+import logging
+import math
 import random
+import struct
+import threading
+import time
+import zlib
 
 from cassandra import ConsistencyLevel
 from cassandra import cqltypes
+from cassandra.policies import LoadBalancingPolicy
 from cassandra.protocol import ResultMessage
 from cassandra.query import BatchType
 from cassandra.query import BatchStatement
 from cassandra.query import BoundStatement
 from cassandra.query import SimpleStatement
 from collections import defaultdict
+from collections import deque
 from datetime import timedelta
 from timeuuid import TimeUUID
 
 from kronos.common.cache import InMemoryLRUCache
+from kronos.common.time import epoch_time_to_kronos_time
+from kronos.common.time import kronos_time_to_epoch_time
+from kronos.conf.constants import ID_FIELD
 from kronos.conf.constants import MAX_LIMIT
 from kronos.conf.constants import TIMESTAMP_FIELD
-from kronos.core import marshal
-from kronos.core.errors import InvalidTimeUUIDComparison
+from kronos.core.errors import InsertFailure
 from kronos.core.executor import execute_greenlet_async
 from kronos.core.executor import wait
+from kronos.core.marshal import json
 from kronos.storage.cassandra.errors import CassandraStorageError
-from kronos.storage.cassandra.errors import InvalidStreamComparison
 from kronos.utils.math import round_down
 from kronos.utils.uuid import UUIDType
 from kronos.utils.uuid import uuid_from_kronos_time
 from kronos.utils.uuid import uuid_to_kronos_time
 
+log = logging.getLogger(__name__)
+
 
 # Patch Datastax driver to return TimeUUID objects rather than plain UUID
 # objects if the CQL type is timeuuid.
@@ -38,84 +50,431 @@ class TimeUUIDType(cqltypes.TimeUUIDType):
 ResultMessage._type_codes[0x000F] = TimeUUIDType
 
 
-class StreamEvent(object):
-  def __init__(self, _id, event_json, stream_shard):
-    self.stream_shard = stream_shard
-    self.json = event_json
-    _id.descending = stream_shard.descending
-    self.id = _id
+# Events can be stored in the `compact_blob` column rather than the `blob`
+# column. Compact blobs start with a version byte. In version 1, it is
+# followed by the raw deflate compressed JSON of the event without
+# `ID_FIELD` and `TIMESTAMP_FIELD`, which are rebuilt from the id of the
+# row.
+COMPACT_BLOB_V1 = '\x01'
+
+
+def _remove_field(event, event_json, field):
+  """
+  Return `event_json`, the JSON of the dictionary `event`, without `field`,
+  or None if that can't be done without decoding it because `field` may also
+  be nested somewhere in the event.
+  """
+  if field not in event:
+    return event_json
+  field_json = json.dumps({field: event[field]})[1:-1]
+  if event_json.count(field_json) != 1:
+    return None
+  start = event_json.index(field_json)
+  end = start + len(field_json)
+  if event_json[end:end + 2] == ', ':
+    end += 2
+  elif event_json[start - 2:start] == ', ':
+    start -= 2
+  return event_json[:start] + event_json[end:]
+
+
+def compact_event(event):
+  """
+  Return the version 1 compact blob of the `SerializedEvent` `event`. Its JSON
+  is reused rather than serializing the event again.
+  """
+  event_json = _remove_field(event, event.json, ID_FIELD)
+  if event_json is not None:
+    event_json = _remove_field(event, event_json, TIMESTAMP_FIELD)
+  if event_json is None:
+    event = dict(event)
+    event.pop(ID_FIELD, None)
+    event.pop(TIMESTAMP_FIELD, None)
+    event_json = json.dumps(event)
+  compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+  return (COMPACT_BLOB_V1 + compressor.compress(event_json) +
+          compressor.flush())
+
+
+def expand_compact_event(_id, blob):
+  """
+  Return the JSON of the event with id `_id` stored in the compact `blob`.
+  """
+  if blob[:1] != COMPACT_BLOB_V1:
+    raise CassandraStorageError('Unknown compact blob version: %r' % blob[:1])
+  event_json = zlib.decompress(blob[1:], -zlib.MAX_WBITS)
+  # Splice the fields back in rather than parsing and serializing the event.
+  prefix = '{"%s": "%s", "%s": %d' % (ID_FIELD, _id, TIMESTAMP_FIELD,
+                                      uuid_to_kronos_time(_id))
+  if event_json == '{}':
+    return prefix + '}'
+  return prefix + ', ' + event_json[1:]
+
+
+# Maps each byte to its complement, which reverses the order of strings of the
+# same length.
+_COMPLEMENT_BYTES = ''.join(chr(255 - i) for i in xrange(256))
+
+
+def get_sort_key(_id, descending=False):
+  """
+  Return a string that sorts like the TimeUUID `_id` does among other
+  TimeUUIDs (by time, then by the remaining bytes), or in reverse if
+  `descending` is set. Heaps of these keys are compared in C, unlike
+  TimeUUIDs wrapped in Python objects.
+  """
+  key = struct.pack('>Q', _id.time) + _id.bytes[8:]
+  if descending:
+    return key.translate(_COMPLEMENT_BYTES)
+  return key
+
+
+class ReadBuffer(object):
+  """
+  Keeps track of the size of the pages of events that a `Stream.iterator` has
+  read from Cassandra but not yet yielded, so that it stops reading ahead
+  once they take up more than `max_bytes`.
+  """
+  __slots__ = ('max_bytes', 'used')
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.used = 0
+
+  def has_room(self):
+    return self.used < self.max_bytes
+
+
+class SpeculativeBoundStatement(BoundStatement):
+  """
+  A bound statement that `ExcludeHostsPolicy` doesn't send to any of
+  `excluded_hosts`.
+  """
+  excluded_hosts = ()
+
+
+class ExcludeHostsPolicy(LoadBalancingPolicy):
+  """
+  Wraps the load balancing policy `child_policy` and leaves the
+  `excluded_hosts` of `SpeculativeBoundStatement`s out of their query plans.
+  With a token aware child policy, a speculative read that excludes the
+  replica serving the original read is sent to the next replica of its
+  partition, which reads its own copy at consistency level ONE.
+  """
+  def __init__(self, child_policy):
+    self.child_policy = child_policy
+
+  def populate(self, cluster, hosts):
+    self.child_policy.populate(cluster, hosts)
+
+  def check_supported(self):
+    self.child_policy.check_supported()
+
+  def distance(self, host):
+    return self.child_policy.distance(host)
+
+  def make_query_plan(self, working_keyspace=None, query=None):
+    excluded_hosts = getattr(query, 'excluded_hosts', ())
+    for host in self.child_policy.make_query_plan(working_keyspace, query):
+      if host not in excluded_hosts:
+        yield host
+
+  def on_up(self, host):
+    self.child_policy.on_up(host)
+
+  def on_down(self, host):
+    self.child_policy.on_down(host)
+
+  def on_add(self, host):
+    self.child_policy.on_add(host)
+
+  def on_remove(self, host):
+    self.child_policy.on_remove(host)
+
+
+class LatencyTracker(object):
+  """
+  Keeps the latencies of the last `window` shard reads to estimate
+  percentiles of the latency of shard reads.
+  """
+  MIN_SAMPLES = 100
+
+  def __init__(self, window=1000):
+    self.latencies = deque(maxlen=window)
+    self.sorted_latencies = None
+
+  def add(self, latency):
+    self.latencies.append(latency)
+    if len(self.latencies) % self.MIN_SAMPLES == 0:
+      self.sorted_latencies = None
+
+  def percentile(self, percentile):
+    """
+    Return the `percentile`th percentile of recent latencies, or None if there
+    aren't enough of them yet. Percentiles are recomputed every
+    `MIN_SAMPLES` reads.
+    """
+    if len(self.latencies) < self.MIN_SAMPLES:
+      return None
+    if self.sorted_latencies is None:
+      self.sorted_latencies = sorted(self.latencies)
+    index = int(len(self.sorted_latencies) * percentile / 100.0)
+    return self.sorted_latencies[min(index, len(self.sorted_latencies) - 1)]
+
+
+def wait_for_any(futures, timeout=None):
+  """
+  Wait till one of the driver's response `futures` succeeds or all of them
+  fail, for at most `timeout` seconds. Returns the first future that
+  succeeded, or None.
+  """
+  done = threading.Event()
+  succeeded = []
+  failed = []
+
+  def on_result(_, future):
+    succeeded.append(future)
+    done.set()
+
+  def on_error(_, future):
+    failed.append(future)
+    if len(failed) == len(futures):
+      done.set()
+
+  for future in futures:
+    future.add_callbacks(on_result, on_error, callback_args=(future, ),
+                         errback_args=(future, ))
+  done.wait(timeout)
+  return succeeded[0] if succeeded else None
 
-  def __cmp__(self, other):
-    if not other:
-      return 1
-    if isinstance(other, TimeUUID):
-      return cmp(self.id, other)
-    if isinstance(other, StreamEvent):
-      return cmp(self.id, other.id)
-    raise InvalidTimeUUIDComparison('Compared TimeUUID to type {0}'
-                                    .format(type(other)))
+
+class BatchWriter(object):
+  """
+  Groups write statements by partition key into UNLOGGED batches of roughly
+  at most `max_batch_bytes`, so that each batch is sent straight to the
+  replicas of its partition rather than fanned out by a single coordinator.
+  Batches are sent as soon as they fill up, with up to
+  `max_concurrent_batches` in flight at a time. The errors of failed batches
+  are collected in `errors`, their partition keys in `failed_keys` and the
+  number of rows they wrote in `num_failed_rows`.
+  """
+  def __init__(self, session, consistency_level, max_batch_bytes,
+               max_concurrent_batches):
+    self.session = session
+    self.consistency_level = consistency_level
+    self.max_batch_bytes = max_batch_bytes
+    self.max_concurrent_batches = max_concurrent_batches
+    self.pending = {}  # partition key => [statements, size, number of rows]
+    self.in_flight = deque()
+    self.errors = []
+    self.failed_keys = set()
+    self.num_failed_rows = 0
+
+  def add(self, key, statement, size, num_rows=1):
+    """
+    Add `statement`, of approximately `size` bytes and writing `num_rows`
+    rows, to the batch of partition `key`.
+    """
+    batch = self.pending.get(key)
+    if batch is not None and batch[1] + size > self.max_batch_bytes:
+      self.flush(key)
+      batch = None
+    if batch is None:
+      batch = self.pending[key] = [[], 0, 0]
+    batch[0].append(statement)
+    batch[1] += size
+    batch[2] += num_rows
+
+  def flush(self, key):
+    """
+    Send the pending batch of partition `key`, if any.
+    """
+    batch = self.pending.pop(key, None)
+    if batch is None:
+      return
+    statements, _, num_rows = batch
+    while len(self.in_flight) >= self.max_concurrent_batches:
+      self._collect(*self.in_flight.popleft())
+    batch_stmt = BatchStatement(batch_type=BatchType.UNLOGGED,
+                                consistency_level=self.consistency_level)
+    for statement in statements:
+      batch_stmt.add(statement)
+    # Batches don't have a routing key of their own; without one the driver
+    # can't send them to a replica of their partition.
+    batch_stmt.routing_key = (key.encode('utf-8')
+                              if isinstance(key, unicode) else key)
+    self.in_flight.append((key, len(statements), num_rows,
+                           self.session.execute_async(batch_stmt)))
+
+  def _collect(self, key, num_statements, num_rows, future):
+    try:
+      future.result()
+    except Exception, e:
+      self.failed_keys.add(key)
+      self.num_failed_rows += num_rows
+      self.errors.append('Batch of %d statements to partition `%s` failed: %r'
+                         % (num_statements, key, e))
+
+  def finish(self):
+    """
+    Send all pending batches and wait for every batch to be written.
+    """
+    for key in self.pending.keys():
+      self.flush(key)
+    while self.in_flight:
+      self._collect(*self.in_flight.popleft())
 
 
 class StreamShard(object):
+  __slots__ = ('session', 'descending', 'read_size', 'limit',
+               'consistency_level', 'speculative_retry_percentile', 'key',
+               'namespace', 'sort_key', '_events_future', '_select_values',
+               '_fetch_started_at')
+
   def __init__(self, namespace, stream, start_time, width, shard, descending,
-               limit, read_size):
+               limit, read_size, consistency_level=ConsistencyLevel.ONE,
+               speculative_retry_percentile=0):
     self.session = namespace.session
     self.descending = descending
     self.read_size = read_size
     self.limit = limit
+    self.consistency_level = consistency_level
+    self.speculative_retry_percentile = speculative_retry_percentile
     self.key = StreamShard.get_key(stream, start_time, shard)
     self.namespace = namespace
 
-    # If we want to sort in descending order, compare the end of the
-    # interval.
+    # Shards are merged in order of the first id they can hold: the start of
+    # their interval, or its end if we want to sort in descending order.
     if descending:
-      self.cmp_id = uuid_from_kronos_time(start_time + width, UUIDType.HIGHEST)
-      self.cmp_id.descending = True
+      self.sort_key = get_sort_key(
+        uuid_from_kronos_time(start_time + width, UUIDType.HIGHEST), True)
     else:
-      self.cmp_id = uuid_from_kronos_time(start_time, UUIDType.LOWEST)
+      self.sort_key = get_sort_key(
+        uuid_from_kronos_time(start_time, UUIDType.LOWEST))
 
     self._events_future = None
+    self._select_values = None
+    self._fetch_started_at = None
 
   @staticmethod
   def get_key(stream, start_time, shard):
+    # The key doesn't include the width of the bucket, so buckets of
+    # different widths (see `Stream.record_ingest`) that start at the same time
+    # share partitions. Readers merge such buckets into the widest of them
+    # (see `Stream.get_overlapping_shards`).
     return '%s:%d:%d' % (stream, start_time, shard)
 
-  def __cmp__(self, other):
-    if other is None:
-      return 1
-    elif isinstance(other, StreamShard):
-      return cmp((self.cmp_id, self.key), (other.cmp_id, other.key))
-    raise InvalidStreamComparison('Compared StreamShard to type {0}'
-                                  .format(type(other)))
-
-  def start_fetching_events_async(self, start_id, end_id):
+  def _select_events_stmt(self, statement_class):
     if self.descending:
       select_stmt = self.namespace.SELECT_DESC_STMT
     else:
       select_stmt = self.namespace.SELECT_ASC_STMT
+    select_stmt = statement_class(select_stmt,
+                                  fetch_size=self.read_size or 5000,
+                                  routing_key=self.key,
+                                  consistency_level=self.consistency_level)
+    return select_stmt.bind(self._select_values)
 
-    select_stmt = BoundStatement(select_stmt,
-                                 fetch_size=self.read_size or 5000,
-                                 routing_key=self.key,
-                                 consistency_level=ConsistencyLevel.ONE)
+  def start_fetching_events_async(self, start_id, end_id):
+    if self._events_future is not None:
+      # Already prefetched.
+      return
+    self._select_values = (self.key, start_id, end_id, self.limit)
+    self._fetch_started_at = time.time()
     self._events_future = self.session.execute_async(
-      select_stmt.bind((self.key, start_id, end_id, self.limit)))
+      self._select_events_stmt(BoundStatement))
 
-  def iterator(self, start_id=None, end_id=None):
+    if self.speculative_retry_percentile:
+      latencies = self.namespace.read_latencies
+      started_at = self._fetch_started_at
+      recorded = []
+
+      def record_latency(_):
+        # Callbacks also run for the following pages.
+        if not recorded:
+          recorded.append(True)
+          latencies.add(time.time() - started_at)
+      self._events_future.add_callback(record_latency)
+
+  def speculate(self):
+    """
+    If the first page of events has taken longer to arrive than the
+    `speculative_retry_percentile`th percentile of recent shard reads, send
+    the read again to another replica and keep whichever response arrives
+    first, so that one slow replica doesn't hold up the read. This relies on
+    the session's load balancing policy being an `ExcludeHostsPolicy` around
+    a token aware policy.
+    """
+    delay = self.namespace.read_latencies.percentile(
+      self.speculative_retry_percentile)
+    if delay is None:
+      return
+    # A timeout of 0 still returns the read if it has already completed.
+    timeout = max(self._fetch_started_at + delay - time.time(), 0)
+    if wait_for_any([self._events_future], timeout):
+      return
+    speculative_stmt = self._select_events_stmt(SpeculativeBoundStatement)
+    # The driver doesn't expose the host a request was sent to otherwise, and
+    # `_current_host` is private, so if it is missing no host is excluded.
+    current_host = getattr(self._events_future, '_current_host', None)
+    if current_host is not None:
+      speculative_stmt.excluded_hosts = (current_host, )
+    speculative_future = self.session.execute_async(speculative_stmt)
+    future = wait_for_any([self._events_future, speculative_future])
+    if future is not None:
+      self._events_future = future
+
+  def iterator(self, start_id=None, end_id=None, read_buffer=None):
+    """
+    Yield the (id, event JSON) pairs of the shard a page at a time. As soon as
+    a page arrives, the next one is requested so that it is fetched while the
+    current page is consumed, unless `read_buffer` (a `ReadBuffer`) is full,
+    in which case it is only requested once the current page has been
+    consumed.
+    """
     if self._events_future is None:
       assert start_id is not None and end_id is not None
       self.start_fetching_events_async(start_id, end_id)
-    for event in self._events_future.result():
+    if self.speculative_retry_percentile:
+      self.speculate()
+    future = self._events_future
+    while True:
+      page = future.result()
+      has_more_pages = future.has_more_pages
+      if has_more_pages:
+        # Only take the rows of this page: iterating over the `PagedResult`
+        # would block on fetching the next page once they run out.
+        page = page.current_response
+      # Rows are (id, blob, compact_blob), only one of the blobs being set.
+      rows = list(page)
+      prefetching = has_more_pages and (read_buffer is None or
+                                        read_buffer.has_room())
+      if prefetching:
+        future.start_fetching_next_page()
+      size = sum(len(row[1] or row[2]) for row in rows)
+      if read_buffer is not None:
+        read_buffer.used += size
       try:
-        yield StreamEvent(event[0], event[1], self)
+        for row in rows:
+          if row[1] is None:
+            yield row[0], expand_compact_event(row[0], row[2])
+          else:
+            yield row[0], row[1]
       except GeneratorExit:
-        break
+        return
+      finally:
+        if read_buffer is not None:
+          read_buffer.used -= size
+      if not has_more_pages:
+        return
+      if not prefetching:
+        future.start_fetching_next_page()
 
   def ids_iterator(self, start_id, end_id):
     select_ids_stmt = BoundStatement(self.namespace.SELECT_ID_STMT,
                                      fetch_size=100000,  # 100k ids at a time.
                                      routing_key=self.key,
-                                     consistency_level=ConsistencyLevel.ONE)
+                                     consistency_level=self.consistency_level)
     ids = self.session.execute(
       select_ids_stmt.bind((self.key, start_id, end_id, self.limit)))
     for _id in ids:
@@ -125,30 +484,163 @@ class StreamShard(object):
         break
 
 
+def choose_bucket_layout(ingest_rate, max_events_per_shard, shards,
+                         max_shards):
+  """
+  Return the (width, shards) to use for new buckets of a stream that receives
+  `ingest_rate` events per second, so that each shard of a bucket holds about
+  half of `max_events_per_shard` events or less. The widest width of
+  `Stream.AUTO_TUNE_WIDTHS` that is small enough is used with `shards` shards.
+  If even the narrowest width is too wide, buckets are split into more shards,
+  up to `max_shards`.
+  """
+  target = max_events_per_shard / 2.0
+  for width in reversed(Stream.AUTO_TUNE_WIDTHS):
+    if ingest_rate * width / 1e7 / shards <= target:
+      return width, shards
+  width = Stream.AUTO_TUNE_WIDTHS[0]
+  needed_shards = int(math.ceil(ingest_rate * width / 1e7 / target))
+  return width, max(shards, min(needed_shards, max_shards))
+
+
 class Stream(object):
   # 6 months.
   MAX_WIDTH = int(timedelta(days=365.25).total_seconds() * 1e7) / 2
 
-  def __init__(self, namespace, stream, width, shards, read_size):
+  # Bucket widths that auto-tuning chooses from: a minute, 10 minutes, an
+  # hour, 6 hours, a day, a week and 4 weeks.
+  AUTO_TUNE_WIDTHS = [epoch_time_to_kronos_time(seconds)
+                      for seconds in (60, 600, 3600, 6 * 3600, 86400,
+                                      7 * 86400, 28 * 86400)]
+
+  # The ingest rate of a stream is measured over windows of at least this
+  # many seconds.
+  INGEST_RATE_WINDOW_SECONDS = 60
+
+  def __init__(self, namespace, stream, width, shards, read_size,
+               index_cache_ttl=0, max_events_per_shard=0, max_shards=0):
     self.session = namespace.session
     self.read_size = read_size
     self.stream = stream
     self.shards = shards
     self.width = width
     self.namespace = namespace
+    self.index_cache_ttl = index_cache_ttl
+
+    # Bucket auto-tuning: if `max_events_per_shard` is set, the width and
+    # number of shards of new buckets are changed when the ingest rate of the
+    # stream would put more than `max_events_per_shard` (or much fewer) events
+    # in each shard. The index stores the width of each bucket, so readers
+    # handle buckets of different widths.
+    self.max_events_per_shard = max_events_per_shard
+    self.max_shards = max(max_shards, shards)
+    self.ingest_rate = None  # Events per second.
+    self.ingest_window_start = time.time()
+    self.ingest_window_events = 0
 
     # Index cache is a write cache: it prevents us from writing to the
     # bucket index if we've already updated it in a previous
-    # operation.
+    # operation. Keys are (start_time, width, shard).
     self.index_cache = InMemoryLRUCache(max_items=1000)
 
-  def get_overlapping_shards(self, start_time, end_time):
+    # Whether this process has added the stream to the stream catalog.
+    self.in_catalog = False
+
+    # Index read cache: maps the start of each `MAX_WIDTH` wide page of the
+    # bucket index to [expiry time, set of (start_time, width, shard) rows in
+    # the page], so that reads don't have to scan the index every time. Other
+    # kronosd processes can add buckets, so pages expire after
+    # `index_cache_ttl` seconds, and till then reads miss the events in those
+    # buckets. Buckets added by this process are added to cached pages as they
+    # are written. The cache is only used if `index_cache_ttl` is set.
+    self.index_pages = InMemoryLRUCache(max_items=100)
+
+  def invalidate_index_cache(self):
+    self.index_pages.clear()
+
+  def get_index_page(self, page_start):
+    """
+    Return the set of (start_time, width, shard) index rows with start times in
+    [`page_start`, `page_start` + `MAX_WIDTH`), from the index read cache if
+    possible.
+    """
+    if self.index_cache_ttl:
+      try:
+        expires_at, rows = self.index_pages.get(page_start)
+        if expires_at > time.time():
+          return rows
+      except KeyError:
+        pass
     index_scan_stmt = BoundStatement(self.namespace.INDEX_SCAN_STMT)
-    potential_shards = self.session.execute(
+    rows = set(tuple(row) for row in self.session.execute(
       index_scan_stmt.bind((self.stream,
-                            max(start_time - Stream.MAX_WIDTH, 0),
-                            end_time))
-    )
+                            page_start,
+                            page_start + Stream.MAX_WIDTH))))
+    if self.index_cache_ttl:
+      self.index_pages.set(page_start,
+                           [time.time() + self.index_cache_ttl, rows])
+    return rows
+
+  def add_to_index_cache(self, start_time, width, shard):
+    page_start = round_down(start_time, Stream.MAX_WIDTH)
+    try:
+      _, rows = self.index_pages.get(page_start)
+      rows.add((start_time, width, shard))
+    except KeyError:
+      pass
+
+  def record_ingest(self, num_events):
+    """
+    Update the ingest rate of the stream with `num_events` new events and
+    retune its buckets (see `choose_bucket_layout`) once the events per shard
+    it would lead to leave [`max_events_per_shard` / 4,
+    `max_events_per_shard`]. The rate is an exponentially weighted average of
+    the rate over windows of `INGEST_RATE_WINDOW_SECONDS`. Each kronosd
+    process only sees the events it inserts.
+    """
+    self.ingest_window_events += num_events
+    now = time.time()
+    elapsed = now - self.ingest_window_start
+    if elapsed < Stream.INGEST_RATE_WINDOW_SECONDS:
+      return
+    rate = self.ingest_window_events / elapsed
+    if self.ingest_rate is None:
+      self.ingest_rate = rate
+    else:
+      self.ingest_rate = (self.ingest_rate + rate) / 2
+    self.ingest_window_start = now
+    self.ingest_window_events = 0
+
+    events_per_shard = self.ingest_rate * self.width / 1e7 / self.shards
+    if (self.max_events_per_shard / 4.0 <= events_per_shard <=
+        self.max_events_per_shard):
+      return
+    width, shards = choose_bucket_layout(self.ingest_rate,
+                                         self.max_events_per_shard,
+                                         self.shards, self.max_shards)
+    if (width, shards) != (self.width, self.shards):
+      log.info('Stream `%s` ingests %.2f events/s: using %d second buckets '
+               'with %d shards rather than %d second buckets with %d shards.',
+               self.stream, self.ingest_rate,
+               kronos_time_to_epoch_time(width), shards,
+               kronos_time_to_epoch_time(self.width), self.shards)
+      self.width, self.shards = width, shards
+
+  def get_overlapping_shards(self, start_time, end_time):
+    scan_start = max(start_time - Stream.MAX_WIDTH, 0)
+    if self.index_cache_ttl:
+      # Read the index a cacheable page at a time.
+      potential_shards = (
+        row
+        for page_start in xrange(round_down(scan_start, Stream.MAX_WIDTH),
+                                 end_time,
+                                 Stream.MAX_WIDTH)
+        for row in self.get_index_page(page_start)
+        if scan_start <= row[0] < end_time)
+    else:
+      index_scan_stmt = BoundStatement(self.namespace.INDEX_SCAN_STMT)
+      potential_shards = self.session.execute(
+        index_scan_stmt.bind((self.stream, scan_start, end_time)))
     shards = defaultdict(lambda: defaultdict(int))
     for (shard_time, width, shard) in potential_shards:
       if shard_time + width < start_time:
@@ -161,43 +653,94 @@ class Stream(object):
                'width': width,
                'shard': shard}
 
-  def insert(self, events):
+  def insert(self, events, max_batch_bytes, max_concurrent_batches,
+             consistency_level=ConsistencyLevel.QUORUM, compact=False):
+    """
+    Insert `events`, a list of (TimeUUID, SerializedEvent) pairs, in batches
+    (see `BatchWriter`). If `compact` is set, events are stored as compact
+    blobs (see `compact_event`). Raises InsertFailure listing each batch that
+    failed.
+    """
     if not events:
       return
-    batch_stmt = BatchStatement(batch_type=BatchType.UNLOGGED,
-                                consistency_level=ConsistencyLevel.QUORUM)
 
+    writer = BatchWriter(self.session, consistency_level, max_batch_bytes,
+                         max_concurrent_batches)
+    # Auto-tuning can change these while the events are written.
+    width, shards = self.width, self.shards
+    # Index entries (and the catalog entry) are only cached once they have
+    # been written, so that concurrent inserts into the same buckets keep
+    # writing them till one of the writes succeeds.
+    new_index_entries = set()
+    add_to_catalog = False
     shard_idx = {}
     for _id, event in events:
-      shard_time = round_down(event[TIMESTAMP_FIELD], self.width)
+      shard_time = round_down(event[TIMESTAMP_FIELD], width)
       shard = shard_idx.get(shard_time,
-                            random.randint(0, self.shards - 1))
+                            random.randint(0, shards - 1))
 
       # Insert to index.
-      try:
-        self.index_cache.get((shard_time, shard))
-      except KeyError:
-        batch_stmt.add(BoundStatement(self.namespace.INDEX_INSERT_STMT,
-                                      routing_key=self.stream,
-                                      consistency_level=ConsistencyLevel.QUORUM)
-                       .bind((self.stream, shard_time, self.width, shard)))
-        self.index_cache.set((shard_time, shard), None)
+      index_entry = (shard_time, width, shard)
+      if index_entry not in new_index_entries:
+        try:
+          self.index_cache.get(index_entry)
+        except KeyError:
+          writer.add(self.stream,
+                     BoundStatement(self.namespace.INDEX_INSERT_STMT)
+                     .bind((self.stream, shard_time, width, shard)),
+                     len(self.stream) + 20)
+          new_index_entries.add(index_entry)
+          if not self.in_catalog and not add_to_catalog:
+            add_to_catalog = True
+            writer.add(Namespace.CATALOG_KEY,
+                       BoundStatement(self.namespace.CATALOG_INSERT_STMT)
+                       .bind((Namespace.CATALOG_KEY, self.stream)),
+                       len(self.stream) + 20)
 
       # Insert to stream.
       shard_key = StreamShard.get_key(self.stream, shard_time, shard)
-      batch_stmt.add(BoundStatement(self.namespace.INSERT_STMT,
-                                    routing_key=shard_key,
-                                    consistency_level=ConsistencyLevel.QUORUM)
-                     .bind((shard_key,
-                            _id,
-                            marshal.dumps(event))))
-      shard_idx[shard_time] = (shard + 1) % self.shards  # Round robin.
+      if compact:
+        blob = compact_event(event)
+        insert_stmt = self.namespace.COMPACT_INSERT_STMT
+      else:
+        blob = event.json
+        insert_stmt = self.namespace.INSERT_STMT
+      writer.add(shard_key,
+                 BoundStatement(insert_stmt).bind((shard_key, _id, blob)),
+                 len(shard_key) + 16 + len(blob))
+      shard_idx[shard_time] = (shard + 1) % shards  # Round robin.
+    writer.finish()
 
-    self.session.execute(batch_stmt)
+    # If the index or catalog writes failed, they are written again the next
+    # time their buckets are written to.
+    if self.stream not in writer.failed_keys:
+      for index_entry in new_index_entries:
+        self.index_cache.set(index_entry, None)
+        self.add_to_index_cache(*index_entry)
+    if add_to_catalog and Namespace.CATALOG_KEY not in writer.failed_keys:
+      self.in_catalog = True
+      self.namespace.add_to_stream_list(self.stream)
 
-  def iterator(self, start_id, end_id, descending, limit):
-    start_id.descending = end_id.descending = descending
+    if self.max_events_per_shard:
+      self.record_ingest(len(events))
 
+    if writer.errors:
+      raise InsertFailure(writer.errors)
+
+  def iterator(self, start_id, end_id, descending, limit, prefetch_shards=0,
+               prefetch_buffer_bytes=0, consistency_level=ConsistencyLevel.ONE,
+               speculative_retry_percentile=0):
+    """
+    Yield the (id, event JSON) pairs of the events with `start_id` <= id <=
+    `end_id` in order by merging the events of all overlapping shards.
+    Besides the shards that the merge needs right away, the first page of the
+    next `prefetch_shards` shards is requested ahead of time, and the next
+    page of each shard being merged is requested as soon as its current page
+    arrives. Reading ahead stops while more than `prefetch_buffer_bytes` of
+    events are buffered. Shards are read at `consistency_level`,
+    speculatively if `speculative_retry_percentile` is
+    set (see `StreamShard.speculate`).
+    """
     shards = self.get_overlapping_shards(uuid_to_kronos_time(start_id),
                                          uuid_to_kronos_time(end_id))
     shards = sorted(map(lambda shard: StreamShard(self.namespace,
@@ -207,30 +750,66 @@ class Stream(object):
                                                   shard['shard'],
                                                   descending,
                                                   limit,
-                                                  self.read_size),
-                        shards))
+                                                  self.read_size,
+                                                  consistency_level,
+                                                  speculative_retry_percentile),
+                        shards),
+                    key=lambda shard: (shard.sort_key, shard.key))
+    # (index, shard) pairs of the shards that haven't been loaded yet.
+    shards = list(enumerate(shards))
+    if descending:
+      first_key = get_sort_key(end_id, True)
+      last_key = get_sort_key(start_id, True)
+    else:
+      first_key = get_sort_key(start_id)
+      last_key = get_sort_key(end_id)
+    # Maps the index of each shard being merged to its iterator.
     iterators = {}
+    # Holds the next event of each shard being merged as a (sort key, shard
+    # index, id, event JSON) tuple. Shard indexes are unique, so comparisons
+    # never get past them.
     event_heap = []
     shards_to_load = []
+    read_buffer = ReadBuffer(prefetch_buffer_bytes)
 
-    def load_next_shards(cmp_id):
+    def push_next_event(index, it):
+      """
+      Pushes the next event of the shard `index` onto the event heap. Returns
+      False if the shard has no more events.
+      """
+      try:
+        _id, event_json = it.next()
+      except StopIteration:
+        return False
+      heapq.heappush(event_heap,
+                     (get_sort_key(_id, descending), index, _id, event_json))
+      return True
+
+    def prefetch_next_shards():
+      """
+      Start fetching the next `prefetch_shards` shards to be merged, so that
+      their events have arrived by the time the merge gets to them.
+      """
+      for _, shard in shards[:prefetch_shards]:
+        if not read_buffer.has_room():
+          break
+        shard.start_fetching_events_async(start_id, end_id)
+
+    def load_next_shards(sort_key):
       """
       Pulls the earliest event from the next earliest shard and puts it into the
       event heap.
       """
-      while shards and shards[0].cmp_id <= cmp_id:
-        shard = shards.pop(0)
+      while shards and shards[0][1].sort_key <= sort_key:
+        index, shard = shards.pop(0)
         shard.start_fetching_events_async(start_id, end_id)
-        shards_to_load.append(shard)
+        shards_to_load.append((index, shard))
       while shards_to_load:
-        shard = shards_to_load.pop(0)
-        it = shard.iterator(start_id, end_id)
-        try:
-          event = it.next()
-          heapq.heappush(event_heap, event)
-          iterators[shard] = it
-        except StopIteration:
-          pass
+        index, shard = shards_to_load.pop(0)
+        it = shard.iterator(start_id, end_id, read_buffer)
+        if push_next_event(index, it):
+          iterators[index] = it
+      prefetch_next_shards()
 
     def load_overlapping_shards():
       """
@@ -240,77 +819,118 @@ class Stream(object):
       """
       while not event_heap and shards:
         # Try to pull events from unread shards.
-        load_next_shards(shards[0].cmp_id)
+        load_next_shards(shards[0][1].sort_key)
 
       if event_heap and shards:
         # Pull events from all shards that overlap with the next event to be
         # yielded.
-        load_next_shards(event_heap[0].id)
+        load_next_shards(event_heap[0][0])
       elif not iterators:
         # No events in the heap and no active iterators? We're done!
         return
 
-      shards_with_events = set(event.stream_shard for event in event_heap)
-      for shard in iterators.keys():
-        if shard in shards_with_events:
+      shards_with_events = set(entry[1] for entry in event_heap)
+      for index in iterators.keys():
+        if index in shards_with_events:
           continue
-        try:
-          it = iterators[shard]
-          event = it.next()
-          heapq.heappush(event_heap, event)
-        except StopIteration:
-          del iterators[shard]
+        if not push_next_event(index, iterators[index]):
+          del iterators[index]
 
     def _iterator(limit):
       load_overlapping_shards()  # bootstrap.
 
-      # No events?
-      if not event_heap:
-        raise StopIteration
-
       while event_heap or shards:
         if limit <= 0:
-          raise StopIteration
+          return
         if event_heap:
-          # Get the next event to return.
-          event = heapq.heappop(event_heap)
-          # Note: in descending conditions below, we flip `<` for
-          # `>` and `>=` for `<=` UUID comparator logic is flipped.
-          if ((not descending and event.id > end_id) or
-              (descending and event.id > start_id)):
-            raise StopIteration
-          elif ((not descending and event.id >= start_id) or
-                (descending and event.id >= end_id)):
+          # Get the next event to return. Sort keys are reversed when
+          # descending, so `first_key` is `end_id`'s key in that case.
+          sort_key, _, _id, event_json = heapq.heappop(event_heap)
+          if sort_key > last_key:
+            return
+          elif sort_key >= first_key:
             limit -= 1
-            yield event
+            yield _id, event_json
 
         load_overlapping_shards()
 
     for event in _iterator(limit):
       yield event
 
-  def delete(self, start_id, end_id):
+  def count(self, start_id, end_id, limit,
+            consistency_level=ConsistencyLevel.ONE):
+    """
+    Count events with `start_id` < id <= `end_id`, up to `limit`. Only the ids
+    of events are read, and all shards are scanned concurrently.
+    """
     shards = list(self.get_overlapping_shards(uuid_to_kronos_time(start_id),
                                               uuid_to_kronos_time(end_id)))
 
-    def delete_from_shard(shard):
-      batch_stmt = BatchStatement(batch_type=BatchType.UNLOGGED,
-                                  consistency_level=ConsistencyLevel.QUORUM)
-      num_deleted = 0
+    def count_shard(shard):
+      # Read one more id than `limit` in case `start_id` is among them.
       shard = StreamShard(self.namespace, self.stream,
                           shard['start_time'], shard['width'],
                           shard['shard'], False,
-                          MAX_LIMIT, read_size=self.read_size)
-      for _id in shard.ids_iterator(start_id, end_id):
-        if _id == start_id:
-          continue
-        num_deleted += 1
-        batch_stmt.add(BoundStatement(self.namespace.DELETE_STMT,
-                                      routing_key=shard.key,
-                                      consistency_level=ConsistencyLevel.QUORUM)
-                       .bind((shard.key, _id)))
-      self.session.execute(batch_stmt)
-      return num_deleted
+                          min(limit + 1, MAX_LIMIT), self.read_size,
+                          consistency_level)
+      return sum(1 for _id in shard.ids_iterator(start_id, end_id)
+                 if _id != start_id)
+
+    for i, shard in enumerate(shards):
+      shards[i] = execute_greenlet_async(count_shard, shard)
+    wait(shards)
+    return min(sum(shard.get() for shard in shards), limit)
+
+  def delete(self, start_id, end_id, max_batch_bytes, max_concurrent_batches,
+             range_deletes=False, read_consistency_level=ConsistencyLevel.ONE,
+             write_consistency_level=ConsistencyLevel.QUORUM):
+    """
+    Delete events with `start_id` < id <= `end_id`. Shards that only contain
+    such events are deleted with a single partition tombstone. Events of the
+    other shards are deleted as their ids are paged in, in batches (see
+    `BatchWriter`), or with a single range tombstone per shard if
+    `range_deletes` is set, which requires Cassandra 3.0 or later. Returns
+    the number of deleted events and a list of errors. Tombstones are written
+    without reading the ids they delete, so the events they delete aren't
+    counted: the number of deleted events is a lower bound.
+    """
+    start_time = uuid_to_kronos_time(start_id)
+    end_time = uuid_to_kronos_time(end_id)
+    shards = list(self.get_overlapping_shards(start_time, end_time))
+
+    def delete_from_shard(shard):
+      stream_shard = StreamShard(self.namespace, self.stream,
+                                 shard['start_time'], shard['width'],
+                                 shard['shard'], False,
+                                 MAX_LIMIT, self.read_size,
+                                 read_consistency_level)
+      key = stream_shard.key
+      # Shards are deleted concurrently, so each gets a writer of its own.
+      writer = BatchWriter(self.session, write_consistency_level,
+                           max_batch_bytes, max_concurrent_batches)
+      num_deleted = 0
+      if (shard['start_time'] > start_time and
+          shard['start_time'] + shard['width'] <= end_time + 1):
+        writer.add(key,
+                   BoundStatement(self.namespace.PARTITION_DELETE_STMT)
+                   .bind((key, )),
+                   len(key) + 32, 0)
+      elif range_deletes:
+        writer.add(key,
+                   BoundStatement(self.namespace.get_range_delete_stmt())
+                   .bind((key, start_id, end_id)),
+                   len(key) + 32, 0)
+      else:
+        for _id in stream_shard.ids_iterator(start_id, end_id):
+          if _id == start_id:
+            continue
+          num_deleted += 1
+          writer.add(key,
+                     BoundStatement(self.namespace.DELETE_STMT)
+                     .bind((key, _id)),
+                     len(key) + 16)
+      writer.finish()
+      return num_deleted - writer.num_failed_rows, writer.errors
 
     for i, shard in enumerate(shards):
       shards[i] = execute_greenlet_async(delete_from_shard, shard)
@@ -320,7 +940,9 @@ class Stream(object):
     num_deleted = 0
     for shard in shards:
       try:
-        num_deleted += shard.get()
+        shard_num_deleted, shard_errors = shard.get()
+        num_deleted += shard_num_deleted
+        errors.extend(shard_errors)
       except Exception, e:
         errors.append(repr(e))
 
@@ -338,6 +960,7 @@ class Namespace(object):
     key text,
     id timeuuid,
     blob text,
+    compact_blob blob,
     PRIMARY KEY (key, id)
   )"""
   INDEX_CQL = """CREATE TABLE idx (
@@ -347,30 +970,60 @@ class Namespace(object):
     shard int,
     PRIMARY KEY (stream, start_time, width, shard)
   )"""
+  # The stream catalog lists the streams of the namespace in a single
+  # partition, so that listing them doesn't scan every partition of `idx`.
+  # Keyspaces created before the catalog existed get it when Kronos starts,
+  # filled with the streams in `idx`; the `CATALOG_FILLED_KEY` partition
+  # records that this is done.
+  CATALOG_CQL = """CREATE TABLE IF NOT EXISTS stream_catalog (
+    catalog text,
+    stream text,
+    PRIMARY KEY (catalog, stream)
+  )"""
+  CATALOG_KEY = 'streams'
+  # Keyspaces created before compact blobs existed get the column when Kronos
+  # starts.
+  ADD_COMPACT_BLOB_CQL = """ALTER TABLE stream ADD compact_blob blob"""
+  CHECK_COMPACT_BLOB_CQL = """SELECT compact_blob FROM stream LIMIT 1"""
+  CATALOG_FILLED_KEY = 'filled'
   STREAM_LIST_CQL = """SELECT DISTINCT stream FROM idx"""
+  # Range deletes are only supported by Cassandra 3.0 and later, so this
+  # statement is only prepared if it is used.
+  RANGE_DELETE_CQL = """DELETE FROM stream WHERE
+    key = ? AND
+    id > ? AND
+    id <= ?"""
 
   # Stream-level CQL statements.
   DELETE_STMT = """DELETE FROM stream WHERE
     key = ? AND
     id = ?"""
+  PARTITION_DELETE_STMT = """DELETE FROM stream WHERE
+    key = ?"""
   INSERT_STMT = """INSERT INTO stream (key, id, blob)
     VALUES (?, ?, ?)"""
+  COMPACT_INSERT_STMT = """INSERT INTO stream (key, id, compact_blob)
+    VALUES (?, ?, ?)"""
   INDEX_INSERT_STMT = """INSERT INTO idx (stream, start_time, width, shard)
     VALUES (?, ?, ?, ?)"""
   INDEX_SCAN_STMT = """SELECT start_time, width, shard FROM idx WHERE
     stream = ? AND
     start_time >= ? AND
     start_time < ?"""
+  CATALOG_INSERT_STMT = """INSERT INTO stream_catalog (catalog, stream)
+    VALUES (?, ?)"""
+  CATALOG_LIST_STMT = """SELECT stream FROM stream_catalog WHERE
+    catalog = ?"""
 
   # StreamShard-level CQL statements.
-  SELECT_ASC_STMT = """SELECT id, blob FROM stream WHERE
+  SELECT_ASC_STMT = """SELECT id, blob, compact_blob FROM stream WHERE
     key = ? AND
     id >= ? AND
     id <= ?
     ORDER BY id ASC
     LIMIT ?
     """
-  SELECT_DESC_STMT = """SELECT id, blob FROM stream WHERE
+  SELECT_DESC_STMT = """SELECT id, blob, compact_blob FROM stream WHERE
     key = ? AND
     id >= ? AND
     id <= ?
@@ -384,12 +1037,24 @@ class Namespace(object):
     LIMIT ?
     """
 
-  def __init__(self, cluster, name, replication_factor, read_size):
+  def __init__(self, cluster, name, replication_factor, read_size,
+               index_cache_ttl=0, stream_list_cache_ttl=0):
     self.cluster = cluster
     self.name = name
     self.replication_factor = replication_factor
     self.read_size = read_size
+    self.index_cache_ttl = index_cache_ttl
     self.session = None
+    self.range_delete_stmt = None
+
+    # Stream list cache: [expiry time, set of streams in the catalog]. Streams
+    # added to the catalog by this process are added to it as they are
+    # written.
+    self.stream_list_cache_ttl = stream_list_cache_ttl
+    self.stream_list = None
+
+    # Latencies of shard reads, to decide when to retry them speculatively.
+    self.read_latencies = LatencyTracker()
 
     # Create session.
     self.create_session()
@@ -397,21 +1062,42 @@ class Namespace(object):
     # Cache for Stream instances.
     self.stream_cache = InMemoryLRUCache(max_items=1000)
 
-  def get_stream(self, stream_name, width, shards):
+  def get_stream(self, stream_name, width, shards, max_events_per_shard=0,
+                 max_shards=0):
     # width and shard settings change requires a restart of kronosd, so we can
     # just cache on stream name.
     try:
       return self.stream_cache.get(stream_name)
     except KeyError:
-      stream = Stream(self, stream_name, width, shards, self.read_size)
+      stream = Stream(self, stream_name, width, shards, self.read_size,
+                      self.index_cache_ttl, max_events_per_shard, max_shards)
       self.stream_cache.set(stream_name, stream)
       return stream
 
-  def list_streams(self):
-    for stream in self.session.execute(
-      SimpleStatement(Namespace.STREAM_LIST_CQL,
-                      consistency_level=ConsistencyLevel.QUORUM)):
-      yield stream[0]
+  def get_range_delete_stmt(self):
+    if self.range_delete_stmt is None:
+      self.range_delete_stmt = self.session.prepare(Namespace.RANGE_DELETE_CQL)
+    return self.range_delete_stmt
+
+  def list_streams(self, consistency_level=ConsistencyLevel.QUORUM):
+    """
+    Return the sorted list of streams in the stream catalog, from the stream
+    list cache if possible.
+    """
+    if (self.stream_list_cache_ttl and self.stream_list is not None and
+        self.stream_list[0] > time.time()):
+      return sorted(self.stream_list[1])
+    catalog_list_stmt = BoundStatement(self.CATALOG_LIST_STMT,
+                                       consistency_level=consistency_level)
+    streams = set(row[0] for row in self.session.execute(
+      catalog_list_stmt.bind((Namespace.CATALOG_KEY, ))))
+    if self.stream_list_cache_ttl:
+      self.stream_list = [time.time() + self.stream_list_cache_ttl, streams]
+    return sorted(streams)
+
+  def add_to_stream_list(self, stream):
+    if self.stream_list is not None:
+      self.stream_list[1].add(stream)
 
   def create_session(self):
     if self.session:
@@ -432,8 +1118,14 @@ class Namespace(object):
       # Create column families + indices.
       session.execute(Namespace.STREAM_CQL)
       session.execute(Namespace.INDEX_CQL)
+      session.execute(Namespace.CATALOG_CQL)
 
     self.session = session
+    keyspace_metadata = self.cluster.metadata.keyspaces[self.name]
+    if 'stream_catalog' not in keyspace_metadata.tables:
+      session.execute(Namespace.CATALOG_CQL)
+    if 'compact_blob' not in keyspace_metadata.tables['stream'].columns:
+      self.add_compact_blob_column()
 
     # Prepare statements for this session.
     for attr, value in Namespace.__dict__.iteritems():
@@ -441,11 +1133,47 @@ class Namespace(object):
         continue
       setattr(self, attr, self.session.prepare(value))
 
+    self.fill_catalog()
+
+  def add_compact_blob_column(self):
+    """
+    Add the `compact_blob` column to the `stream` table. kronosd processes
+    starting at the same time race to add it, and the losers' ALTER fails,
+    which is fine as long as the column exists.
+    """
+    try:
+      self.session.execute(Namespace.ADD_COMPACT_BLOB_CQL)
+    except cassandra.InvalidRequest:
+      # Raises InvalidRequest again if the column still doesn't exist.
+      self.session.execute(Namespace.CHECK_COMPACT_BLOB_CQL)
+
+  def fill_catalog(self):
+    """
+    Add the streams in the index to the stream catalog, unless that was
+    already done. This scans the whole index once per keyspace. Processes
+    that start at the same time may all fill the catalog, which only repeats
+    idempotent writes.
+    """
+    if list(self.session.execute(self.CATALOG_LIST_STMT.bind(
+        (Namespace.CATALOG_FILLED_KEY, )))):
+      return
+    for row in self.session.execute(
+      SimpleStatement(Namespace.STREAM_LIST_CQL,
+                      consistency_level=ConsistencyLevel.QUORUM)):
+      self.session.execute(self.CATALOG_INSERT_STMT.bind(
+        (Namespace.CATALOG_KEY, row[0])))
+    self.session.execute(self.CATALOG_INSERT_STMT.bind(
+      (Namespace.CATALOG_FILLED_KEY, '')))
+
   def destroy_session(self):
     self.session.shutdown()
     self.session = None
+    self.range_delete_stmt = None
 
   def drop(self):
+    # Cached streams remember which buckets exist, which they no longer do.
+    self.stream_cache.clear()
+    self.stream_list = None
     self.session.execute(Namespace.DROP_KEYSPACE_CQL % self.name)
     # Session should automatically expire if keyspace dropped.
     self.destroy_session()
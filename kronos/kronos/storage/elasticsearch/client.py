@@ -1,10 +1,16 @@
 import atexit
+import bisect
 import gevent
+import logging
+import math
 import os
+import sys
+import time
 import weakref
 
 from calendar import monthrange
 from collections import defaultdict
+from collections import deque
 from datetime import datetime
 from dateutil.tz import tzutc
 from elasticsearch import Elasticsearch
@@ -15,22 +21,134 @@ from timeuuid import UUIDType
 
 from kronos.common.cache import InMemoryLRUCache
 from kronos.common.time import kronos_time_to_datetime
+from kronos.conf.constants import AggregateOp
 from kronos.conf.constants import ID_FIELD, TIMESTAMP_FIELD
 from kronos.conf.constants import ResultOrder
 from kronos.core import marshal; json = marshal.get_marshaler('json')
+from kronos.core.errors import InsertFailure
 from kronos.storage.base import BaseStorage
+from kronos.storage.base import filter_events
+from kronos.utils.aggregate import make_bucket
+from kronos.utils.filter import get_condition_properties
 from kronos.utils.uuid import uuid_from_kronos_time
 from kronos.utils.uuid import uuid_to_kronos_time
 from kronos.utils.validate import is_bool
 from kronos.utils.validate import is_int
 from kronos.utils.validate import is_list
 from kronos.utils.validate import is_non_empty_str
+from kronos.utils.validate import is_non_neg_int
 from kronos.utils.validate import is_pos_int
 
+log = logging.getLogger(__name__)
 
 INDEX_TEMPLATE = 'index.template'
 INDEX_PATTERN = '%Y.%m.%d'  # YYYY.MM.DD for Kibana.
 LOGSTASH_TIMESTAMP_FIELD = '@timestamp'
+# Field types that ElasticSearch aggregations treat the same way kronosd does.
+# Strings are analyzed (so grouping by them would group by token) and other
+# types have their own quirks, so aggregates over them are computed by kronosd.
+NUMERIC_FIELD_TYPES = frozenset({'long', 'integer', 'short', 'byte', 'double',
+                                 'float'})
+KRONOS_TIME_UNITS_PER_MS = 10000
+# Documents ElasticSearch rejects because its bulk queue is full are retried
+# after this many seconds, doubling for each retry.
+BULK_RETRY_BACKOFF_SECONDS = 0.5
+
+
+def _is_number(value):
+  return (isinstance(value, (int, long, float)) and
+          not isinstance(value, bool))
+
+
+def _condition_to_filter(condition, numeric_fields):
+  """
+  Translate `condition` into an ElasticSearch filter that matches at least the
+  events that satisfy it, or None if there is no such filter worth using. Only
+  comparisons of properties in `numeric_fields` (mapped to numbers in every
+  index) with numeric constants are translated, since strings are analyzed.
+  Events missing the property match `lt` and `lte` comparisons in kronosd
+  (None sorts first), so those filters also match missing fields.
+  """
+  if condition.get('negate'):
+    return None
+  if condition.get('type') == 'and':
+    filters = [_condition_to_filter(child, numeric_fields)
+               for child in condition['conditions']]
+    filters = [es_filter for es_filter in filters if es_filter is not None]
+    if not filters:
+      return None
+    return {'bool': {'must': filters}}
+  if condition.get('type') == 'or':
+    filters = [_condition_to_filter(child, numeric_fields)
+               for child in condition['conditions']]
+    if None in filters:
+      return None
+    return {'bool': {'should': filters}}
+
+  op, left, right = condition['op'], condition['left'], condition['right']
+  if (left['type'] != 'property' or right['type'] != 'constant' or
+      left['name'] not in numeric_fields):
+    return None
+  field, value = left['name'], right['value']
+  if op in ('lt', 'lte', 'gt', 'gte') and _is_number(value):
+    es_filter = {'range': {field: {op: value}}}
+  elif op == 'eq' and _is_number(value):
+    es_filter = {'term': {field: value}}
+  elif (op == 'in' and isinstance(value, list) and value and
+        all(_is_number(v) for v in value)):
+    es_filter = {'terms': {field: value}}
+  else:
+    return None
+  if op in ('lt', 'lte') or left.get('default') is not None:
+    es_filter = {'bool': {'should': [es_filter,
+                                     {'missing': {'field': field}}]}}
+  return es_filter
+
+
+def _after_sort_values_filter(sort_values, descending):
+  """
+  Return a filter that matches the events that come after the event with
+  `sort_values` (the `sort` of its search hit) when sorting by time and then
+  id, so that each page of a search can start where the previous one ended
+  without keeping a scroll context open. ElasticSearch 5's `search_after`
+  does the same.
+  """
+  sort_time, _id = sort_values
+  op = 'lt' if descending else 'gt'
+  return {
+    'bool': {
+      'should': [
+        {'range': {TIMESTAMP_FIELD: {op: sort_time}}},
+        {
+          'bool': {
+            'must': [
+              {'term': {TIMESTAMP_FIELD: sort_time}},
+              {'range': {ID_FIELD: {op: _id}}}
+            ]
+          }
+        }
+      ]
+    }
+  }
+
+
+def _chunk_bulk_lines(line_pairs, max_bytes):
+  """
+  Yield lists of the (action, source) JSON line pairs of `line_pairs` that add
+  up to at most `max_bytes`, or a single pair if it is bigger than that.
+  """
+  chunk = []
+  chunk_bytes = 0
+  for action, source in line_pairs:
+    size = len(action) + len(source) + 2  # Newlines.
+    if chunk and chunk_bytes + size > max_bytes:
+      yield chunk
+      chunk = []
+      chunk_bytes = 0
+    chunk.append((action, source))
+    chunk_bytes += size
+  if chunk:
+    yield chunk
 
 
 def _round_datetime_down(dt):
@@ -63,14 +181,30 @@ class IndexManager(object):
     self.es = storage.es
     self.index_prefix = storage.index_prefix
     self.rollover_size = storage.rollover_size
+    self.rollover_size_bytes = storage.rollover_size_bytes
+    self.rollover_max_age_seconds = storage.rollover_max_age_seconds
     self.rollover_check_period_seconds = storage.rollover_check_period_seconds
+    self.use_alias_catalog = storage.alias_catalog
     self.namespaces = storage.namespaces
+    # Maps each namespace to [index, directory version, index creation time].
     self.namespace_to_metadata = {}
+    # Maps each namespace to the size and age of its index as of the last
+    # rollover check, and the number of rollovers and their last reason.
+    self.rollover_stats = defaultdict(lambda: {'rollovers': 0,
+                                               'last_rollover_reason': None})
 
     # Alias cache is a write cache. It prevents us creating an alias for an
     # index if we've already created it in a previous operation.
     self.alias_cache = defaultdict(lambda: InMemoryLRUCache(max_items=1000))
 
+    # Alias catalog maps each namespace to the sorted list of its aliases, so
+    # that reads find the aliases of a time range without listing all aliases
+    # of the namespace. It is refreshed along with rollovers and updated as we
+    # add aliases, so aliases added by other Kronos processes are only seen
+    # after up to `rollover_check_period_seconds`, and till then reads miss
+    # the events behind them. It is only used if `use_alias_catalog` is set.
+    self.alias_catalog = {}
+
     self.update()
 
     self.rollover_worker = gevent.spawn(self.update_periodic)
@@ -88,25 +222,44 @@ class IndexManager(object):
       except gevent.GreenletExit:
         return
 
+  def get_rollover_reason(self, num_docs, size_bytes, age_seconds):
+    """
+    Return why an index with `num_docs` documents taking up `size_bytes` on
+    its primary shards and created `age_seconds` ago (None if unknown) should
+    be rolled over, or None if it shouldn't.
+    """
+    if self.rollover_size_bytes and size_bytes >= self.rollover_size_bytes:
+      return 'size'
+    if self.rollover_size and num_docs >= self.rollover_size:
+      return 'count'
+    if (self.rollover_max_age_seconds and age_seconds is not None and
+        num_docs and age_seconds >= self.rollover_max_age_seconds):
+      return 'age'
+    return None
+
   def update(self):
     def rollover_index(namespace, version):
       rand = os.urandom(6).encode('hex')
+      created_at = time.time()
       try:
         doc = self.es.index('%s:directory' % self.index_prefix,
                             'idx',
-                            {'rand': rand},
+                            {'rand': rand, 'created_at': created_at},
                             id=namespace,
                             version=version,
                             refresh=True)
       except TransportError, e:
         if e.status_code != 409:  # VersionConflictEngineException?
           raise
+        # Another Kronos instance rolled the index over first.
         doc = self.es.get('%s:directory' % self.index_prefix,
                           namespace,
                           doc_type='idx')
+        rand = doc['_source']['rand']
+        created_at = doc['_source'].get('created_at')
 
       self.alias_cache[namespace].clear()
-      return rand, doc['_version']
+      return [self.get_alias(namespace, rand), doc['_version'], created_at]
 
     docs = self.es.mget({'ids': list(self.namespaces)},
                         index='%s:directory' % self.index_prefix,
@@ -114,23 +267,56 @@ class IndexManager(object):
     for doc in docs['docs']:
       namespace = doc['_id']
       if not doc.get('found'):
-        rand, version = rollover_index(namespace, 0)
+        self.namespace_to_metadata[namespace] = rollover_index(namespace, 0)
       else:
-        rand, version = doc['_source']['rand'], doc['_version']
-      self.namespace_to_metadata[namespace] = [self.get_alias(namespace,
-                                                              rand),
-                                               version]
-
+        self.namespace_to_metadata[namespace] = [
+          self.get_alias(namespace, doc['_source']['rand']),
+          doc['_version'],
+          doc['_source'].get('created_at')]
+
+    # Fetch the size of all indices being written to at once.
+    stats = self.es.indices.stats(index=[metadata[0] for metadata in
+                                         self.namespace_to_metadata.values()],
+                                  metric='docs,store',
+                                  ignore=404,
+                                  allow_no_indices=True,
+                                  ignore_unavailable=True)
+    now = time.time()
+    for namespace in self.namespaces:
+      index, version, created_at = self.namespace_to_metadata[namespace]
+      primaries = stats.get('indices', {}).get(index, {}).get('primaries', {})
+      num_docs = primaries.get('docs', {}).get('count', 0)
+      size_bytes = primaries.get('store', {}).get('size_in_bytes', 0)
+      age_seconds = None if created_at is None else now - created_at
+      rollover_stats = self.rollover_stats[namespace]
+      rollover_stats.update({'index': index,
+                             'docs': num_docs,
+                             'primary_store_bytes': size_bytes,
+                             'age_seconds': age_seconds})
+      reason = self.get_rollover_reason(num_docs, size_bytes, age_seconds)
+      if reason is None:
+        continue
+      log.info('Rolling over index %s of namespace %s (%s): %d documents, '
+               '%d bytes, %s seconds old.', index, namespace, reason,
+               num_docs, size_bytes, age_seconds)
+      self.namespace_to_metadata[namespace] = rollover_index(namespace,
+                                                             version)
+      rollover_stats['rollovers'] += 1
+      rollover_stats['last_rollover_reason'] = reason
+
+    if self.use_alias_catalog:
+      self.refresh_alias_catalog()
+
+  def refresh_alias_catalog(self):
     for namespace in self.namespaces:
-      index, version = self.namespace_to_metadata[namespace]
-      # TODO(usmanm): Change count to actual disk size.
-      count = self.es.count(index=index,
-                            ignore_unavailable=True).get('count', 0)
-      if count >= self.rollover_size:
-        rand, version = rollover_index(namespace, version)
-        self.namespace_to_metadata[namespace] = [self.get_alias(namespace,
-                                                                rand),
-                                                 version]
+      aliases = set()
+      for value in self.es.indices.get_aliases(
+        index=self.get_alias(namespace, '*')).itervalues():
+        aliases.update(value['aliases'])
+      # Kronos never removes aliases, so keep the ones we added while waiting
+      # for ElasticSearch.
+      aliases.update(self.alias_catalog.get(namespace, ()))
+      self.alias_catalog[namespace] = sorted(aliases)
 
   def get_all_indices(self):
     return [index
@@ -158,6 +344,14 @@ class IndexManager(object):
                                     [{'add': {'index': index, 'alias': alias}}
                                      for alias in aliases_to_add]})
 
+    if not self.use_alias_catalog:
+      return
+    catalog = self.alias_catalog.setdefault(namespace, [])
+    for alias in aliases_to_add:
+      i = bisect.bisect_left(catalog, alias)
+      if i == len(catalog) or catalog[i] != alias:
+        catalog.insert(i, alias)
+
   def get_alias(self, namespace, dt):
     if isinstance(dt, datetime):
       dt = dt.strftime(INDEX_PATTERN)
@@ -170,13 +364,18 @@ class IndexManager(object):
     end_alias = self.get_alias(namespace,
                                kronos_time_to_datetime(end_time))
 
-    aliases = set()
+    if not self.use_alias_catalog:
+      aliases = set()
+      for value in self.es.indices.get_aliases(
+        index=self.get_alias(namespace, '*')).itervalues():
+        aliases.update(value['aliases'])
+      return sorted(alias for alias in aliases
+                    if start_alias <= alias <= end_alias)
 
-    for value in self.es.indices.get_aliases(
-      index=self.get_alias(namespace, '*')).itervalues():
-      aliases.update(value['aliases'])
-
-    return filter(lambda a: a >= start_alias and a <= end_alias, aliases)
+    # Aliases of the same namespace sort by date.
+    catalog = self.alias_catalog.get(namespace, [])
+    return catalog[bisect.bisect_left(catalog, start_alias):
+                   bisect.bisect_right(catalog, end_alias)]
 
 
 class ElasticSearchStorage(BaseStorage):
@@ -186,10 +385,27 @@ class ElasticSearchStorage(BaseStorage):
     'index_template': is_non_empty_str,
     'index_prefix': is_non_empty_str,
     'replicas': is_int,
-    'rollover_size': is_pos_int,
+    'rollover_size': is_non_neg_int,
+    'rollover_size_bytes': is_non_neg_int,
+    'rollover_max_age_seconds': is_non_neg_int,
     'rollover_check_period_seconds': is_pos_int,
     'read_size': is_pos_int,
     'shards': is_pos_int,
+    'pagination': lambda x: x in ('scroll', 'search_after'),
+    'bulk_chunk_bytes': is_pos_int,
+    'bulk_concurrency': is_pos_int,
+    'bulk_max_retries': is_non_neg_int,
+    'alias_catalog': is_bool,
+  }
+  SETTINGS_DEFAULTS = {
+    'pagination': 'search_after',
+    'rollover_size': 0,
+    'rollover_size_bytes': 10 * 1024 * 1024 * 1024,  # 10GB.
+    'rollover_max_age_seconds': 0,
+    'bulk_chunk_bytes': 5 * 1024 * 1024,  # 5MB.
+    'bulk_concurrency': 4,
+    'bulk_max_retries': 3,
+    'alias_catalog': False,
   }
 
   def __init__(self, name, namespaces, **settings):
@@ -228,21 +444,72 @@ class ElasticSearchStorage(BaseStorage):
     index = self.index_manager.get_index(namespace)
     start_dts_to_add = set()
 
-    def actions():
+    # Events are already serialized, so build each bulk action out of JSON
+    # fragments instead of serializing the events again: the action line is
+    # the same for all events, and `@timestamp` is spliced into the front of
+    # each serialized event (which is always a non-empty object).
+    action = json.dumps({'index': {'_index': index, '_type': stream}})
+
+    def line_pairs():
       for _id, event in events:
         dt = kronos_time_to_datetime(uuid_to_kronos_time(_id))
         start_dts_to_add.add(_round_datetime_down(dt))
-        event['_index'] = index
-        event['_type'] = stream
-        event[LOGSTASH_TIMESTAMP_FIELD] = dt.isoformat()
-
-        yield event
+        yield action, '{"%s": "%s", %s' % (LOGSTASH_TIMESTAMP_FIELD,
+                                           dt.isoformat(),
+                                           event.json[1:])
+
+    # Send up to `bulk_concurrency` chunks at a time. Their greenlets are
+    # spawned directly rather than with `execute_greenlet_async`: inserts
+    # already run in its bounded pool, and waiting on requests queued behind
+    # them could deadlock it.
+    errors = []
+    in_flight = deque()
+    for chunk in _chunk_bulk_lines(line_pairs(), self.bulk_chunk_bytes):
+      if len(in_flight) >= self.bulk_concurrency:
+        errors.extend(in_flight.popleft().get())
+      in_flight.append(gevent.spawn(self._bulk_index, chunk))
+    while in_flight:
+      errors.extend(in_flight.popleft().get())
 
-    list(es_helpers.streaming_bulk(self.es, actions(), chunk_size=1000,
-                                   refresh=self.force_refresh))
     self.index_manager.add_aliases(namespace,
                                    index,
                                    start_dts_to_add)
+    if errors:
+      raise InsertFailure(errors)
+
+  def _bulk_index(self, chunk):
+    """
+    Index `chunk`, a list of (action, source) JSON line pairs, with a bulk
+    request. Documents that ElasticSearch rejects because its bulk queue is
+    full (status 429) are sent again after a backoff, up to `bulk_max_retries`
+    times; other failures aren't retried. Returns a description of each
+    document that couldn't be indexed.
+    """
+    errors = []
+    for retry in xrange(self.bulk_max_retries + 1):
+      if retry:
+        gevent.sleep(BULK_RETRY_BACKOFF_SECONDS * 2 ** (retry - 1))
+      try:
+        res = self.es.bulk(''.join('%s\n%s\n' % pair for pair in chunk),
+                           refresh=self.force_refresh)
+      except TransportError, e:
+        if e.status_code == 429:
+          continue
+        return errors + ['Bulk request of %d events failed: %r' %
+                         (len(chunk), e)]
+      rejected = []
+      for pair, item in zip(chunk, res['items']):
+        result = item.values()[0]
+        status = result.get('status', 500)
+        if status == 429:
+          rejected.append(pair)
+        elif not 200 <= status < 300:
+          errors.append('Failed to index event: %s' % result.get('error'))
+      if not rejected:
+        return errors
+      chunk = rejected
+    return errors + ['Failed to index event: rejected by ElasticSearch %d '
+                     'times' % (self.bulk_max_retries + 1)] * len(chunk)
 
   def _delete(self, namespace, stream, start_id, end_time, configuration):
     """
@@ -291,10 +558,15 @@ class ElasticSearchStorage(BaseStorage):
       return 0, [repr(e)]
 
   def _retrieve(self, namespace, stream, start_id, end_time, order, limit,
-                configuration):
+                configuration, es_filter=None, source=True):
     """
     Yield events from stream starting after the event with id `start_id` until
-    and including events with timestamp `end_time`.
+    and including events with timestamp `end_time`. Only events matching
+    `es_filter`, if given, are returned. `source` is either True or the list
+    of fields to fetch from each event. Pages are fetched with a scroll or,
+    if the `pagination` setting is `search_after`, with searches that each
+    start after the last event of the previous page (see
+    `_after_sort_values_filter`).
     """
     indices = self.index_manager.get_aliases(namespace,
                                              uuid_to_kronos_time(start_id),
@@ -307,13 +579,16 @@ class ElasticSearchStorage(BaseStorage):
       order == ResultOrder.DESCENDING)
 
     start_time = uuid_to_kronos_time(start_id)
+    time_filter = {
+      'range': {TIMESTAMP_FIELD: {'gte': start_time, 'lte': end_time}}
+    }
+    if es_filter is not None:
+      time_filter = {'bool': {'must': [time_filter, es_filter]}}
     body_query = {
       'query': {
         'filtered': {
           'query': {'match_all': {}},
-          'filter': {
-            'range': {TIMESTAMP_FIELD: {'gte': start_time, 'lte': end_time}}
-          }
+          'filter': time_filter
         }
       }
     }
@@ -322,27 +597,51 @@ class ElasticSearchStorage(BaseStorage):
       '%s:%s' % (TIMESTAMP_FIELD, order),
       '%s:%s' % (ID_FIELD, order)
     ]
+    if source is True:
+      source_params = {'_source_exclude': LOGSTASH_TIMESTAMP_FIELD}
+    else:
+      source_params = {'_source': source}
 
     last_id = end_id if descending else start_id
     scroll_id = None
+    last_sort_values = None
     while True:
-      size = max(min(limit, configuration['read_size']) / self.shards, 10)
-      if scroll_id is None:
+      if configuration['pagination'] == 'search_after':
+        # Fetch no more events than we still need.
+        size = min(limit, configuration['read_size'])
+        if last_sort_values is not None:
+          body_query['query']['filtered']['filter'] = {
+            'bool': {'must': [time_filter,
+                              _after_sort_values_filter(last_sort_values,
+                                                        descending)]}
+          }
         res = self.es.search(index=indices,
                              doc_type=stream,
                              size=size,
                              body=body_query,
                              sort=sort_query,
-                             _source=True,
-                             scroll='1m',
                              ignore=[400, 404],
                              allow_no_indices=True,
-                             ignore_unavailable=True)
+                             ignore_unavailable=True,
+                             **source_params)
       else:
-        res = self.es.scroll(scroll_id, scroll='1m')
-      if '_scroll_id' not in res:
-        break
-      scroll_id = res['_scroll_id']
+        size = max(min(limit, configuration['read_size']) / self.shards, 10)
+        if scroll_id is None:
+          res = self.es.search(index=indices,
+                               doc_type=stream,
+                               size=size,
+                               body=body_query,
+                               sort=sort_query,
+                               scroll='1m',
+                               ignore=[400, 404],
+                               allow_no_indices=True,
+                               ignore_unavailable=True,
+                               **source_params)
+        else:
+          res = self.es.scroll(scroll_id, scroll='1m')
+        if '_scroll_id' not in res:
+          break
+        scroll_id = res['_scroll_id']
       hits = res.get('hits', {}).get('hits')
       if not hits:
         break
@@ -353,15 +652,212 @@ class ElasticSearchStorage(BaseStorage):
           continue
         last_id = _id
         event = hit['_source']
-        del event[LOGSTASH_TIMESTAMP_FIELD]
-        yield json.dumps(event)
+        event.pop(LOGSTASH_TIMESTAMP_FIELD, None)
+        yield _id, json.dumps(event)
         limit -= 1
         if limit == 0:
           break
 
+      if limit <= 0:
+        break
+      if configuration['pagination'] == 'search_after':
+        if len(hits) < size:
+          break
+        last_sort_values = hits[-1]['sort']
+
     if scroll_id is not None:
       self.es.clear_scroll(scroll_id)
 
+  def _retrieve_filtered(self, namespace, stream, start_id, end_time, order,
+                         limit, configuration, condition, properties):
+    """
+    Push filters and projections down to ElasticSearch where possible (see
+    `_condition_to_filter`), and only fetch the properties needed to check
+    `condition` and project events. ElasticSearch filters can match more
+    events than `condition`, so events are still checked here.
+    """
+    es_filter = None
+    fields = set()
+    if condition:
+      fields = get_condition_properties(condition)
+      indices = self.index_manager.get_aliases(namespace,
+                                               uuid_to_kronos_time(start_id),
+                                               end_time)
+      if indices:
+        field_types = self._get_field_types(indices, stream, fields)
+        es_filter = _condition_to_filter(
+          condition,
+          {field for field, types in field_types.iteritems()
+           if types <= NUMERIC_FIELD_TYPES})
+    source = True
+    if properties:
+      source = sorted(fields.union(properties))
+    events = self._retrieve(namespace, stream, start_id, end_time, order,
+                            sys.maxint if condition else limit, configuration,
+                            es_filter=es_filter, source=source)
+    return filter_events(events, condition, properties, limit)
+
+  def _count(self, namespace, stream, start_id, end_time, limit,
+             configuration):
+    """
+    Count events with ElasticSearch's count API. Events at exactly the time of
+    `start_id` are scanned by id instead, since only those with ids greater
+    than `start_id` count.
+    """
+    start_time = uuid_to_kronos_time(start_id)
+    indices = self.index_manager.get_aliases(namespace, start_time, end_time)
+    if not indices:
+      return 0
+
+    def time_query(bounds):
+      return {
+        'query': {
+          'filtered': {
+            'query': {'match_all': {}},
+            'filter': {'range': {TIMESTAMP_FIELD: bounds}}
+          }
+        }
+      }
+
+    res = self.es.count(index=indices,
+                        doc_type=stream,
+                        body=time_query({'gt': start_time, 'lte': end_time}),
+                        ignore=[400, 404],
+                        allow_no_indices=True,
+                        ignore_unavailable=True)
+    count = res.get('count', 0)
+    hits = es_helpers.scan(self.es,
+                           query=time_query({'gte': start_time,
+                                             'lte': start_time}),
+                           index=indices,
+                           doc_type=stream,
+                           _source=False,
+                           allow_no_indices=True,
+                           ignore_unavailable=True)
+    count += sum(1 for hit in hits if TimeUUID(hit['_id']) > start_id)
+    return min(count, limit)
+
+  def _get_field_types(self, indices, stream, fields):
+    """
+    Return a dictionary mapping each of `fields` that is mapped in any of
+    `indices` to the set of types it is mapped to.
+    """
+    field_types = defaultdict(set)
+    if not fields:
+      return field_types
+    mappings = self.es.indices.get_field_mapping(field=','.join(fields),
+                                                 index=indices,
+                                                 doc_type=stream,
+                                                 allow_no_indices=True,
+                                                 ignore_unavailable=True)
+    for index_mappings in mappings.itervalues():
+      for type_mappings in index_mappings.get('mappings', {}).itervalues():
+        for field, field_mapping in type_mappings.iteritems():
+          for mapping in field_mapping.get('mapping', {}).itervalues():
+            field_types[field].add(mapping.get('type'))
+    return field_types
+
+  def _can_aggregate(self, indices, stream, bucket_width, group_by,
+                     aggregates):
+    """
+    Can the aggregate be computed by ElasticSearch and give the same result as
+    computing it in kronosd? Time buckets are computed on the millisecond
+    precision `@timestamp` field, and all properties involved must be mapped
+    to numbers in every index.
+    """
+    if bucket_width is not None and bucket_width % KRONOS_TIME_UNITS_PER_MS:
+      return False
+    fields = set(group_by)
+    fields.update(_property for _, _property, _ in aggregates if _property)
+    field_types = self._get_field_types(indices, stream, fields)
+    return all(types <= NUMERIC_FIELD_TYPES
+               for types in field_types.itervalues())
+
+  def _aggregate(self, namespace, stream, start_time, end_time, bucket_width,
+                 group_by, aggregates, configuration):
+    """
+    Push aggregates down to ElasticSearch aggregations where possible: a date
+    histogram for time buckets, nested terms aggregations for `group_by` and
+    metric aggregations for `aggregates`.
+    """
+    indices = self.index_manager.get_aliases(namespace, start_time, end_time)
+    if not indices:
+      return []
+    if not self._can_aggregate(indices, stream, bucket_width, group_by,
+                               aggregates):
+      return super(ElasticSearchStorage, self)._aggregate(
+        namespace, stream, start_time, end_time, bucket_width, group_by,
+        aggregates, configuration)
+
+    aggs = {}
+    for i, (op, _property, _) in enumerate(aggregates):
+      if _property is None:
+        continue  # Counts of all events are bucket document counts.
+      es_op = 'value_count' if op == AggregateOp.COUNT else op
+      aggs['m%d' % i] = {es_op: {'field': _property}}
+    for depth in xrange(len(group_by) - 1, -1, -1):
+      aggs = {'g%d' % depth: {'terms': {'field': group_by[depth], 'size': 0},
+                              'aggs': aggs}}
+    if bucket_width is not None:
+      interval = bucket_width / KRONOS_TIME_UNITS_PER_MS
+      aggs = {'time': {'date_histogram': {'field': LOGSTASH_TIMESTAMP_FIELD,
+                                          'interval': '%dms' % interval},
+                       'aggs': aggs}}
+    body_query = {
+      'query': {
+        'filtered': {
+          'query': {'match_all': {}},
+          'filter': {
+            'range': {TIMESTAMP_FIELD: {'gte': start_time, 'lte': end_time}}
+          }
+        }
+      },
+      'aggs': aggs
+    }
+    res = self.es.search(index=indices,
+                         doc_type=stream,
+                         body=body_query,
+                         search_type='count',
+                         ignore=[400, 404],
+                         allow_no_indices=True,
+                         ignore_unavailable=True)
+    if 'aggregations' not in res:
+      return []
+
+    buckets = []
+
+    def collect(result, time, group, doc_count):
+      depth = len(group)
+      if depth < len(group_by):
+        for bucket in result['g%d' % depth]['buckets']:
+          collect(bucket, time, group + (bucket['key'], ), bucket['doc_count'])
+        return
+      if not doc_count:
+        return
+      values = []
+      for i, (op, _property, _) in enumerate(aggregates):
+        if _property is None:
+          value = doc_count
+        else:
+          value = result['m%d' % i]['value']
+          if isinstance(value, float) and (math.isinf(value) or
+                                           math.isnan(value)):
+            value = None  # Min/max/avg of no values.
+          elif op == AggregateOp.COUNT:
+            value = int(value)
+        values.append(value)
+      buckets.append(make_bucket(time, group_by, group, aggregates, values))
+
+    if bucket_width is None:
+      collect(res['aggregations'], start_time, (), res['hits']['total'])
+    else:
+      for bucket in res['aggregations']['time']['buckets']:
+        collect(bucket, bucket['key'] * KRONOS_TIME_UNITS_PER_MS, (),
+                bucket['doc_count'])
+    buckets.sort(key=lambda bucket: (bucket[TIMESTAMP_FIELD],
+                                     tuple(bucket[name] for name in group_by)))
+    return buckets
+
   def _streams(self, namespace):
     index = self.index_manager.get_index(namespace)
     res = self.es.indices.get_mapping(index=index,
@@ -377,6 +873,8 @@ class ElasticSearchStorage(BaseStorage):
 
   def _clear(self):
     self.es.indices.delete(self.index_manager.get_all_indices())
+    self.index_manager.alias_cache.clear()
+    self.index_manager.alias_catalog.clear()
 
   def stop(self):
     self.index_manager.kill_rollover_worker()
@@ -3,22 +3,24 @@ import bisect
 from collections import defaultdict
 
 from kronos.conf.constants import ResultOrder
-from kronos.core import marshal
 from kronos.storage.base import BaseStorage
 from kronos.utils.uuid import uuid_from_kronos_time
 from kronos.utils.uuid import UUIDType
 from kronos.utils.validate import is_pos_int
 
 
-class Event(dict):
+class Event(object):
   """
-  An event is stored in memory as a dictionary.
+  An event is stored in memory as its JSON serialization, which is returned
+  as is when the event is retrieved.
   We define a comparator because events are sortable by the time in their
   UUIDs
   """
-  def __init__(self, _id, *args, **kwargs):
+  __slots__ = ('id', 'json')
+
+  def __init__(self, _id, event_json=None):
     self.id = _id
-    super(Event, self).__init__(*args, **kwargs)
+    self.json = event_json
 
   def __eq__(self, other):
     return self.__cmp__(other) == 0
@@ -56,27 +58,33 @@ class InMemoryStorage(BaseStorage):
     for _id, event in events:
       while len(self.db[namespace][stream]) >= max_items:
         self.db[namespace][stream].pop(0)
-      bisect.insort(self.db[namespace][stream], Event(_id, event))
+      bisect.insort(self.db[namespace][stream], Event(_id, event.json))
 
-  def _delete(self, namespace, stream, start_id, end_time, configuration):
+  def _get_interval(self, namespace, stream, start_id, end_time):
     """
-    Delete events with id > `start_id` and end_time <= `end_time`.
+    Return the sorted list of events of `stream` along with the bounds
+    (lo, hi) of the slice of events with id > `start_id` and timestamp
+    <= `end_time`.
     """
     start_id_event = Event(start_id)
     end_id_event = Event(uuid_from_kronos_time(end_time,
                                                _type=UUIDType.HIGHEST))
     stream_events = self.db[namespace][stream]
 
-    # Find the interval our events belong to.
     lo = bisect.bisect_left(stream_events, start_id_event)
-    if lo + 1 > len(stream_events):
-      return 0, []
-    if stream_events[lo] == start_id_event:
+    if lo < len(stream_events) and stream_events[lo] == start_id_event:
       lo += 1
-    hi = bisect.bisect_right(stream_events, end_id_event)
+    hi = max(lo, bisect.bisect_right(stream_events, end_id_event))
+    return stream_events, lo, hi
 
+  def _delete(self, namespace, stream, start_id, end_time, configuration):
+    """
+    Delete events with id > `start_id` and end_time <= `end_time`.
+    """
+    stream_events, lo, hi = self._get_interval(namespace, stream, start_id,
+                                               end_time)
     del stream_events[lo:hi]
-    return max(0, hi - lo), []
+    return hi - lo, []
 
   def _retrieve(self, namespace, stream, start_id, end_time, order, limit,
                 configuration):
@@ -84,19 +92,8 @@ class InMemoryStorage(BaseStorage):
     Yield events from stream starting after the event with id `start_id` until
     and including events with timestamp `end_time`.
     """
-    start_id_event = Event(start_id)
-    end_id_event = Event(uuid_from_kronos_time(end_time,
-                                               _type=UUIDType.HIGHEST))
-    stream_events = self.db[namespace][stream]
-
-    # Find the interval our events belong to.
-    lo = bisect.bisect_left(stream_events, start_id_event)
-    if lo + 1 > len(stream_events):
-      return
-    if stream_events[lo] == start_id_event:
-      lo += 1
-    hi = bisect.bisect_right(stream_events, end_id_event)
-
+    stream_events, lo, hi = self._get_interval(namespace, stream, start_id,
+                                               end_time)
     if order == ResultOrder.DESCENDING:
       index_it = xrange(hi - 1, lo - 1, -1)
     else:
@@ -106,7 +103,16 @@ class InMemoryStorage(BaseStorage):
       if limit <= 0:
         break
       limit -= 1
-      yield marshal.dumps(stream_events[i])
+      yield stream_events[i].id, stream_events[i].json
+
+  def _count(self, namespace, stream, start_id, end_time, limit,
+             configuration):
+    """
+    Count events from the bounds of their interval in the sorted list of events
+    of `stream`.
+    """
+    _, lo, hi = self._get_interval(namespace, stream, start_id, end_time)
+    return min(hi - lo, limit)
 
   def _streams(self, namespace):
     return self.db[namespace].iterkeys()
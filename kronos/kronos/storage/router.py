@@ -7,6 +7,7 @@ from kronos.common.settings import merge_dicts
 from kronos.conf import settings
 from kronos.core.errors import BackendMissing
 from kronos.core.errors import NamespaceMissing
+from kronos.core.validator import validate_storage_settings
 from kronos.core.validator import validate_stream
 
 
@@ -70,8 +71,10 @@ class StorageRouter(object):
         backends = options['backends']
         for backend_name, configuration in backends.iteritems():
           backend = self.get_backend(backend_name)
-          prefix_confs[prefix][backend] = merge_dicts(backend._settings,
-                                                      configuration or {})
+          configuration = merge_dicts(backend._settings, configuration or {})
+          # Catch invalid overrides now rather than when a request uses them.
+          validate_storage_settings(backend.__class__, configuration)
+          prefix_confs[prefix][backend] = configuration
 
   def get_namespaces(self):
     return self.namespaces
@@ -0,0 +1,172 @@
+"""
+Helpers to compute time-bucketed aggregates over events inside kronosd, so
+clients don't have to retrieve every event to count or sum them.
+"""
+import types
+
+from kronos.common.event_tools import get_property
+from kronos.conf.constants import AggregateOp
+from kronos.conf.constants import TIMESTAMP_FIELD
+
+
+def _is_number(value):
+  return (isinstance(value, (int, long, float)) and
+          not isinstance(value, bool))
+
+
+class Count(object):
+  def __init__(self):
+    self.value = 0
+
+  def update(self, value):
+    if value is not None:
+      self.value += 1
+
+  def aggregate(self):
+    return self.value
+
+
+class Sum(object):
+  def __init__(self):
+    self.value = 0
+
+  def update(self, value):
+    if _is_number(value):
+      self.value += value
+
+  def aggregate(self):
+    return self.value
+
+
+class Min(object):
+  def __init__(self):
+    self.value = None
+
+  def update(self, value):
+    if value is not None and (self.value is None or value < self.value):
+      self.value = value
+
+  def aggregate(self):
+    return self.value
+
+
+class Max(object):
+  def __init__(self):
+    self.value = None
+
+  def update(self, value):
+    if value is not None and (self.value is None or value > self.value):
+      self.value = value
+
+  def aggregate(self):
+    return self.value
+
+
+class Avg(object):
+  def __init__(self):
+    self.total = 0
+    self.count = 0
+
+  def update(self, value):
+    if _is_number(value):
+      self.total += value
+      self.count += 1
+
+  def aggregate(self):
+    if not self.count:
+      return None
+    return float(self.total) / self.count
+
+
+AGGREGATORS = {
+  AggregateOp.COUNT: Count,
+  AggregateOp.SUM: Sum,
+  AggregateOp.MIN: Min,
+  AggregateOp.MAX: Max,
+  AggregateOp.AVG: Avg
+}
+
+
+def parse_aggregates(aggregates):
+  """
+  Validate the `aggregates` of an aggregate request, a list of dictionaries of
+  the form {op: op_name, property: property_name, alias: alias}. `property` is
+  optional for counts, in which case all events are counted. `alias` defaults
+  to the op name followed by the property name. Returns a list of
+  (op, property, alias) tuples. Raises ValueError if `aggregates` is invalid.
+  """
+  if not isinstance(aggregates, list) or not aggregates:
+    raise ValueError('`aggregates` must be a non-empty list.')
+  parsed = []
+  for aggregate in aggregates:
+    if not isinstance(aggregate, dict):
+      raise ValueError('Each aggregate must be a dictionary.')
+    op = aggregate.get('op')
+    if op not in AGGREGATORS:
+      raise ValueError('Invalid aggregate op: %s.' % op)
+    _property = aggregate.get('property')
+    if _property is None and op != AggregateOp.COUNT:
+      raise ValueError('The `%s` aggregate requires a property.' % op)
+    if _property is not None and not isinstance(_property,
+                                                types.StringTypes):
+      raise ValueError('Aggregate properties must be strings.')
+    alias = aggregate.get('alias')
+    if alias is None:
+      alias = op if _property is None else '%s_%s' % (op, _property)
+    parsed.append((op, _property, alias))
+  return parsed
+
+
+def make_bucket(time, group_by, group, aggregates, values):
+  """
+  Return a bucket in the format returned by the aggregate endpoint: a
+  dictionary mapping `TIMESTAMP_FIELD` to the start time of the bucket, each
+  `group_by` property to its value and each aggregate's alias to its value.
+  """
+  bucket = {TIMESTAMP_FIELD: time}
+  bucket.update(zip(group_by, group))
+  bucket.update(zip((alias for _, _, alias in aggregates), values))
+  return bucket
+
+
+def aggregate_events(events, start_time, bucket_width, group_by, aggregates):
+  """
+  Compute `aggregates` (as returned by `parse_aggregates`) over `events`, a
+  sequence of event dictionaries. Events are grouped into time buckets of
+  width `bucket_width` aligned to multiples of `bucket_width`, or into a single
+  bucket starting at `start_time` if `bucket_width` is None, and then by the
+  values of the properties in `group_by`. Events that don't have a scalar
+  value for all `group_by` properties are skipped. Returns a list of buckets
+  (see `make_bucket`) ordered by time and group.
+  """
+  buckets = {}
+  for event in events:
+    time = event[TIMESTAMP_FIELD]
+    if bucket_width is None:
+      time = start_time
+    else:
+      time -= time % bucket_width
+    try:
+      group = tuple(get_property(event, name) for name in group_by)
+      key = (time, group)
+      aggregators = buckets.get(key)
+    except (KeyError, TypeError):
+      continue
+    if aggregators is None:
+      aggregators = buckets[key] = [AGGREGATORS[op]()
+                                    for op, _, _ in aggregates]
+    for aggregator, (op, _property, _) in zip(aggregators, aggregates):
+      if _property is None:
+        aggregator.update(True)
+        continue
+      try:
+        aggregator.update(get_property(event, _property))
+      except KeyError:
+        pass
+
+  result = []
+  for (time, group), aggregators in sorted(buckets.iteritems()):
+    result.append(make_bucket(time, group_by, group, aggregates,
+                              [aggregator.aggregate()
+                               for aggregator in aggregators]))
+  return result
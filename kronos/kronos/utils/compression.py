@@ -0,0 +1,141 @@
+"""
+Helpers to compress HTTP response bodies as they are streamed to clients and
+to decompress request bodies as they are read.
+"""
+import zlib
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# Maps content codings we can produce to the `wbits` argument zlib needs to
+# produce them. The `deflate` content coding is a zlib stream (RFC 2616).
+_ENCODING_WBITS = {
+  'gzip': 16 + zlib.MAX_WBITS,
+  'deflate': zlib.MAX_WBITS
+}
+
+
+def get_response_encoding(accept_encoding):
+  """
+  Return the content coding (`gzip` or `deflate`) to use for a response given
+  the request's `Accept-Encoding` header, or None if the client accepts
+  neither. gzip is preferred when both are accepted.
+  """
+  accepted = set()
+  refused = set()
+  for coding in (accept_encoding or '').split(','):
+    coding, _, params = coding.partition(';')
+    coding = coding.strip().lower()
+    params = params.replace(' ', '')
+    if params.startswith('q='):
+      try:
+        if float(params[2:]) == 0:
+          refused.add(coding)
+          continue
+      except ValueError:
+        continue
+    accepted.add(coding)
+  for encoding in ('gzip', 'deflate'):
+    if encoding in accepted or ('*' in accepted and encoding not in refused):
+      return encoding
+  return None
+
+
+class StreamCompressor(object):
+  """
+  Compresses a response body that is yielded in pieces. Each call to
+  `compress` returns everything compressed so far, so the client can decode
+  each piece as soon as it arrives instead of waiting for the whole body.
+  """
+
+  def __init__(self, encoding, level):
+    self.compressobj = zlib.compressobj(level, zlib.DEFLATED,
+                                        _ENCODING_WBITS[encoding])
+
+  def compress(self, data):
+    return (self.compressobj.compress(data) +
+            self.compressobj.flush(zlib.Z_SYNC_FLUSH))
+
+  def finish(self):
+    return self.compressobj.flush()
+
+
+def get_decompressing_reader(stream, encoding, read_size):
+  """
+  Return a file-like object that decompresses the file-like `stream` of data
+  compressed with the `Content-Encoding` header `encoding`, or None if it isn't
+  supported. zstd is only supported if the zstandard package is installed.
+  """
+  encoding = encoding.strip().lower()
+  if encoding in _ENCODING_WBITS:
+    return DecompressingReader(
+      stream, zlib.decompressobj(_ENCODING_WBITS[encoding]), read_size)
+  if encoding == 'zstd' and zstandard is not None:
+    return ZstdDecompressingReader(stream, read_size)
+  return None
+
+
+class DecompressingReader(object):
+  """
+  Wraps the file-like `stream` of compressed data, decompressing it `read_size`
+  bytes at a time as it is read. At most `read_size` bytes (or as many as the
+  caller asked for) are inflated at once, so a small body that expands to
+  gigabytes can't exhaust memory. Raises ValueError if the data is corrupt.
+  """
+
+  def __init__(self, stream, decompressobj, read_size):
+    self.stream = stream
+    self.decompressobj = decompressobj
+    self.read_size = read_size
+    self.buffer = ''
+    self.eof = False
+
+  def read(self, size=-1):
+    while not self.eof and (size < 0 or len(self.buffer) < size):
+      max_length = self.read_size
+      if size >= 0:
+        max_length = min(max_length, size - len(self.buffer))
+      # Input that didn't fit in the last `max_length` is inflated before any
+      # more is read.
+      data = (self.decompressobj.unconsumed_tail or
+              self.stream.read(self.read_size))
+      try:
+        if data:
+          self.buffer += self.decompressobj.decompress(data, max_length)
+        else:
+          self.buffer += self.decompressobj.flush()
+          self.eof = True
+      except zlib.error, e:
+        raise ValueError('Could not decompress request body: %s' % e)
+    if size < 0:
+      size = len(self.buffer)
+    data = self.buffer[:size]
+    self.buffer = self.buffer[size:]
+    return data
+
+
+class ZstdDecompressingReader(object):
+  """
+  Like `DecompressingReader`, for zstd. zstandard's `decompressobj` can't limit
+  how much it inflates, so this reads through its `stream_reader` instead.
+  """
+
+  def __init__(self, stream, read_size):
+    self.reader = zstandard.ZstdDecompressor().stream_reader(
+      stream, read_size=read_size).__enter__()
+    self.read_size = read_size
+
+  def read(self, size=-1):
+    try:
+      if size >= 0:
+        return self.reader.read(size)
+      chunks = []
+      chunk = self.reader.read(self.read_size)
+      while chunk:
+        chunks.append(chunk)
+        chunk = self.reader.read(self.read_size)
+      return ''.join(chunks)
+    except zstandard.ZstdError, e:
+      raise ValueError('Could not decompress request body: %s' % e)
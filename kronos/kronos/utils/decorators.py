@@ -11,6 +11,7 @@ from kronos.conf.constants import ServingMode
 from kronos.conf.constants import SUCCESS_FIELD
 from kronos.conf.constants import TOOK_FIELD
 from kronos.core import marshal
+from kronos.utils.compression import get_decompressing_reader
 
 log = logging.getLogger(__name__)
 
@@ -20,11 +21,16 @@ ENDPOINTS = {}
 # Which endpoints should we allow access to inside the endpoint
 # decorator below for the various serving modes?
 _serving_mode_endpoints = {
-  ServingMode.ALL: frozenset({'index', 'put_events', 'get_events',
-                              'delete_events', 'get_streams', 'infer_schema'}),
-  ServingMode.READONLY: frozenset({'index', 'get_events', 'get_streams',
-                                   'infer_schema'}),
-  ServingMode.COLLECTOR: frozenset({'index', 'put_events'}),
+  ServingMode.ALL: frozenset({'index', 'put_events', 'put_ndjson_events',
+                              'get_events', 'get_multi_events',
+                              'count_events', 'aggregate_events',
+                              'delete_events', 'get_streams',
+                              'infer_schema'}),
+  ServingMode.READONLY: frozenset({'index', 'get_events', 'get_multi_events',
+                                   'count_events', 'aggregate_events',
+                                   'get_streams', 'infer_schema'}),
+  ServingMode.COLLECTOR: frozenset({'index', 'put_events',
+                                    'put_ndjson_events'}),
 }
 
 
@@ -42,10 +48,12 @@ def is_remote_allowed(remote):
   return False
 
 
-def endpoint(url, methods=['GET']):
+def endpoint(url, methods=['GET'], decode_body=True):
   """
   Returns a decorator which when applied a function, causes that function to
-  serve `url` and only allows the HTTP methods in `methods`
+  serve `url` and only allows the HTTP methods in `methods`. If `decode_body`
+  is False, POST bodies are not decoded up front and the function is expected
+  to read `environment['wsgi.input']` itself.
   """
   def decorator(function, methods=methods):
     # Always allow OPTIONS since CORS requests will need it.
@@ -92,7 +100,8 @@ def endpoint(url, methods=['GET']):
               ('Access-Control-Allow-Origin', remote_origin),
               ('Access-Control-Allow-Credentials', 'true'),
               ('Access-Control-Allow-Headers', ', '.join(
-                ('Accept', 'Content-Type', 'Origin', 'X-Requested-With'))),
+                ('Accept', 'Content-Encoding', 'Content-Type', 'Origin',
+                 'X-Requested-With'))),
               ('Access-Control-Allow-Methods', ', '.join(methods))
             ])
           # We just tell the client that CORS is ok. Client will follow up
@@ -100,22 +109,48 @@ def endpoint(url, methods=['GET']):
           start_response('200 OK', headers)
           return ''
 
-        # All POST bodies must be json, so decode it here.
-        if req_method == 'POST':
+        # Compressed request bodies are decompressed as they are read, so
+        # endpoints that stream their input keep doing so.
+        content_encoding = environment.get('HTTP_CONTENT_ENCODING', 'identity')
+        if content_encoding.strip().lower() != 'identity':
+          stream = get_decompressing_reader(environment['wsgi.input'],
+                                            content_encoding,
+                                            settings.node.put_read_size)
+          if stream is None:
+            start_response('415 Unsupported Media Type',
+                           [('Content-Type', 'application/json')])
+            return marshal.dumps({
+              ERRORS_FIELD: ['Unsupported Content-Encoding: %s.' %
+                             content_encoding],
+              SUCCESS_FIELD: False,
+              TOOK_FIELD: '%fms' % (1000 * (time.time() - start_time))
+            })
+          environment['wsgi.input'] = stream
+
+        # Request bodies are decoded and responses encoded with the marshalers
+        # picked by the `Content-Type` and `Accept` headers (JSON by default).
+        request_marshaler = environment['request_marshaler'] = (
+          marshal.get_marshaler_for_content_type(
+            environment.get('CONTENT_TYPE')))
+        response_marshaler = environment['response_marshaler'] = (
+          marshal.get_marshaler_for_accept(environment.get('HTTP_ACCEPT')))
+
+        # Decode POST bodies here.
+        if req_method == 'POST' and decode_body:
           try:
-            environment['json'] = marshal.loads(environment['wsgi.input']
-                                                .read())
+            environment['json'] = request_marshaler.loads(
+              environment['wsgi.input'].read())
           except ValueError:
             start_response('400 Bad Request',
                            [('Content-Type', 'application/json')])
             return marshal.dumps({
-              ERRORS_FIELD: ['Request body must be valid JSON.'],
+              ERRORS_FIELD: ['Request body must be valid %s.' %
+                             request_marshaler.name],
               SUCCESS_FIELD: False,
               TOOK_FIELD: '%fms' % (1000 * (time.time() - start_time))
             })
 
-        # All responses are JSON.
-        headers.append(('Content-Type', 'application/json'))
+        headers.append(('Content-Type', response_marshaler.content_type))
 
         if remote_origin:
           headers.append(('Access-Control-Allow-Origin', remote_origin))
@@ -123,7 +158,7 @@ def endpoint(url, methods=['GET']):
         response = function(environment, start_response, headers)
         if not isinstance(response, types.GeneratorType):
           response[TOOK_FIELD] = '%fms' % (1000 * (time.time() - start_time))
-          response = marshal.dumps(response)
+          response = response_marshaler.dumps(response)
         return response
       except Exception, e:
         log.exception('endpoint: uncaught exception!')
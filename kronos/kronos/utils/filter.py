@@ -0,0 +1,171 @@
+"""
+Helpers to filter and project events inside kronosd, so clients that only
+want some events or some of their properties don't have to retrieve and parse
+entire streams. Filters use the JSON format of metis `Condition`s.
+"""
+import operator
+import re
+import types
+
+from kronos.common.event_tools import get_property
+from kronos.conf.constants import ID_FIELD
+from kronos.conf.constants import TIMESTAMP_FIELD
+
+# Same semantics as `metis.core.execute.utils.CONDITIONS`.
+OPERATORS = {
+  'lt': operator.lt,
+  'lte': operator.le,
+  'gt': operator.gt,
+  'gte': operator.ge,
+  'eq': operator.eq,
+  'contains': lambda left, right: right in left,
+  'in': lambda left, right: left in right,
+  'regex': lambda left, right: re.search(right, left)
+}
+
+COMPOUND_TYPES = ('and', 'or')
+
+# Properties that are always returned when projecting events, so clients can
+# still order events and resume interrupted retrievals.
+REQUIRED_PROPERTIES = (ID_FIELD, TIMESTAMP_FIELD)
+
+
+def _parse_value(value):
+  if not isinstance(value, dict):
+    raise ValueError('Condition values must be dictionaries.')
+  if value.get('type') == 'constant':
+    if 'value' not in value:
+      raise ValueError('Constant values require a `value`.')
+  elif value.get('type') == 'property':
+    if not isinstance(value.get('name'), types.StringTypes):
+      raise ValueError('Property values require a string `name`.')
+  else:
+    raise ValueError('Unsupported condition value type: %s.' %
+                     value.get('type'))
+  return value
+
+
+def parse_condition(condition):
+  """
+  Validate `condition`, a dictionary in the JSON format of a metis `Condition`.
+  Leaf conditions look like {op: lt|lte|gt|gte|eq|contains|in|regex,
+  left: value, right: value, negate: bool (optional)} and compound conditions
+  like {type: and|or, conditions: [condition, ...], negate: bool (optional)}.
+  Values are either {type: constant, value: value} or {type: property,
+  name: property_name, default: value (optional)}; function values are not
+  supported. Returns `condition`. Raises ValueError if it is invalid.
+  """
+  if not isinstance(condition, dict):
+    raise ValueError('Conditions must be dictionaries.')
+  if condition.get('type') in COMPOUND_TYPES:
+    conditions = condition.get('conditions')
+    if not isinstance(conditions, list) or not conditions:
+      raise ValueError('Compound conditions require a non-empty list of '
+                       '`conditions`.')
+    for child in conditions:
+      parse_condition(child)
+  elif condition.get('op') in OPERATORS:
+    _parse_value(condition.get('left'))
+    _parse_value(condition.get('right'))
+    if (condition['op'] == 'regex' and
+        condition['right']['type'] == 'constant'):
+      try:
+        re.compile(condition['right']['value'])
+      except (re.error, TypeError), e:
+        raise ValueError('Invalid regex: %s.' % e)
+  else:
+    raise ValueError('Invalid condition: %s.' % condition)
+  return condition
+
+
+def _generate_value(value):
+  if value['type'] == 'constant':
+    constant = value['value']
+    return lambda event: constant
+
+  name = value['name']
+  default = value.get('default')
+
+  def get_value(event):
+    try:
+      return get_property(event, name)
+    except KeyError:
+      return default
+  return get_value
+
+
+def generate_filter(condition):
+  """
+  Return a function that takes an event dictionary and returns whether it
+  satisfies `condition` (as validated by `parse_condition`). Conditions that
+  raise while being evaluated aren't satisfied, as in metis.
+  """
+  negate = condition.get('negate', False)
+
+  if condition.get('type') in COMPOUND_TYPES:
+    children = map(generate_filter, condition['conditions'])
+    combine = all if condition['type'] == 'and' else any
+
+    def check_compound(event):
+      return combine(child(event) for child in children) != negate
+    return check_compound
+
+  op = OPERATORS[condition['op']]
+  left = _generate_value(condition['left'])
+  right = _generate_value(condition['right'])
+
+  def check_leaf(event):
+    try:
+      return bool(op(left(event), right(event))) != negate
+    except Exception:
+      return False
+  return check_leaf
+
+
+def get_condition_properties(condition):
+  """
+  Return the set of property names that `condition` reads.
+  """
+  if condition.get('type') in COMPOUND_TYPES:
+    return set().union(*map(get_condition_properties,
+                            condition['conditions']))
+  return set(value['name'] for value in (condition['left'],
+                                         condition['right'])
+             if value['type'] == 'property')
+
+
+def parse_properties(properties):
+  """
+  Validate `properties`, a list of dot-notation property names to project
+  events onto. Returns the list with `REQUIRED_PROPERTIES` added. Raises
+  ValueError if it is invalid.
+  """
+  if (not isinstance(properties, list) or
+      not all(isinstance(name, types.StringTypes) for name in properties)):
+    raise ValueError('`properties` must be a list of property names.')
+  return list(REQUIRED_PROPERTIES) + [name for name in properties
+                                      if name not in REQUIRED_PROPERTIES]
+
+
+def project_event(event, properties):
+  """
+  Return a copy of `event` with only `properties`, a list of dot-notation
+  property names. Nested properties keep their nesting, so projecting
+  {'a': {'b': 1, 'c': 2}} onto ['a.b'] returns {'a': {'b': 1}}. Properties
+  missing from `event` are skipped.
+  """
+  projected = {}
+  for name in properties:
+    try:
+      value = get_property(event, name)
+    except KeyError:
+      continue
+    parts = name.split('.')
+    parent = projected
+    for part in parts[:-1]:
+      child = parent.get(part)
+      if not isinstance(child, dict):
+        child = parent[part] = {}
+      parent = child
+    parent[parts[-1]] = value
+  return projected
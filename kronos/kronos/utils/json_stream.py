@@ -0,0 +1,241 @@
+"""
+Helpers to incrementally decode large JSON documents (e.g., bulk put request
+bodies) and newline-delimited JSON without reading the whole request body into
+memory first.
+"""
+import re
+
+from kronos.core import marshal; json = marshal.get_marshaler('json')
+
+_WHITESPACE = ' \t\n\r'
+_STRING_SPECIAL_CHARS_REGEX = re.compile(r'["\\]')
+_CONTAINER_SPECIAL_CHARS_REGEX = re.compile(r'["{}\[\]]')
+_SCALAR_END_REGEX = re.compile(r'[\s,:\]}]')
+
+
+class JSONStreamReader(object):
+  """
+  Walks a JSON document read from the file-like `stream` in chunks of
+  `read_size` bytes. The structure of the document is walked through with
+  `iter_object` and `iter_array`; everything else is located by scanning for
+  the end of the value and decoded in one shot with ujson. At any point only
+  the value being decoded and the current chunk are held in memory.
+  """
+
+  def __init__(self, stream, read_size):
+    self.stream = stream
+    self.read_size = read_size
+    self.buffer = ''
+    self.pos = 0
+    self.eof = False
+
+  def _fill(self):
+    """
+    Read the next chunk from the stream and drop everything in the buffer that
+    has already been consumed. Positions relative to `self.pos` remain valid.
+    Returns False if the stream has no more data.
+    """
+    if self.eof:
+      return False
+    chunk = self.stream.read(self.read_size)
+    if not chunk:
+      self.eof = True
+      return False
+    self.buffer = self.buffer[self.pos:] + chunk
+    self.pos = 0
+    return True
+
+  def peek(self):
+    """
+    Skip whitespace and return the next character without consuming it. Returns
+    an empty string at the end of the stream.
+    """
+    while True:
+      buf = self.buffer
+      pos = self.pos
+      length = len(buf)
+      while pos < length and buf[pos] in _WHITESPACE:
+        pos += 1
+      self.pos = pos
+      if pos < length:
+        return buf[pos]
+      if not self._fill():
+        return ''
+
+  def expect(self, chars):
+    """
+    Consume the next character and return it, it must be one of `chars`.
+    """
+    char = self.peek()
+    if not char or char not in chars:
+      raise ValueError('Expected one of `%s` but found `%s`.' % (chars, char))
+    self.pos += 1
+    return char
+
+  def _scan_string(self, offset):
+    """
+    Return the offset (relative to `self.pos`) just past the closing quote of
+    the string whose contents start at `offset`.
+    """
+    while True:
+      match = _STRING_SPECIAL_CHARS_REGEX.search(self.buffer, self.pos + offset)
+      if match is None:
+        offset = len(self.buffer) - self.pos
+      elif match.group() == '"':
+        return match.end() - self.pos
+      elif match.end() < len(self.buffer):
+        # Skip the escaped character.
+        offset = match.end() + 1 - self.pos
+        continue
+      else:
+        # Escape character at the end of the buffer; rescan it with more data.
+        offset = match.start() - self.pos
+      if not self._fill():
+        raise ValueError('Unterminated string.')
+
+  def _scan_container(self):
+    """
+    Return the offset (relative to `self.pos`) just past the end of the object
+    or array that starts at `self.pos`.
+    """
+    depth = 0
+    offset = 0
+    while True:
+      match = _CONTAINER_SPECIAL_CHARS_REGEX.search(self.buffer,
+                                                    self.pos + offset)
+      if match is None:
+        offset = len(self.buffer) - self.pos
+        if not self._fill():
+          raise ValueError('Unterminated object or array.')
+        continue
+      char = match.group()
+      offset = match.end() - self.pos
+      if char == '"':
+        offset = self._scan_string(offset)
+        continue
+      if char in '{[':
+        depth += 1
+      else:
+        depth -= 1
+      if depth == 0:
+        return offset
+
+  def _scan_scalar(self):
+    """
+    Return the offset (relative to `self.pos`) just past the end of the number
+    or literal that starts at `self.pos`.
+    """
+    offset = 0
+    while True:
+      match = _SCALAR_END_REGEX.search(self.buffer, self.pos + offset)
+      if match is not None:
+        return match.start() - self.pos
+      offset = len(self.buffer) - self.pos
+      if not self._fill():
+        return offset
+
+  def _scan_value(self):
+    char = self.peek()
+    if not char:
+      raise ValueError('Unexpected end of JSON document.')
+    if char == '"':
+      return self._scan_string(1)
+    if char in '{[':
+      return self._scan_container()
+    return self._scan_scalar()
+
+  def read_value(self):
+    """
+    Consume and decode the next value.
+    """
+    end = self._scan_value()
+    value = json.loads(self.buffer[self.pos:self.pos + end])
+    self.pos += end
+    return value
+
+  def skip_value(self):
+    """
+    Consume the next value without decoding it.
+    """
+    end = self._scan_value()
+    self.pos += end
+
+  def iter_object(self):
+    """
+    Consume an object, yielding its keys one at a time. The caller must consume
+    the value for each key (with `read_value`, `skip_value` etc.) before
+    advancing the iterator.
+    """
+    self.expect('{')
+    if self.peek() == '}':
+      self.pos += 1
+      return
+    while True:
+      if self.peek() != '"':
+        raise ValueError('Object keys must be strings.')
+      key = self.read_value()
+      self.expect(':')
+      yield key
+      if self.expect(',}') == '}':
+        return
+
+  def iter_array(self):
+    """
+    Consume an array, yielding once for each of its items. The caller must
+    consume the item before advancing the iterator.
+    """
+    self.expect('[')
+    if self.peek() == ']':
+      self.pos += 1
+      return
+    while True:
+      yield
+      if self.expect(',]') == ']':
+        return
+
+  def expect_end(self):
+    if self.peek():
+      raise ValueError('Extra data after the end of the JSON document.')
+
+
+def iter_put_request(stream, read_size):
+  """
+  Incrementally decode a put request body of the form:
+    { namespace: namespace_name (optional),
+      events: { stream_name1 : [event1, event2, ...],
+                stream_name2 : [event1, event2, ...],
+                ... }
+    }
+  Yields ('namespace', namespace_name) and ('event', (stream_name, event))
+  tuples in the order they appear in the body. Raises ValueError if the body
+  is not valid JSON.
+  """
+  reader = JSONStreamReader(stream, read_size)
+  for key in reader.iter_object():
+    if key == 'namespace':
+      yield 'namespace', reader.read_value()
+    elif key == 'events':
+      for stream_name in reader.iter_object():
+        for _ in reader.iter_array():
+          yield 'event', (stream_name, reader.read_value())
+    else:
+      reader.skip_value()
+  reader.expect_end()
+
+
+def iter_lines(stream, read_size):
+  """
+  Yield the lines (without line terminators) read from the file-like `stream`
+  in chunks of `read_size` bytes.
+  """
+  leftover = ''
+  while True:
+    chunk = stream.read(read_size)
+    if not chunk:
+      break
+    lines = (leftover + chunk).split('\n')
+    leftover = lines.pop()
+    for line in lines:
+      yield line.rstrip('\r')
+  if leftover:
+    yield leftover.rstrip('\r')
@@ -0,0 +1,34 @@
+"""
+msgpack counterpart of `kronos.utils.json_stream`: incrementally decodes put
+request bodies encoded with msgpack.
+"""
+from kronos.core.marshal import _msgpack as msgpack
+
+
+def iter_put_request(stream, read_size):
+  """
+  Incrementally decode a msgpack encoded put request body. The body has the
+  same structure as a JSON put request body, and the same tuples are yielded as
+  `kronos.utils.json_stream.iter_put_request` does. Raises ValueError if the
+  body is not valid msgpack.
+  """
+  unpacker = msgpack.Unpacker(stream, read_size=read_size, encoding='utf-8')
+  try:
+    for _ in xrange(unpacker.read_map_header()):
+      key = unpacker.unpack()
+      if key == 'namespace':
+        yield 'namespace', unpacker.unpack()
+      elif key == 'events':
+        for _ in xrange(unpacker.read_map_header()):
+          stream_name = unpacker.unpack()
+          for _ in xrange(unpacker.read_array_header()):
+            yield 'event', (stream_name, unpacker.unpack())
+      else:
+        unpacker.skip()
+  except msgpack.UnpackException, e:
+    raise ValueError(repr(e))
+  try:
+    unpacker.skip()
+  except msgpack.OutOfData:
+    return
+  raise ValueError('Extra data after the end of the msgpack document.')
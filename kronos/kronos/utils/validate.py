@@ -12,6 +12,10 @@ def is_pos_int(x):
   return is_int(x) and x > 0
 
 
+def is_non_neg_int(x):
+  return is_int(x) and x >= 0
+
+
 def is_int(x):
   return isinstance(x, (int, long))
 
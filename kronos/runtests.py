@@ -24,6 +24,7 @@ logging.root.addHandler(logging.NullHandler())
 # Mapping from test name => (<pathname of directory with test file>,
 # <backends to run test against>)
 TESTS = {
+  'buffer': ('tests/storage/buffer', ('memory', )),
   'cassandra': ('tests/storage/cassandra', ('cassandra', )),
   'common': ('tests/common', ('memory',
                               'cassandra',
@@ -106,6 +107,7 @@ if __name__ == '__main__':
     run_test('cassandra')
     run_test('conf')
     run_test('elasticsearch')
+    run_test('buffer')
   else:
     for test in args.tests:
       run_test(test)
@@ -1,13 +1,19 @@
+import msgpack as msgpack_module
 import random
 import time
+import zlib
 
 from collections import defaultdict
 from timeuuid import TimeUUID
 
 from kronos.common.time import epoch_time_to_kronos_time
+from kronos.conf.constants import ERRORS_FIELD
 from kronos.conf.constants import ID_FIELD
 from kronos.conf.constants import ResultOrder
+from kronos.conf.constants import STREAM_FIELD
+from kronos.conf.constants import SUCCESS_FIELD
 from kronos.conf.constants import TIMESTAMP_FIELD
+from kronos.core import marshal
 from tests.server import KronosServerTestCase
 
 
@@ -78,6 +84,180 @@ class TestKronosAPIs(KronosServerTestCase):
       events = self.get(stream, 0, 10)
       self.assertEqual(len(events), 10)
 
+  def test_put_chunked(self):
+    # Test a put larger than `put_read_size` and `put_chunk_size`.
+    stream = 'TestKronosAPIs_test_put_chunked'
+    value = 'a "quoted" \\ {string} with [brackets]'
+    response = self.put(stream, [{TIMESTAMP_FIELD: t,
+                                  'value': value,
+                                  'nested': {'a': [1, {'b': 2.5}], 'c': None}}
+                                 for t in xrange(1, 101)])
+    for num in response[stream].itervalues():
+      self.assertEqual(num, {'num_inserted': 100})
+    events = self.get(stream, 0, 100)
+    self.assertEqual(len(events), 100)
+    for event in events:
+      self.assertEqual(event['value'], value)
+      self.assertEqual(event['nested'], {'a': [1, {'b': 2.5}], 'c': None})
+
+    # Test put with `namespace` after `events`.
+    body = '{"events": {"%s": [{"%s": 1}, {"%s": 2}]}, "namespace": "%s"}' % (
+      stream, TIMESTAMP_FIELD, TIMESTAMP_FIELD, 'namespace1')
+    response = self.http_client.post(path=self.put_path, data=body,
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(marshal.loads(response.data)[SUCCESS_FIELD])
+    self.assertEqual(len(self.get(stream, 0, 100, namespace='namespace1')), 2)
+    self.assertEqual(len(self.get(stream, 0, 100)), 100)
+
+    # Test put with a null `namespace`, which stands for the default namespace.
+    body = '{"namespace": null, "events": {"%s": [{"%s": 101}]}}' % (
+      stream, TIMESTAMP_FIELD)
+    response = self.http_client.post(path=self.put_path, data=body,
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(marshal.loads(response.data)[SUCCESS_FIELD])
+    self.assertEqual(len(self.get(stream, 0, 101)), 101)
+
+    # Test put with an invalid body.
+    response = self.http_client.post(path=self.put_path,
+                                     data='{"events": {"%s": [{' % stream,
+                                     buffered=True)
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+    self.assertEqual(len(self.get(stream, 0, 100)), 100)
+
+  def test_put_ndjson(self):
+    stream1 = 'TestKronosAPIs_test_put_ndjson_1'
+    stream2 = 'TestKronosAPIs_test_put_ndjson_2'
+
+    # Test put with a per-request stream.
+    response = self.put_ndjson([{TIMESTAMP_FIELD: t} for t in xrange(1, 11)],
+                               stream=stream1)
+    self.assertTrue(response[SUCCESS_FIELD])
+    for num in response[stream1].itervalues():
+      self.assertEqual(num, {'num_inserted': 10})
+    self.assertEqual(len(self.get(stream1, 0, 10)), 10)
+
+    # Test put with `@stream` on each event overriding the request stream.
+    events = [{TIMESTAMP_FIELD: t, STREAM_FIELD: stream2}
+              for t in xrange(1, 8)]
+    events.append({TIMESTAMP_FIELD: 1})
+    response = self.put_ndjson(events, stream=stream1, namespace='namespace1')
+    self.assertTrue(response[SUCCESS_FIELD])
+    for num in response[stream1].itervalues():
+      self.assertEqual(num, {'num_inserted': 1})
+    for num in response[stream2].itervalues():
+      self.assertEqual(num, {'num_inserted': 7})
+    events = self.get(stream2, 0, 10, namespace='namespace1')
+    self.assertEqual(len(events), 7)
+    self.assertTrue(all(STREAM_FIELD not in event for event in events))
+    self.assertEqual(len(self.get(stream1, 0, 10, namespace='namespace1')), 1)
+
+    # Test that bad lines are reported and skipped.
+    response = self.http_client.post(
+      path=self.put_ndjson_path,
+      data='{"%s": 1, "%s": "%s"}\n{"lol\n[]\n\n{"%s": 1}' % (
+        TIMESTAMP_FIELD, STREAM_FIELD, stream2, TIMESTAMP_FIELD),
+      buffered=True)
+    self.assertEqual(response.status_code, 200)
+    response = marshal.loads(response.data)
+    self.assertFalse(response[SUCCESS_FIELD])
+    self.assertEqual(len(response[ERRORS_FIELD]), 3)
+    for num in response[stream2].itervalues():
+      self.assertEqual(num, {'num_inserted': 1})
+
+  def test_put_compressed(self):
+    stream = 'TestKronosAPIs_test_put_compressed'
+    body = marshal.dumps({'events': {stream: [{TIMESTAMP_FIELD: t, 'a': 'x'}
+                                              for t in xrange(1, 101)]}})
+
+    def compress(data, wbits):
+      compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+      return compressor.compress(data) + compressor.flush()
+
+    for i, (encoding, wbits) in enumerate((('gzip', 16 + zlib.MAX_WBITS),
+                                           ('deflate', zlib.MAX_WBITS))):
+      response = self.http_client.post(
+        path=self.put_path, data=compress(body, wbits),
+        headers=[('Content-Encoding', encoding)], buffered=True)
+      self.assertEqual(response.status_code, 200)
+      response = marshal.loads(response.data)
+      self.assertTrue(response[SUCCESS_FIELD])
+      for num in response[stream].itervalues():
+        self.assertEqual(num, {'num_inserted': 100})
+      self.assertEqual(len(self.get(stream, 0, 100)), 100 * (i + 1))
+
+    # Test a corrupt body.
+    response = self.http_client.post(
+      path=self.put_path, data=compress(body, zlib.MAX_WBITS)[:-10] + 'lol',
+      headers=[('Content-Encoding', 'gzip')], buffered=True)
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+    ndjson_body = '\n'.join(marshal.dumps({TIMESTAMP_FIELD: t})
+                            for t in xrange(1, 101))
+    response = self.http_client.post(
+      path=self.put_ndjson_path, query_string={'stream': stream},
+      data='lol' + compress(ndjson_body, zlib.MAX_WBITS)[3:],
+      headers=[('Content-Encoding', 'deflate')], buffered=True)
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+    # Lines are inserted as they are inflated, so those before the corrupt
+    # part of a body are kept and the error is reported alongside them.
+    response = self.http_client.post(
+      path=self.put_ndjson_path, query_string={'stream': stream},
+      data=compress(ndjson_body, zlib.MAX_WBITS)[:-10] + 'lol',
+      headers=[('Content-Encoding', 'deflate')], buffered=True)
+    self.assertEqual(response.status_code, 200)
+    response = marshal.loads(response.data)
+    self.assertFalse(response[SUCCESS_FIELD])
+    self.assertEqual(response[ERRORS_FIELD],
+                     ['Request body could not be read.'])
+    num_inserted = response[stream].values()[0]['num_inserted']
+    self.assertTrue(0 < num_inserted < 100)
+
+    # Test an unsupported encoding.
+    response = self.http_client.post(
+      path=self.put_path, data=body,
+      headers=[('Content-Encoding', 'compress')], buffered=True)
+    self.assertEqual(response.status_code, 415)
+    self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+    self.assertEqual(len(self.get(stream, 0, 100)), 200 + num_inserted)
+
+  def test_msgpack(self):
+    stream = 'TestKronosAPIs_test_msgpack'
+    msgpack = marshal.get_marshaler('msgpack')
+    headers = [('Content-Type', msgpack.content_type),
+               ('Accept', msgpack.content_type)]
+
+    # Test put with a msgpack body and response.
+    events = [{TIMESTAMP_FIELD: t, 'a': u'caf\xe9', 'b': [1.5, None]}
+              for t in xrange(1, 11)]
+    body = msgpack.dumps({'events': {stream: events}})
+    response = self.http_client.post(path=self.put_path, data=body,
+                                     headers=headers, buffered=True)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.headers['Content-Type'], msgpack.content_type)
+    response = msgpack.loads(response.data)
+    self.assertTrue(response[SUCCESS_FIELD])
+    for num in response[stream].itervalues():
+      self.assertEqual(num, {'num_inserted': 10})
+
+    # Test get with a msgpack request and response.
+    body = msgpack.dumps({'stream': stream, 'start_time': 0, 'end_time': 10})
+    response = self.http_client.post(path=self.get_path, data=body,
+                                     headers=headers, buffered=True)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.headers['Content-Type'], msgpack.content_type)
+    unpacker = msgpack_module.Unpacker(encoding='utf-8')
+    unpacker.feed(response.data)
+    events = list(unpacker)
+    self.assertEqual(len(events), 10)
+    self.assertEqual(events, self.get(stream, 0, 10))
+    for event in events:
+      self.assertEqual(event['a'], u'caf\xe9')
+      self.assertEqual(event['b'], [1.5, None])
+
   def test_get(self):
     stream = 'TestKronosAPIs_test_get'
     event1 = [{'a': 1, TIMESTAMP_FIELD: 1}]
@@ -189,7 +369,225 @@ class TestKronosAPIs(KronosServerTestCase):
     # `start_time` < 0 and `end_time` < 0
     self.assertEqual(len(self.get(stream, -2000, -1000)), 0)
 
+  def test_get_compressed(self):
+    stream = 'TestKronosAPIs_test_get_compressed'
+    # Enough events for the response to be flushed in several chunks.
+    self.put(stream, [{TIMESTAMP_FIELD: t, 'a': 'x' * 50}
+                      for t in xrange(1, 101)])
+    events = self.get(stream, 0, 100)
+    self.assertEqual(len(events), 100)
+    body = marshal.dumps({'stream': stream, 'start_time': 0, 'end_time': 100})
+
+    for accept_encoding, encoding, wbits in (
+        ('gzip', 'gzip', 16 + zlib.MAX_WBITS),
+        ('deflate, gzip;q=0.5', 'gzip', 16 + zlib.MAX_WBITS),
+        ('deflate', 'deflate', zlib.MAX_WBITS),
+        ('gzip;q=0, deflate', 'deflate', zlib.MAX_WBITS),
+        ('gzip;q=0, *', 'deflate', zlib.MAX_WBITS)):
+      response = self.http_client.post(
+        path=self.get_path, data=body,
+        headers=[('Accept-Encoding', accept_encoding)], buffered=True)
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.headers['Content-Encoding'], encoding)
+      data = zlib.decompress(response.data, wbits)
+      self.assertEqual(map(marshal.loads, data.splitlines()), events)
+
+    # No compression for clients that don't accept it.
+    response = self.http_client.post(
+      path=self.get_path, data=body,
+      headers=[('Accept-Encoding', 'identity')], buffered=True)
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse('Content-Encoding' in response.headers)
+    self.assertEqual(map(marshal.loads, response.data.splitlines()), events)
+
+  def test_get_multi(self):
+    streams = ['TestKronosAPIs_test_get_multi_%s' % i for i in xrange(3)]
+    for i, stream in enumerate(streams):
+      self.put(stream, [{TIMESTAMP_FIELD: t, 'a': i}
+                        for t in xrange(i + 1, 37, 3)])
+
+    def summarize(events):
+      return [(event[STREAM_FIELD], event[TIMESTAMP_FIELD], event['a'])
+              for event in events]
+
+    # Framed: all events of each stream in the order the streams are given.
+    events = self.get_multi(streams[::-1], 0, 36)
+    self.assertEqual(summarize(events),
+                     [(streams[2], t, 2) for t in xrange(3, 37, 3)] +
+                     [(streams[1], t, 1) for t in xrange(2, 37, 3)] +
+                     [(streams[0], t, 0) for t in xrange(1, 37, 3)])
+
+    # Merged by id, with per-stream limits.
+    events = self.get_multi(streams, 0, 36, merge=True)
+    self.assertEqual([event[TIMESTAMP_FIELD] for event in events],
+                     range(1, 37))
+    self.assertEqual(summarize(events)[:3], [(streams[0], 1, 0),
+                                             (streams[1], 2, 1),
+                                             (streams[2], 3, 2)])
+    events = self.get_multi(streams, 0, 36, merge=True, limit=2,
+                            order=ResultOrder.DESCENDING)
+    self.assertEqual([event[TIMESTAMP_FIELD] for event in events],
+                     [36, 35, 34, 33, 32, 31])
+
+    # Invalid requests.
+    for value in ([], 'TestKronosAPIs_test_get_multi_0', ['@invalid']):
+      data = {'streams': value, 'start_time': 0, 'end_time': 36}
+      response = self.http_client.post(path=self.get_multi_path,
+                                       data=marshal.dumps(data),
+                                       buffered=True)
+      self.assertEqual(response.status_code, 400)
+      self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+
+  def test_count(self):
+    stream = 'TestKronosAPIs_test_count'
+    self.assertEqual(self.count(stream, 0, 100), 0)
+    self.put(stream, [{TIMESTAMP_FIELD: t} for t in xrange(1, 11)] +
+             [{TIMESTAMP_FIELD: 5}])
+
+    self.assertEqual(self.count(stream, 0, 100), 11)
+    self.assertEqual(self.count(stream, 5, 5), 2)
+    self.assertEqual(self.count(stream, 2, 6), 6)
+    self.assertEqual(self.count(stream, 11, 100), 0)
+    self.assertEqual(self.count(stream, 10, 1), 0)
+
+    # Limits.
+    self.assertEqual(self.count(stream, 0, 100, limit=3), 3)
+    self.assertEqual(self.count(stream, 0, 100, limit=1), 1)
+    self.assertEqual(self.count(stream, 11, 100, limit=1), 0)
+    self.assertEqual(self.count(stream, 0, 100, limit=0), 0)
+
+    # Counts after `start_id` match what `get` returns.
+    events = self.get(stream, 0, 100)
+    for i, event in enumerate(events):
+      self.assertEqual(self.count(stream, None, 100, start_id=event[ID_FIELD]),
+                       len(events) - i - 1)
+
+  def test_aggregate(self):
+    stream = 'TestKronosAPIs_test_aggregate'
+    events = [{TIMESTAMP_FIELD: t, 'a': t % 3, 'b': {'c': t}}
+              for t in xrange(1, 21)]
+    events.append({TIMESTAMP_FIELD: 21, 'b': {'c': 'lol'}})
+    self.put(stream, events)
+
+    # A single bucket without grouping.
+    buckets = self.aggregate(stream, 0, 21,
+                             [{'op': 'count'},
+                              {'op': 'count', 'property': 'a'},
+                              {'op': 'sum', 'property': 'b.c'},
+                              {'op': 'min', 'property': 'a', 'alias': 'lo'},
+                              {'op': 'max', 'property': 'a', 'alias': 'hi'},
+                              {'op': 'avg', 'property': 'b.c'}])
+    self.assertEqual(buckets, [{TIMESTAMP_FIELD: 0,
+                                'count': 21,
+                                'count_a': 20,
+                                'sum_b.c': 210,
+                                'lo': 0,
+                                'hi': 2,
+                                'avg_b.c': 10.5}])
+
+    # Time buckets.
+    buckets = self.aggregate(stream, 5, 14, [{'op': 'count'},
+                                             {'op': 'sum', 'property': 'b.c'}],
+                             bucket_width=5)
+    self.assertEqual(buckets, [{TIMESTAMP_FIELD: 5, 'count': 5, 'sum_b.c': 35},
+                               {TIMESTAMP_FIELD: 10, 'count': 5,
+                                'sum_b.c': 60}])
+
+    # Time buckets and groups.
+    buckets = self.aggregate(stream, 1, 6, [{'op': 'count'}], bucket_width=6,
+                             group_by=['a'])
+    self.assertEqual(buckets, [{TIMESTAMP_FIELD: 0, 'a': 0, 'count': 1},
+                               {TIMESTAMP_FIELD: 0, 'a': 1, 'count': 2},
+                               {TIMESTAMP_FIELD: 0, 'a': 2, 'count': 2},
+                               {TIMESTAMP_FIELD: 6, 'a': 0, 'count': 1}])
+
+    # Empty ranges.
+    self.assertEqual(self.aggregate(stream, 100, 200, [{'op': 'count'}]), [])
+    self.assertEqual(self.aggregate(stream, 10, 5, [{'op': 'count'}]), [])
+
+    # Invalid requests.
+    for aggregates, bucket_width in (([], None),
+                                     ([{'op': 'median', 'property': 'a'}],
+                                      None),
+                                     ([{'op': 'sum'}], None),
+                                     ([{'op': 'count'}], 0)):
+      data = {'stream': stream, 'start_time': 0, 'end_time': 21,
+              'aggregates': aggregates, 'bucket_width': bucket_width}
+      response = self.http_client.post(path=self.aggregate_path,
+                                       data=marshal.dumps(data),
+                                       buffered=True)
+      self.assertEqual(response.status_code, 400)
+      self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+
+  def test_get_filter_and_properties(self):
+    stream = 'TestKronosAPIs_test_get_filter_and_properties'
+    self.put(stream, [{TIMESTAMP_FIELD: t, 'a': t % 3, 'b': {'c': t, 'd': 'x'},
+                       'e': 'hello %s' % t}
+                      for t in xrange(1, 11)])
+
+    def prop(name, **kwargs):
+      return dict(type='property', name=name, **kwargs)
+
+    def const(value):
+      return {'type': 'constant', 'value': value}
+
+    # Leaf conditions.
+    events = self.get(stream, 0, 10, condition={'op': 'eq',
+                                                'left': prop('a'),
+                                                'right': const(1)})
+    self.assertEqual([event[TIMESTAMP_FIELD] for event in events],
+                     [1, 4, 7, 10])
+    events = self.get(stream, 0, 10, condition={'op': 'regex',
+                                                'left': prop('e'),
+                                                'right': const('o 1$'),
+                                                'negate': True})
+    self.assertEqual(len(events), 9)
+
+    # Compound conditions, defaults for missing properties and limits.
+    condition = {'type': 'and',
+                 'conditions': [{'op': 'gt', 'left': prop('b.c'),
+                                 'right': const(3)},
+                                {'type': 'or',
+                                 'conditions': [
+                                   {'op': 'in', 'left': prop('a'),
+                                    'right': const([0, 2])},
+                                   {'op': 'eq', 'left': prop('z', default=1),
+                                    'right': const(2)}]}]}
+    events = self.get(stream, 0, 10, condition=condition)
+    self.assertEqual([event[TIMESTAMP_FIELD] for event in events],
+                     [5, 6, 8, 9])
+    events = self.get(stream, 0, 10, condition=condition, limit=2,
+                      order=ResultOrder.DESCENDING)
+    self.assertEqual([event[TIMESTAMP_FIELD] for event in events], [9, 8])
+
+    # Projections always keep the id and time.
+    events = self.get(stream, 0, 10, properties=['a', 'b.c', 'missing'])
+    self.assertEqual(len(events), 10)
+    for event in events:
+      self.assertEqual(set(event), {ID_FIELD, TIMESTAMP_FIELD, 'a', 'b'})
+      self.assertEqual(event['b'], {'c': event[TIMESTAMP_FIELD]})
+    events = self.get(stream, 0, 10, properties=['e'],
+                      condition={'op': 'lte', 'left': prop('b.c'),
+                                 'right': const(2)})
+    self.assertEqual([event['e'] for event in events], ['hello 1', 'hello 2'])
+
+    # Invalid filters and projections.
+    for key, value in (('filter', {'op': 'eq', 'left': const(1)}),
+                       ('filter', {'op': 'eq', 'left': {'type': 'function'},
+                                   'right': const(1)}),
+                       ('filter', {'type': 'and', 'conditions': []}),
+                       ('properties', 'a')):
+      data = {'stream': stream, 'start_time': 0, 'end_time': 10, key: value}
+      response = self.http_client.post(path=self.get_path,
+                                       data=marshal.dumps(data),
+                                       buffered=True)
+      self.assertEqual(response.status_code, 400)
+      self.assertFalse(marshal.loads(response.data)[SUCCESS_FIELD])
+
   def test_delete(self):
+    # `num_deleted` is only a lower bound for Cassandra, which doesn't count
+    # the events of shards it deletes entirely. These deletes each cover part
+    # of a shard, so every backend counts exactly.
     stream = 'TestKronosAPIs_test_delete'
     event1 = [{'a': 1, TIMESTAMP_FIELD: 1}]
     event2 = [{'a': 3, TIMESTAMP_FIELD: 2}]
@@ -0,0 +1,49 @@
+import StringIO
+import unittest
+import zlib
+
+from kronos.utils.compression import get_decompressing_reader
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+
+class TestDecompressingReader(unittest.TestCase):
+  def check_bounded(self, encoding, data):
+    # 32 MB of zeroes compress to a few kilobytes; no single read may inflate
+    # much more than it was asked for.
+    reader = get_decompressing_reader(StringIO.StringIO(data), encoding, 1024)
+    total = 0
+    chunk = reader.read(4096)
+    while chunk:
+      self.assertTrue(len(chunk) <= 4096)
+      self.assertTrue(len(getattr(reader, 'buffer', '')) <= 1024)
+      total += len(chunk)
+      chunk = reader.read(4096)
+    self.assertEqual(total, 32 << 20)
+
+  def test_bounded_inflation(self):
+    body = '\0' * (32 << 20)
+    for encoding, wbits in (('gzip', 16 + zlib.MAX_WBITS),
+                            ('deflate', zlib.MAX_WBITS)):
+      compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+      self.check_bounded(encoding,
+                         compressor.compress(body) + compressor.flush())
+    if zstandard is not None:
+      self.check_bounded('zstd', zstandard.ZstdCompressor().compress(body))
+
+  def test_corrupt(self):
+    data = 'lol' + zlib.compress('{"events": []}' * 100)[3:]
+    reader = get_decompressing_reader(StringIO.StringIO(data), 'deflate', 16)
+    self.assertRaises(ValueError, reader.read)
+    if zstandard is not None:
+      data = zstandard.ZstdCompressor().compress('{"events": []}' * 100)
+      reader = get_decompressing_reader(
+        StringIO.StringIO('lol' + data[3:]), 'zstd', 16)
+      self.assertRaises(ValueError, reader.read)
+
+  def test_unsupported(self):
+    self.assertEqual(
+      get_decompressing_reader(StringIO.StringIO(''), 'compress', 16), None)
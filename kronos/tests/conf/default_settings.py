@@ -40,6 +40,10 @@ storage = {
 node = {
   'id': hex(getnode()),
   'flush_size': 512,
+  'put_read_size': 512,
+  'put_chunk_size': 5,
+  'compression_level': 6,
+  'get_multi_batch_size': 5,
   'greenlet_pool_size': 50,
   'gipc_pool_size': 2,
   'log_directory': 'logs',
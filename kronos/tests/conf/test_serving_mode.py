@@ -28,15 +28,21 @@ class TestServingMode(KronosServerTestCase):
 
     # Check forbidden resources.
     mode_to_endpoints = {
-      ServingMode.ALL: [(self.put_path, self.get_path, self.index_path,
+      ServingMode.ALL: [(self.put_path, self.put_ndjson_path, self.get_path,
+                         self.get_multi_path, self.count_path,
+                         self.aggregate_path, self.index_path,
                          self.delete_path, self.streams_path),
                         ()],
-      ServingMode.READONLY: [(self.get_path, self.index_path,
-                              self.streams_path),
-                             (self.put_path, self.delete_path)],
-      ServingMode.COLLECTOR: [(self.put_path, self.index_path),
-                              (self.get_path, self.delete_path,
-                               self.streams_path)]
+      ServingMode.READONLY: [(self.get_path, self.get_multi_path,
+                              self.count_path, self.aggregate_path,
+                              self.index_path, self.streams_path),
+                             (self.put_path, self.put_ndjson_path,
+                              self.delete_path)],
+      ServingMode.COLLECTOR: [(self.put_path, self.put_ndjson_path,
+                               self.index_path),
+                              (self.get_path, self.get_multi_path,
+                               self.count_path, self.aggregate_path,
+                               self.delete_path, self.streams_path)]
     }
 
     for mode, (found, forbidden) in mode_to_endpoints.iteritems():
@@ -0,0 +1,50 @@
+import unittest
+
+from kronos.common.settings import Settings
+from kronos.core.errors import ImproperlyConfigured
+from kronos.core.validator import NODE_SETTINGS_DEFAULTS
+from kronos.core.validator import validate_settings
+from tests.conf import default_settings
+
+
+class TestValidateSettings(unittest.TestCase):
+  def get_settings(self, **node):
+    settings = Settings()
+    settings.update(default_settings)
+    settings['node'] = dict(settings['node'], **node)
+    return settings
+
+  def test_node_defaults(self):
+    settings = self.get_settings()
+    for key in NODE_SETTINGS_DEFAULTS:
+      del settings['node'][key]
+    validate_settings(settings)
+    for key, value in NODE_SETTINGS_DEFAULTS.iteritems():
+      self.assertEqual(settings.node[key], value)
+
+  def test_invalid_node_settings(self):
+    for node in ({'put_read_size': 0},
+                 {'put_chunk_size': -1},
+                 {'get_multi_batch_size': 0},
+                 {'compression_level': 10}):
+      self.assertRaises(ImproperlyConfigured, validate_settings,
+                        self.get_settings(**node))
+
+  def test_write_buffer(self):
+    write_buffer = {'flush_size': 100, 'flush_interval_seconds': 0.5,
+                    'max_events': 1000}
+    validate_settings(self.get_settings(write_buffer=write_buffer))
+    validate_settings(self.get_settings(
+      write_buffer=dict(write_buffer, ack='flush', flush_interval_seconds=0)))
+    for invalid in ({'flush_sise': 100},
+                    {'flush_size': 0},
+                    {'max_events': -1},
+                    {'flush_interval_seconds': -0.5},
+                    {'flush_interval_seconds': '1'},
+                    {'ack': 'insert'}):
+      self.assertRaises(
+        ImproperlyConfigured, validate_settings,
+        self.get_settings(write_buffer=dict(write_buffer, **invalid)))
+    del write_buffer['max_events']
+    self.assertRaises(ImproperlyConfigured, validate_settings,
+                      self.get_settings(write_buffer=write_buffer))
@@ -21,6 +21,10 @@ class KronosServerTestCase(unittest.TestCase):
     self.http_client = Client(application, BaseResponse)
     self.get_path = '%s/get' % EVENT_BASE_PATH
     self.put_path = '%s/put' % EVENT_BASE_PATH
+    self.put_ndjson_path = '%s/put_ndjson' % EVENT_BASE_PATH
+    self.get_multi_path = '%s/get_multi' % EVENT_BASE_PATH
+    self.count_path = '%s/count' % EVENT_BASE_PATH
+    self.aggregate_path = '%s/aggregate' % EVENT_BASE_PATH
     self.delete_path = '%s/delete' % EVENT_BASE_PATH
     self.index_path = '%s/index' % BASE_PATH
     self.streams_path = '%s/streams' % BASE_PATH
@@ -48,8 +52,22 @@ class KronosServerTestCase(unittest.TestCase):
     self.assertTrue(response[SUCCESS_FIELD])
     return response
 
+  def put_ndjson(self, events, stream=None, namespace=None):
+    params = {}
+    if stream is not None:
+      params['stream'] = stream
+    if namespace is not None:
+      params['namespace'] = namespace
+    response = self.http_client.post(path=self.put_ndjson_path,
+                                     query_string=params,
+                                     data='\n'.join(map(marshal.dumps,
+                                                        events)),
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    return marshal.loads(response.data)
+
   def get(self, stream, start_time, end_time, start_id=None, limit=None,
-          order=None, namespace=None):
+          order=None, namespace=None, condition=None, properties=None):
     data = {'stream': stream, 'end_time': end_time}
 
     if start_id:
@@ -62,12 +80,66 @@ class KronosServerTestCase(unittest.TestCase):
       data['order'] = order
     if namespace is not None:
       data['namespace'] = namespace
+    if condition is not None:
+      data['filter'] = condition
+    if properties is not None:
+      data['properties'] = properties
     response = self.http_client.post(path=self.get_path,
                                      data=marshal.dumps(data),
                                      buffered=True)
     self.assertEqual(response.status_code, 200)
     return map(marshal.loads, response.data.splitlines())
 
+  def get_multi(self, streams, start_time, end_time, merge=None, limit=None,
+                order=None):
+    data = {'streams': streams, 'start_time': start_time,
+            'end_time': end_time}
+    if merge is not None:
+      data['merge'] = merge
+    if limit is not None:
+      data['limit'] = limit
+    if order is not None:
+      data['order'] = order
+    response = self.http_client.post(path=self.get_multi_path,
+                                     data=marshal.dumps(data),
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    return map(marshal.loads, response.data.splitlines())
+
+  def count(self, stream, start_time, end_time, start_id=None, limit=None):
+    data = {'stream': stream, 'end_time': end_time}
+    if start_id:
+      data['start_id'] = start_id
+    else:
+      data['start_time'] = start_time
+    if limit is not None:
+      data['limit'] = limit
+    response = self.http_client.post(path=self.count_path,
+                                     data=marshal.dumps(data),
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    response = marshal.loads(response.data)
+    self.assertTrue(response[SUCCESS_FIELD])
+    return response['count']
+
+  def aggregate(self, stream, start_time, end_time, aggregates,
+                bucket_width=None, group_by=None, namespace=None):
+    data = {'stream': stream, 'start_time': start_time, 'end_time': end_time,
+            'aggregates': aggregates}
+    if bucket_width is not None:
+      data['bucket_width'] = bucket_width
+    if group_by is not None:
+      data['group_by'] = group_by
+    if namespace is not None:
+      data['namespace'] = namespace
+    response = self.http_client.post(path=self.aggregate_path,
+                                     data=marshal.dumps(data),
+                                     buffered=True)
+    self.assertEqual(response.status_code, 200)
+    response = marshal.loads(response.data)
+    self.assertTrue(response[SUCCESS_FIELD])
+    return response['buckets']
+
   def delete(self, stream, start_time, end_time, start_id=None, namespace=None):
     data = {'stream': stream, 'end_time': end_time}
     if start_id:
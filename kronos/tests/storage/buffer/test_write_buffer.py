@@ -0,0 +1,105 @@
+import gevent
+import time
+
+from kronos.conf.constants import TIMESTAMP_FIELD
+from kronos.core.validator import validate_event_and_assign_id
+from kronos.storage import buffer
+from kronos.storage.buffer import ACK_ON_FLUSH
+from kronos.storage.buffer import WriteBehindBuffer
+from kronos.storage.router import router
+from tests.server import KronosServerTestCase
+
+
+class TestWriteBehindBuffer(KronosServerTestCase):
+  def tearDown(self):
+    if buffer._WRITE_BUFFER is not None:
+      buffer._WRITE_BUFFER.close()
+      buffer._WRITE_BUFFER = None
+    super(TestWriteBehindBuffer, self).tearDown()
+
+  def test_ack_on_buffer(self):
+    buffer._WRITE_BUFFER = WriteBehindBuffer(flush_size=20,
+                                             flush_interval_seconds=60,
+                                             max_events=100)
+    stream = 'TestWriteBehindBuffer_test_ack_on_buffer'
+    for i in xrange(3):
+      response = self.put(stream, [{TIMESTAMP_FIELD: i * 5 + j}
+                                   for j in xrange(5)])
+      self.assertEqual(response[stream]['memory']['num_inserted'], 5)
+    # Puts succeed before their events are inserted.
+    self.assertEqual(self.get(stream, 0, 100), [])
+
+    # Events are inserted together once there are `flush_size` of them.
+    self.put(stream, [{TIMESTAMP_FIELD: 15 + j} for j in xrange(5)])
+    gevent.sleep(0.1)
+    self.assertEqual([event[TIMESTAMP_FIELD]
+                      for event in self.get(stream, 0, 100)], range(20))
+
+    # Or once they have been buffered for `flush_interval_seconds`.
+    self.put(stream, [{TIMESTAMP_FIELD: 20}])
+    self.assertEqual(len(self.get(stream, 0, 100)), 20)
+    buffer._WRITE_BUFFER.flush(max_age_seconds=0)
+    gevent.sleep(0.1)
+    self.assertEqual(len(self.get(stream, 0, 100)), 21)
+
+  def test_ack_on_flush(self):
+    buffer._WRITE_BUFFER = WriteBehindBuffer(flush_size=1000,
+                                             flush_interval_seconds=0.2,
+                                             max_events=1000,
+                                             ack=ACK_ON_FLUSH)
+    stream = 'TestWriteBehindBuffer_test_ack_on_flush'
+    puts = [gevent.spawn(self.put, stream, [{TIMESTAMP_FIELD: i}])
+            for i in xrange(10)]
+    gevent.joinall(puts)
+    # Puts only succeed once their events are inserted.
+    self.assertEqual(len(self.get(stream, 0, 100)), 10)
+
+  def test_flush_interval(self):
+    buffer._WRITE_BUFFER = WriteBehindBuffer(flush_size=1000,
+                                             flush_interval_seconds=0.2,
+                                             max_events=1000)
+    stream = 'TestWriteBehindBuffer_test_flush_interval'
+    self.put(stream, [{TIMESTAMP_FIELD: i} for i in xrange(3)])
+    self.assertEqual(self.get(stream, 0, 100), [])
+    # Events are inserted once they have been buffered for
+    # `flush_interval_seconds`, without anything else being put.
+    gevent.sleep(0.5)
+    self.assertEqual(len(self.get(stream, 0, 100)), 3)
+
+  def test_ack_on_flush_chunks(self):
+    buffer._WRITE_BUFFER = WriteBehindBuffer(flush_size=1000,
+                                             flush_interval_seconds=0.2,
+                                             max_events=1000,
+                                             ack=ACK_ON_FLUSH)
+    stream = 'TestWriteBehindBuffer_test_ack_on_flush_chunks'
+    # The put is split into 5 chunks (`put_chunk_size` is 5), which are all
+    # buffered before the put waits for them, so it waits for a single flush.
+    start = time.time()
+    self.put(stream, [{TIMESTAMP_FIELD: i} for i in xrange(25)])
+    self.assertTrue(time.time() - start < 0.6)
+    self.assertEqual(len(self.get(stream, 0, 100)), 25)
+
+  def test_backpressure(self):
+    write_buffer = WriteBehindBuffer(flush_size=1000,
+                                     flush_interval_seconds=60,
+                                     max_events=10)
+    backend = router.get_backend('memory')
+    stream = 'TestWriteBehindBuffer_test_backpressure'
+    configuration = router.get_configuration('kronos', stream, backend)
+
+    def add(i):
+      events = [validate_event_and_assign_id({TIMESTAMP_FIELD: i})
+                for _ in xrange(5)]
+      write_buffer.add('kronos', stream, backend, configuration, events)
+
+    add(0)
+    add(1)
+    blocked = gevent.spawn(add, 2)
+    gevent.sleep(0.1)
+    # The buffer is full, so adding more events waits for a flush.
+    self.assertFalse(blocked.ready())
+    write_buffer.flush()
+    blocked.join(timeout=1)
+    self.assertTrue(blocked.ready())
+    write_buffer.close()
+    self.assertEqual(len(self.get(stream, 0, 100)), 15)
@@ -6,6 +6,13 @@ from kronos.conf import settings
 from kronos.conf.constants import MAX_LIMIT
 from kronos.conf.constants import TIMESTAMP_FIELD
 from kronos.core import marshal
+from kronos.core.errors import ImproperlyConfigured
+from kronos.core.marshal import SerializedEvent
+from kronos.core.validator import validate_event_and_assign_id
+from kronos.storage.cassandra.internal import choose_bucket_layout
+from kronos.storage.cassandra.internal import LatencyTracker
+from kronos.storage.cassandra.internal import Namespace
+from kronos.storage.cassandra.internal import Stream
 from kronos.storage.cassandra.internal import StreamShard
 from kronos.storage.router import router
 from kronos.utils.math import round_down
@@ -83,8 +90,8 @@ class TestCassandraBackend(KronosServerTestCase):
         events = stream_shard.iterator(
           uuid_from_time(start_time, UUIDType.LOWEST),
           uuid_from_time(start_time + self.width_seconds))
-        bucket_to_events[start_time].extend(marshal.loads(event.json)
-                                            for event in events)
+        bucket_to_events[start_time].extend(marshal.loads(event_json)
+                                            for _, event_json in events)
 
     num_events = 0
     for start_time, events in bucket_to_events.iteritems():
@@ -125,6 +132,220 @@ class TestCassandraBackend(KronosServerTestCase):
                      set(round_down(epoch_time_to_kronos_time(t), self.width)
                          for t in xrange(20)))
 
+  def test_index_cache(self):
+    ''' Reads the index through the index read cache and checks that buckets
+    added by this stream show up right away, while buckets added by another
+    process (simulated by another `Stream`) show up once the cache is
+    invalidated. '''
+
+    stream_name = 'TestCassandraBackend_test_index_cache'
+    stream = self.namespace.get_stream(stream_name, self.width, self.shards)
+    stream.index_cache_ttl = 60
+    other_stream = Stream(self.namespace, stream_name, self.width, 1,
+                          self.namespace.read_size)
+
+    def bucket_times(end_seconds):
+      shard_descs = stream.get_overlapping_shards(
+        0, epoch_time_to_kronos_time(end_seconds))
+      return {shard_desc['start_time'] for shard_desc in shard_descs}
+
+    self.put(stream_name, [{TIMESTAMP_FIELD: epoch_time_to_kronos_time(0)}])
+    self.assertEqual(bucket_times(20), {0})
+
+    # Buckets written through the cached stream are added to the cache.
+    self.put(stream_name, [{TIMESTAMP_FIELD: epoch_time_to_kronos_time(4)}])
+    self.assertEqual(bucket_times(20), {0, epoch_time_to_kronos_time(4)})
+
+    # Buckets written by others are only seen after the cache expires.
+    event = {TIMESTAMP_FIELD: epoch_time_to_kronos_time(8)}
+    other_stream.insert([(uuid_from_time(8), SerializedEvent(event))],
+                        32 * 1024, 1)
+    self.assertEqual(bucket_times(20), {0, epoch_time_to_kronos_time(4)})
+    stream.invalidate_index_cache()
+    self.assertEqual(bucket_times(20), {0, epoch_time_to_kronos_time(4),
+                                        epoch_time_to_kronos_time(8)})
+    self.assertEqual(len(self.get(stream_name, 0,
+                                  epoch_time_to_kronos_time(20))), 3)
+
+  def test_stream_catalog(self):
+    ''' Lists streams through the stream list cache and checks that streams
+    added by this process show up right away, while streams added by another
+    process (simulated by another `Namespace`) show up once the cache
+    expires. '''
+
+    stream_name = 'TestCassandraBackend_test_stream_catalog'
+    self.put(stream_name, [{TIMESTAMP_FIELD: epoch_time_to_kronos_time(0)}])
+    self.assertTrue(stream_name in self.namespace.list_streams())
+
+    other_namespace = Namespace(self.namespace.cluster, self.namespace.name,
+                                self.namespace.replication_factor,
+                                self.namespace.read_size)
+    other_stream = other_namespace.get_stream('%s_other' % stream_name,
+                                              self.width, 1)
+    event = {TIMESTAMP_FIELD: epoch_time_to_kronos_time(0)}
+    other_stream.insert([(uuid_from_time(0), SerializedEvent(event))],
+                        32 * 1024, 1)
+    self.assertFalse(other_stream.stream in self.namespace.list_streams())
+    self.namespace.stream_list = None
+    self.assertTrue(other_stream.stream in self.namespace.list_streams())
+    other_namespace.destroy_session()
+
+  def test_compact_storage(self):
+    ''' Writes some events as regular blobs and others as compact blobs and
+    checks that all of them are read back unchanged, including events that
+    nest a copy of their time. '''
+
+    stream_name = 'TestCassandraBackend_test_compact_storage'
+    stream = self.namespace.get_stream(stream_name, self.width, self.shards)
+
+    def make_event(i):
+      event = {TIMESTAMP_FIELD: epoch_time_to_kronos_time(i)}
+      if i % 5:
+        event.update({'i': i, 'nested': {'a': [i, u'\u263a']}})
+      if i % 3 == 0:
+        event['nested'] = {TIMESTAMP_FIELD: event[TIMESTAMP_FIELD]}
+      return event
+
+    events = [validate_event_and_assign_id(make_event(i)) for i in xrange(20)]
+    stream.insert(events[:10], 32 * 1024, 4)
+    stream.insert(events[10:], 32 * 1024, 4, compact=True)
+
+    expected = [marshal.loads(serialized.json) for _, serialized in events]
+    self.assertEqual(self.get(stream_name, 0, epoch_time_to_kronos_time(20)),
+                     expected)
+
+  def test_insert_batching(self):
+    ''' Inserts events with batches capped to a single write and checks that
+    every event and bucket made it to Cassandra. '''
+
+    stream_name = 'TestCassandraBackend_test_insert_batching'
+    stream = Stream(self.namespace, stream_name, self.width, self.shards,
+                    self.namespace.read_size)
+    events = [(uuid_from_time(i % 10),
+               SerializedEvent({TIMESTAMP_FIELD:
+                                epoch_time_to_kronos_time(i % 10)}))
+              for i in xrange(50)]
+    stream.insert(events, 1, 4)
+
+    shard_descs = list(stream.get_overlapping_shards(
+      0, epoch_time_to_kronos_time(10)))
+    self.assertEqual(
+      {shard_desc['start_time'] for shard_desc in shard_descs},
+      {round_down(epoch_time_to_kronos_time(t), self.width)
+       for t in xrange(10)})
+    # Index entries are cached once they have been written.
+    for shard_desc in shard_descs:
+      stream.index_cache.get((shard_desc['start_time'], shard_desc['width'],
+                              shard_desc['shard']))
+    self.assertEqual(len(self.get(stream_name, 0,
+                                  epoch_time_to_kronos_time(10))), 50)
+
+  def test_paged_delete(self):
+    ''' Deletes a range of events covering some buckets entirely, which are
+    deleted with partition tombstones, and others partly, whose events are
+    deleted in batches of one. '''
+
+    stream_name = 'TestCassandraBackend_test_paged_delete'
+    stream = Stream(self.namespace, stream_name, epoch_time_to_kronos_time(2),
+                    1, self.namespace.read_size)
+    stream.insert([(uuid_from_time(i % 10),
+                    SerializedEvent({TIMESTAMP_FIELD:
+                                     epoch_time_to_kronos_time(i % 10)}))
+                   for i in xrange(30)], 32 * 1024, 4)
+
+    # Buckets [2, 4) and [4, 6) are deleted entirely, [0, 2) and [6, 8)
+    # partly. Only the 6 events deleted one by one are counted.
+    num_deleted, errors = stream.delete(
+      uuid_from_kronos_time(epoch_time_to_kronos_time(1) - 1,
+                            UUIDType.HIGHEST),
+      uuid_from_time(6, UUIDType.HIGHEST), 1, 4)
+    self.assertEqual((num_deleted, errors), (6, []))
+    events = stream.iterator(uuid_from_time(0, UUIDType.LOWEST),
+                             uuid_from_time(10, UUIDType.HIGHEST),
+                             False, MAX_LIMIT)
+    times = {marshal.loads(event_json)[TIMESTAMP_FIELD]
+             for _, event_json in events}
+    self.assertEqual(sorted(map(kronos_time_to_epoch_time, times)),
+                     [0, 7, 8, 9])
+
+  def test_prefetching(self):
+    ''' Reads a stream spread over many buckets and small pages with and
+    without prefetching, and with a read buffer too small to prefetch
+    anything, and checks that all reads return the same events in order. '''
+
+    stream_name = 'TestCassandraBackend_test_prefetching'
+    for i in xrange(100):
+      self.put(stream_name, [{TIMESTAMP_FIELD:
+                              epoch_time_to_kronos_time(i % 20)}])
+    stream = Stream(self.namespace, stream_name, self.width, self.shards, 3)
+
+    def read(descending, prefetch_shards, prefetch_buffer_bytes):
+      events = stream.iterator(uuid_from_time(0, UUIDType.LOWEST),
+                               uuid_from_time(20, UUIDType.HIGHEST),
+                               descending, MAX_LIMIT, prefetch_shards,
+                               prefetch_buffer_bytes)
+      return [_id for _id, _ in events]
+
+    for descending in (False, True):
+      ids = read(descending, 0, 0)
+      self.assertEqual(len(ids), 100)
+      self.assertEqual(ids, sorted(ids, reverse=descending))
+      self.assertEqual(read(descending, 4, 1024 * 1024), ids)
+      self.assertEqual(read(descending, 100, 1), ids)
+
+  def test_speculative_retry(self):
+    ''' Makes every shard read look slow so that all of them are retried
+    speculatively, and checks that reads still return every event once. '''
+
+    stream_name = 'TestCassandraBackend_test_speculative_retry'
+    for i in xrange(50):
+      self.put(stream_name, [{TIMESTAMP_FIELD:
+                              epoch_time_to_kronos_time(i % 10)}])
+    stream = self.namespace.get_stream(stream_name, self.width, self.shards)
+    for i in xrange(LatencyTracker.MIN_SAMPLES):
+      self.namespace.read_latencies.add(0)
+
+    events = list(stream.iterator(uuid_from_time(0, UUIDType.LOWEST),
+                                  uuid_from_time(10, UUIDType.HIGHEST),
+                                  False, MAX_LIMIT,
+                                  speculative_retry_percentile=50))
+    self.assertEqual(len(events), 50)
+    self.assertEqual(len({_id for _id, _ in events}), 50)
+
+  def test_bucket_auto_tuning(self):
+    ''' Checks the bucket layouts chosen for various ingest rates, then makes
+    a stream look busy so that it switches to narrower buckets and checks
+    that events in buckets of both widths are read. '''
+
+    day = epoch_time_to_kronos_time(86400)
+    minute = epoch_time_to_kronos_time(60)
+    self.assertEqual(choose_bucket_layout(1, 100000, 3, 64), (day, 3))
+    self.assertEqual(choose_bucket_layout(50000, 100000, 3, 64), (minute, 60))
+    self.assertEqual(choose_bucket_layout(50000, 100000, 3, 8), (minute, 8))
+
+    stream_name = 'TestCassandraBackend_test_bucket_auto_tuning'
+    stream = Stream(self.namespace, stream_name, day, 1,
+                    self.namespace.read_size, max_events_per_shard=100000,
+                    max_shards=4)
+    events = [(uuid_from_time(i),
+               SerializedEvent({TIMESTAMP_FIELD: epoch_time_to_kronos_time(i)}))
+              for i in xrange(120)]
+    stream.insert(events[:60], 32 * 1024, 4)
+    self.assertEqual((stream.width, stream.shards), (day, 1))
+
+    stream.ingest_window_start -= Stream.INGEST_RATE_WINDOW_SECONDS
+    stream.record_ingest(10 ** 7)
+    self.assertEqual(stream.width, minute)
+    self.assertTrue(stream.shards > 1)
+    stream.insert(events[60:], 32 * 1024, 4)
+
+    shard_descs = stream.get_overlapping_shards(
+      0, epoch_time_to_kronos_time(120))
+    self.assertEqual({shard_desc['width'] for shard_desc in shard_descs},
+                     {day, minute})
+    self.assertEqual(len(self.get(stream_name, 0,
+                                  epoch_time_to_kronos_time(120))), 120)
+
   def test_overlapping_shards(self):
     ''' Tests that changing bucket widths doesn\'t break shit. First inserts
     events into two contiguous shards when the bucket width is 2 seconds. Then
@@ -172,3 +393,19 @@ class TestCassandraBackend(KronosServerTestCase):
     # Revert default width settings.
     settings.storage.cassandra.timewidth_seconds = 2
     router.reload()
+
+  def test_prefix_configuration_validation(self):
+    ''' Overrides a setting for a stream prefix with an invalid value and
+    checks that the router rejects it when loading its configuration. '''
+
+    streams_configuration = (
+      settings.namespace_to_streams_configuration[settings.default_namespace])
+    streams_configuration['TestCassandraBackend_'] = {
+      'backends': {'cassandra': {'read_consistency': 'QUORUMM'}},
+      'read_backend': 'cassandra'
+    }
+    try:
+      self.assertRaises(ImproperlyConfigured, router.reload)
+    finally:
+      del streams_configuration['TestCassandraBackend_']
+      router.reload()
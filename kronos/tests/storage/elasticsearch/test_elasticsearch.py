@@ -6,6 +6,7 @@ from timeuuid import TimeUUID
 from kronos.common.time import datetime_to_kronos_time
 from kronos.conf import settings
 from kronos.conf.constants import ID_FIELD
+from kronos.conf.constants import ResultOrder
 from kronos.conf.constants import TIMESTAMP_FIELD
 from kronos.storage.elasticsearch.client import IndexManager
 from kronos.storage.router import router
@@ -87,6 +88,73 @@ class TestElasticSearchBackend(KronosServerTestCase):
     self.assertEqual(es.count(index=index3,
                               ignore_unavailable=True).get('count', 0), 0)
 
+  def test_alias_catalog(self):
+    settings.storage.elasticsearch.alias_catalog = True
+    reload_router(kill_update_thread=True)
+    index_manager = router.get_backend('elasticsearch').index_manager
+
+    times = [datetime_to_kronos_time(datetime(2014, 2, day)) for day in
+             (1, 3, 5)]
+    for time in times:
+      self.put('test_alias_catalog', [{TIMESTAMP_FIELD: time}])
+    self.assertEqual(index_manager.get_aliases('kronos', times[0] + 1,
+                                               times[1]),
+                     ['kronos_test:kronos:2014.02.01',
+                      'kronos_test:kronos:2014.02.03'])
+    self.assertEqual(index_manager.get_aliases('kronos', times[1] + 1,
+                                               times[2] - 1),
+                     ['kronos_test:kronos:2014.02.03'])
+
+    # Aliases added by other Kronos processes show up once the catalog is
+    # refreshed.
+    es = router.get_backend('elasticsearch').es
+    es.indices.update_aliases({'actions': [
+      {'add': {'index': index_manager.get_index('kronos'),
+               'alias': 'kronos_test:kronos:2014.02.04'}}]})
+    self.assertEqual(index_manager.get_aliases('kronos', times[1] + 1,
+                                               times[2] - 1),
+                     ['kronos_test:kronos:2014.02.03'])
+    index_manager.update()
+    self.assertEqual(index_manager.get_aliases('kronos', times[1] + 1,
+                                               times[2] - 1),
+                     ['kronos_test:kronos:2014.02.03',
+                      'kronos_test:kronos:2014.02.04'])
+    self.assertEqual(len(self.get('test_alias_catalog', times[0],
+                                  times[2])), 3)
+
+    # Without the catalog, aliases added by other Kronos processes show up
+    # right away.
+    del settings.storage.elasticsearch['alias_catalog']
+    reload_router(kill_update_thread=True)
+    index_manager = router.get_backend('elasticsearch').index_manager
+    es.indices.update_aliases({'actions': [
+      {'add': {'index': index_manager.get_index('kronos'),
+               'alias': 'kronos_test:kronos:2014.02.02'}}]})
+    self.assertEqual(index_manager.get_aliases('kronos', times[0] + 1,
+                                               times[1]),
+                     ['kronos_test:kronos:2014.02.01',
+                      'kronos_test:kronos:2014.02.02',
+                      'kronos_test:kronos:2014.02.03'])
+
+  def test_pagination(self):
+    # Events at the same time span pages, since `read_size` is 10.
+    self.put('test_pagination', [{TIMESTAMP_FIELD: i % 7, 'i': i}
+                                 for i in xrange(50)])
+    results = []
+    for pagination in ('scroll', 'search_after'):
+      settings.storage.elasticsearch.pagination = pagination
+      reload_router(kill_update_thread=True)
+      for order in (ResultOrder.ASCENDING, ResultOrder.DESCENDING):
+        for limit in (None, 25):
+          events = self.get('test_pagination', 0, 6, order=order, limit=limit)
+          self.assertEqual(len(events), limit or 50)
+          self.assertEqual(events,
+                           sorted(events, key=lambda e: TimeUUID(e[ID_FIELD]),
+                                  reverse=order == ResultOrder.DESCENDING))
+          results.append(events)
+    del settings.storage.elasticsearch['pagination']
+    self.assertEqual(results[:4], results[4:])
+
   def test_rollover(self):
     settings.storage.elasticsearch.rollover_size = 10
     settings.storage.elasticsearch.rollover_check_period_seconds = 2
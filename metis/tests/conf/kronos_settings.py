@@ -10,6 +10,10 @@ serving_mode = ServingMode.ALL
 node = {
   'id': hex(getnode()),
   'flush_size': 512,
+  'put_read_size': 131072,
+  'put_chunk_size': 1000,
+  'compression_level': 6,
+  'get_multi_batch_size': 1000,
   'greenlet_pool_size': 20,
   'gipc_pool_size': 1,
   'log_directory': 'logs',
@@ -17,6 +17,7 @@ from pykronos.client import ID_FIELD
 from pykronos.client import TIMESTAMP_FIELD
 from pykronos.client import KronosClient
 from pykronos.client import ResultOrder
+from pykronos.client import STREAM_FIELD
 from pykronos.common.time import datetime_to_kronos_time
 from datetime import datetime
 from datetime import timedelta
@@ -47,6 +48,27 @@ flushing events, those events will be lost.
 nonblocking = KronosClient('http://localhost:8151', namespace='kronos',
                            blocking=False)
 
+"""
+### A msgpack Client
+
+Pass `marshaler='msgpack'` to talk to the server in
+[msgpack](http://msgpack.org/) rather than JSON, which is faster to encode and
+decode when inserting or retrieving many events. This requires the
+msgpack-python package on both the client and the server.
+"""
+packed = KronosClient('http://localhost:8151', namespace='kronos',
+                      marshaler='msgpack')
+
+"""
+### A Compressing Client
+
+Pass `compress=True` to gzip request bodies before sending them to the
+server.  This trades a little CPU for much smaller uploads, which helps
+clients on slow links that insert a lot of events.
+"""
+compressed = KronosClient('http://localhost:8151', namespace='kronos',
+                          compress=True)
+
 """
 ## Inserting Events
 
@@ -123,6 +145,77 @@ for event in events:
   print 'Limited event', event
   last_event_id = event[ID_FIELD]
 
+"""
+### Filtering Events And Properties
+
+To have the server only return some events, pass a `filter` in the
+format of metis conditions. To only get some properties of each event
+(along with its ID and time), pass a list of `properties`.
+"""
+events = kc.get('yourproduct.website.clicks',
+                start,
+                start + timedelta(minutes=10),
+                filter={'op': 'eq',
+                        'left': {'type': 'property', 'name': 'user'},
+                        'right': {'type': 'constant', 'value': 40}},
+                properties=['user'])
+for event in events:
+  print 'Filtered event', event
+
+"""
+### Retrieving Several Streams
+
+`get_multi` reads several streams in one request, which the server
+serves concurrently. Each event has the name of its stream in
+`STREAM_FIELD`. By default, the events of each stream are returned
+together; with `merge=True`, they are merged in time order.
+"""
+events = kc.get_multi(['yourproduct.website.pageviews',
+                       'yourproduct.website.clicks'],
+                      start,
+                      start + timedelta(minutes=10),
+                      merge=True)
+for event in events:
+  print 'Event from', event[STREAM_FIELD], event
+
+"""
+## Counting Events
+
+To count events without retrieving them, use `count`. It takes the
+same time range as `get`, and an optional `limit` at which counting
+stops, which makes `limit=1` a cheap check for whether a stream has any
+events in a time range.
+"""
+print 'Number of clicks', kc.count('yourproduct.website.clicks',
+                                   start,
+                                   start + timedelta(minutes=10))
+print 'Any clicks?', kc.count('yourproduct.website.clicks',
+                              start,
+                              start + timedelta(minutes=10),
+                              limit=1) > 0
+
+"""
+## Aggregating Events
+
+To count or sum events without retrieving them all, have the server
+aggregate them with `aggregate`.  It takes a list of aggregates, each
+with an `op` (`count`, `sum`, `min`, `max` or `avg`), a `property` to
+aggregate (optional for `count`) and an optional output `alias`.
+Events can be split into time buckets of `bucket_width` and grouped by
+the values of the properties in `group_by`.  Each bucket holds its
+start time, its group's property values and the aggregate values.
+"""
+buckets = kc.aggregate('yourproduct.website.clicks',
+                       start,
+                       start + timedelta(minutes=10),
+                       [{'op': 'count'},
+                        {'op': 'sum', 'property': 'num_clicks',
+                         'alias': 'clicks'}],
+                       bucket_width=timedelta(minutes=1),
+                       group_by=['user'])
+for bucket in buckets:
+  print 'User', bucket['user'], 'clicked', bucket['clicks'], 'times'
+
 """
 ## Getting A List Of Streams
 
@@ -1,4 +1,5 @@
 from pykronos.client import ID_FIELD  # noqa
 from pykronos.client import KronosClient  # noqa
+from pykronos.client import STREAM_FIELD  # noqa
 from pykronos.client import TIMESTAMP_FIELD  # noqa
 from pykronos.version import __version__  # noqa
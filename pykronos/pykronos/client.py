@@ -7,10 +7,12 @@ import time
 import traceback
 import types
 import ujson
+import zlib
 
 from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
+from datetime import timedelta
 from dateutil.parser import parse
 from threading import Lock
 from threading import Thread
@@ -20,15 +22,24 @@ import pykronos
 from pykronos.errors import KronosClientError
 from pykronos.common.time import datetime_to_kronos_time
 from pykronos.common.time import kronos_time_now
+from pykronos.common.time import timedelta_to_kronos_time
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
 
 # These are constants, do not modify them.
 ERRORS_FIELD = '@errors'
 ID_FIELD = '@id'
 LIBRARY_FIELD = '@library'
+STREAM_FIELD = '@stream'
 SUCCESS_FIELD = '@success'
 TIMESTAMP_FIELD = '@time'
 
 _DEFAULT_CHUNK_SIZE = 131072  # 128k
+_JSON_CONTENT_TYPE = 'application/json'
+_MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
 
 
 class ResultOrder(object):
@@ -46,6 +57,11 @@ def _get_errors(json_dict):
   return errors
 
 
+def _is_msgpack(response):
+  content_type = response.headers.get('Content-Type') or ''
+  return content_type.split(';', 1)[0].strip() == _MSGPACK_CONTENT_TYPE
+
+
 class KronosClient(object):
   """
   Initialize a Kronos client that can connect to a server at `http_url`
@@ -57,13 +73,24 @@ class KronosClient(object):
   `chunk_size` is the number of bytes read at once into memory when fetching
   events. For best performance it should be set equal to the `node.flush_size`
   setting of the Kronos server.
+
+  `marshaler` is the wire format used to talk to the server, either 'json' or
+  'msgpack'. msgpack is more compact and faster to decode, but requires the
+  msgpack-python package to be installed.
+
+  If `compress` is True, request bodies (e.g., the events sent by `put` and
+  by the background thread of a non-blocking client) are gzip compressed.
   """
 
   def __init__(self, http_url, blocking=True, sleep_block=0.1, namespace=None,
-               chunk_size=_DEFAULT_CHUNK_SIZE):
+               chunk_size=_DEFAULT_CHUNK_SIZE, marshaler='json',
+               compress=False):
     http_url = http_url.rstrip('/')
     self._put_url = '%s/1.0/events/put' % http_url
     self._get_url = '%s/1.0/events/get' % http_url
+    self._get_multi_url = '%s/1.0/events/get_multi' % http_url
+    self._count_url = '%s/1.0/events/count' % http_url
+    self._aggregate_url = '%s/1.0/events/aggregate' % http_url
     self._delete_url = '%s/1.0/events/delete' % http_url
     self._index_url = '%s/1.0/index' % http_url
     self._streams_url = '%s/1.0/streams' % http_url
@@ -71,6 +98,17 @@ class KronosClient(object):
 
     self.namespace = namespace
     self._chunk_size = chunk_size
+    self._compress = compress
+
+    if marshaler == 'json':
+      self._content_type = _JSON_CONTENT_TYPE
+    elif marshaler == 'msgpack':
+      if msgpack is None:
+        raise KronosClientError('The msgpack marshaler requires the '
+                                'msgpack-python package.')
+      self._content_type = _MSGPACK_CONTENT_TYPE
+    else:
+      raise KronosClientError('Unknown marshaler: %s.' % marshaler)
 
     self._blocking = blocking
     if not blocking:
@@ -125,24 +163,43 @@ class KronosClient(object):
       exception_dict['stack_trace'] = traceback.extract_tb(tb)
 
   def _make_request(self, url, data=None, stream=False, timeout=None):
+    # kronosd compresses event streams for clients that accept it. requests
+    # transparently decompresses responses as they are streamed in.
+    headers = {'Accept': self._content_type,
+               'Accept-Encoding': 'gzip, deflate'}
     if data is not None:
-      data = json.dumps(data)
+      if isinstance(data, dict):
+        data = self._encode(data)
+      headers['Content-Type'] = self._content_type
+      if self._compress:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = compressor.compress(data) + compressor.flush()
+        headers['Content-Encoding'] = 'gzip'
       func = requests.post
     else:
       func = requests.get
     response = func(url,
                     data=data,
+                    headers=headers,
                     stream=stream,
                     timeout=timeout)
     if response.status_code != requests.codes.ok:
       raise KronosClientError('Bad status code: %d.' % response.status_code)
     if not stream:
-      response = response.json()
+      if _is_msgpack(response):
+        response = msgpack.unpackb(response.content, encoding='utf-8')
+      else:
+        response = response.json()
       if not response[SUCCESS_FIELD]:
         raise KronosClientError('Encountered errors: %s' %
                                 _get_errors(response))
     return response
 
+  def _encode(self, data):
+    if self._content_type == _MSGPACK_CONTENT_TYPE:
+      return msgpack.packb(data)
+    return json.dumps(data)
+
   def index(self):
     return self._make_request(self._index_url)
 
@@ -194,21 +251,38 @@ class KronosClient(object):
         self._put_queue.append((namespace, event_dict))
 
   def _put(self, namespace, event_dict):
-    request_dict = {'events': event_dict}
-    if namespace is not None:
-      request_dict['namespace'] = namespace
-
-    return self._make_request(self._put_url, data=request_dict)
+    # kronosd decodes put requests incrementally and buffers events till it has
+    # seen `namespace`, so write `namespace` ahead of `events` to let it start
+    # inserting events before the body is fully read. The body is assembled by
+    # hand rather than left to the encoder's dictionary ordering. Without a
+    # namespace, the server's default namespace is used.
+    if self._content_type == _MSGPACK_CONTENT_TYPE:
+      parts = []
+      if namespace is not None:
+        parts.extend([msgpack.packb('namespace'), msgpack.packb(namespace)])
+      parts.extend([msgpack.packb('events'), msgpack.packb(event_dict)])
+      # 0x80 + n is the header of a msgpack map with n entries.
+      data = chr(0x80 + len(parts) / 2) + ''.join(parts)
+    else:
+      data = '"events": %s' % json.dumps(event_dict)
+      if namespace is not None:
+        data = '"namespace": %s, %s' % (json.dumps(namespace), data)
+      data = '{%s}' % data
+    return self._make_request(self._put_url, data=data)
 
   def get(self, stream, start_time, end_time, start_id=None, limit=None,
-          order=ResultOrder.ASCENDING, namespace=None, timeout=None):
+          order=ResultOrder.ASCENDING, namespace=None, timeout=None,
+          filter=None, properties=None):
     """
     Queries a stream with name `stream` for all events between `start_time` and
     `end_time` (both inclusive).  An optional `start_id` allows the client to
     restart from a failure, specifying the last ID they read; all events that
     happened after that ID will be returned. An optional `limit` limits the
     maximum number of events returned.  An optional `order` requests results in
-    `ASCENDING` or `DESCENDING` order.
+    `ASCENDING` or `DESCENDING` order. An optional `filter`, a condition in the
+    JSON format of metis conditions, only returns events that satisfy it, and
+    an optional list of `properties` only returns those properties of each
+    event (along with its ID and time). Both are applied by the server.
     """
     if isinstance(start_time, types.StringTypes):
       start_time = parse(start_time)
@@ -231,6 +305,10 @@ class KronosClient(object):
 
     if limit is not None:
       request_dict['limit'] = limit
+    if filter is not None:
+      request_dict['filter'] = filter
+    if properties is not None:
+      request_dict['properties'] = properties
 
     namespace = namespace or self.namespace
     if namespace is not None:
@@ -244,14 +322,9 @@ class KronosClient(object):
                                       data=request_dict,
                                       stream=True,
                                       timeout=timeout)
-        for line in response.iter_lines(chunk_size=self._chunk_size):
-          if line:
-            # Python's json adds a lot of overhead when decoding a large
-            # number of events; ujson fares better. However ujson won't work
-            # on PyPy since it's a C extension.
-            event = ujson.loads(line, precise_float=True)
-            last_id = event[ID_FIELD]
-            yield event
+        for event in self._iter_response(response):
+          last_id = event[ID_FIELD]
+          yield event
         break
       except Exception, e:
         if isinstance(e, requests.exceptions.Timeout):
@@ -264,6 +337,151 @@ class KronosClient(object):
           request_dict['start_id'] = last_id
         time.sleep(len(errors) * 0.1)
 
+  def get_multi(self, streams, start_time, end_time, start_id=None,
+                limit=None, order=ResultOrder.ASCENDING, namespace=None,
+                timeout=None, filter=None, properties=None, merge=False):
+    """
+    Queries several streams, whose names are in the list `streams`, in a
+    single request. The server reads the streams concurrently. Each event
+    returned has the name of its stream in `STREAM_FIELD`. Events of each
+    stream are returned together, in the order of `streams`, unless `merge`
+    is True, in which case the events of all streams are returned in time
+    order. `limit` is a limit per stream, and the other arguments are as in
+    `get`.
+    """
+    if isinstance(start_time, types.StringTypes):
+      start_time = parse(start_time)
+    if isinstance(end_time, types.StringTypes):
+      end_time = parse(end_time)
+    if isinstance(start_time, datetime):
+      start_time = datetime_to_kronos_time(start_time)
+    if isinstance(end_time, datetime):
+      end_time = datetime_to_kronos_time(end_time)
+
+    request_dict = {
+      'streams': streams,
+      'end_time': end_time,
+      'order': order,
+      'merge': merge
+    }
+    if start_id is not None:
+      request_dict['start_id'] = start_id
+    else:
+      request_dict['start_time'] = start_time
+
+    if limit is not None:
+      request_dict['limit'] = limit
+    if filter is not None:
+      request_dict['filter'] = filter
+    if properties is not None:
+      request_dict['properties'] = properties
+
+    namespace = namespace or self.namespace
+    if namespace is not None:
+      request_dict['namespace'] = namespace
+
+    try:
+      response = self._make_request(self._get_multi_url,
+                                    data=request_dict,
+                                    stream=True,
+                                    timeout=timeout)
+    except requests.exceptions.Timeout:
+      raise KronosClientError('Request timed out.')
+    for event in self._iter_response(response):
+      yield event
+
+  def _iter_response(self, response):
+    """
+    Decode the values in a streamed response one at a time. JSON responses
+    hold one value per line; msgpack responses are a concatenation of values.
+    """
+    if _is_msgpack(response):
+      unpacker = msgpack.Unpacker(encoding='utf-8')
+      for chunk in response.iter_content(chunk_size=self._chunk_size):
+        unpacker.feed(chunk)
+        for value in unpacker:
+          yield value
+      return
+    for line in response.iter_lines(chunk_size=self._chunk_size):
+      if line:
+        # Python's json adds a lot of overhead when decoding a large
+        # number of events; ujson fares better. However ujson won't work
+        # on PyPy since it's a C extension.
+        yield ujson.loads(line, precise_float=True)
+
+  def count(self, stream, start_time, end_time, start_id=None, limit=None,
+            namespace=None):
+    """
+    Counts the events that `get` would return for the same arguments without
+    retrieving them. If `limit` is given, counting stops at `limit`, so
+    `count(..., limit=1)` cheaply checks whether there are any events.
+    """
+    if isinstance(start_time, types.StringTypes):
+      start_time = parse(start_time)
+    if isinstance(end_time, types.StringTypes):
+      end_time = parse(end_time)
+    if isinstance(start_time, datetime):
+      start_time = datetime_to_kronos_time(start_time)
+    if isinstance(end_time, datetime):
+      end_time = datetime_to_kronos_time(end_time)
+
+    request_dict = {
+      'stream': stream,
+      'end_time': end_time
+    }
+    if start_id is not None:
+      request_dict['start_id'] = start_id
+    else:
+      request_dict['start_time'] = start_time
+    if limit is not None:
+      request_dict['limit'] = limit
+
+    namespace = namespace or self.namespace
+    if namespace is not None:
+      request_dict['namespace'] = namespace
+
+    return self._make_request(self._count_url, data=request_dict)['count']
+
+  def aggregate(self, stream, start_time, end_time, aggregates,
+                bucket_width=None, group_by=None, namespace=None):
+    """
+    Computes aggregates over the events in the stream with name `stream`
+    between `start_time` and `end_time` (both inclusive) on the server, and
+    returns a list of buckets. `aggregates` is a list of dictionaries of the
+    form {'op': 'count'|'sum'|'min'|'max'|'avg', 'property': property_name,
+    'alias': output_name}. Events are split into buckets of `bucket_width`
+    (a `timedelta` or Kronos time) and grouped by the values of the
+    properties in the optional `group_by` list.
+    """
+    if isinstance(start_time, types.StringTypes):
+      start_time = parse(start_time)
+    if isinstance(end_time, types.StringTypes):
+      end_time = parse(end_time)
+    if isinstance(start_time, datetime):
+      start_time = datetime_to_kronos_time(start_time)
+    if isinstance(end_time, datetime):
+      end_time = datetime_to_kronos_time(end_time)
+    if isinstance(bucket_width, timedelta):
+      bucket_width = timedelta_to_kronos_time(bucket_width)
+
+    request_dict = {
+      'stream': stream,
+      'start_time': start_time,
+      'end_time': end_time,
+      'aggregates': aggregates
+    }
+    if bucket_width is not None:
+      request_dict['bucket_width'] = bucket_width
+    if group_by is not None:
+      request_dict['group_by'] = group_by
+
+    namespace = namespace or self.namespace
+    if namespace is not None:
+      request_dict['namespace'] = namespace
+
+    return self._make_request(self._aggregate_url,
+                              data=request_dict)['buckets']
+
   def delete(self, stream, start_time, end_time, start_id=None, namespace=None):
     """
     Delete events in the stream with name `stream` that occurred between
@@ -306,9 +524,13 @@ class KronosClient(object):
     response = self._make_request(self._streams_url,
                                   data=request_dict,
                                   stream=True)
-    for line in response.iter_lines():
-      if line:
-        yield line
+    if _is_msgpack(response):
+      for stream in self._iter_response(response):
+        yield stream
+    else:
+      for line in response.iter_lines():
+        if line:
+          yield line
 
   def infer_schema(self, stream, namespace=None):
     """
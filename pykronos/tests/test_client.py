@@ -7,6 +7,7 @@ from datetime import datetime
 from pykronos import KronosClient
 from pykronos.client import ID_FIELD
 from pykronos.client import LIBRARY_FIELD
+from pykronos.client import STREAM_FIELD
 from pykronos.client import TIMESTAMP_FIELD
 from pykronos.common.time import kronos_time_now
 
@@ -108,6 +109,85 @@ class KronosClientTest(unittest.TestCase):
       stream = '%s_%s' % (self.stream, i)
       self.assertTrue(stream in streams)
 
+  def test_msgpack(self):
+    client = KronosClient('http://localhost:9191/', marshaler='msgpack')
+    stream = 'KronosClientTest_test_msgpack'
+    start_time = kronos_time_now()
+    client.put({stream: [{'a': 1}, {'a': u'\u263a'}]})
+    events = list(client.get(stream, start_time, kronos_time_now()))
+    self.assertEqual(len(events), 2)
+    self.assertEqual({1, u'\u263a'}, set(event['a'] for event in events))
+    self.assertTrue(stream in set(client.get_streams()))
+
+  def test_compress(self):
+    for blocking in (True, False):
+      client = KronosClient('http://localhost:9191/', blocking=blocking,
+                            sleep_block=0.2, compress=True)
+      stream = 'KronosClientTest_test_compress_%s' % blocking
+      start_time = kronos_time_now()
+      client.put({stream: [{'a': i} for i in xrange(100)]})
+      client.flush()
+      events = list(client.get(stream, start_time, kronos_time_now()))
+      self.assertEqual(len(events), 100)
+
+  def test_count(self):
+    stream = 'KronosClientTest_test_count'
+    start_time = kronos_time_now()
+    self.blocking_client.put({stream: [{'a': i} for i in xrange(10)]})
+    end_time = kronos_time_now()
+    self.assertEqual(self.blocking_client.count(stream, start_time, end_time),
+                     10)
+    self.assertEqual(self.blocking_client.count(stream, start_time, end_time,
+                                                limit=1), 1)
+    self.assertEqual(self.blocking_client.count(stream, end_time + 1,
+                                                end_time + 2), 0)
+
+  def test_aggregate(self):
+    stream = 'KronosClientTest_test_aggregate'
+    start_time = kronos_time_now()
+    self.blocking_client.put({stream: [{TIMESTAMP_FIELD: start_time + t,
+                                        'a': t % 2, 'b': t}
+                                       for t in xrange(10)]})
+    buckets = self.blocking_client.aggregate(
+      stream, start_time, start_time + 9,
+      [{'op': 'count'}, {'op': 'max', 'property': 'b'}], group_by=['a'])
+    self.assertEqual(buckets, [
+      {TIMESTAMP_FIELD: start_time, 'a': 0, 'count': 5, 'max_b': 8},
+      {TIMESTAMP_FIELD: start_time, 'a': 1, 'count': 5, 'max_b': 9}])
+
+  def test_filter_and_properties(self):
+    stream = 'KronosClientTest_test_filter_and_properties'
+    start_time = kronos_time_now()
+    self.blocking_client.put({stream: [{TIMESTAMP_FIELD: start_time + i,
+                                        'a': i, 'b': i * 2}
+                                       for i in xrange(10)]})
+    events = list(self.blocking_client.get(
+      stream, start_time, start_time + 9,
+      filter={'op': 'gte',
+              'left': {'type': 'property', 'name': 'a'},
+              'right': {'type': 'constant', 'value': 7}},
+      properties=['b']))
+    self.assertEqual([event['b'] for event in events], [14, 16, 18])
+    for event in events:
+      self.assertEqual(set(event), {ID_FIELD, TIMESTAMP_FIELD, 'b'})
+
+  def test_get_multi(self):
+    streams = ['KronosClientTest_test_get_multi_%s' % i for i in xrange(2)]
+    start_time = kronos_time_now()
+    for i, stream in enumerate(streams):
+      self.blocking_client.put({stream: [{TIMESTAMP_FIELD: start_time + t}
+                                         for t in xrange(i, 6, 2)]})
+    events = list(self.blocking_client.get_multi(streams, start_time,
+                                                 start_time + 5))
+    self.assertEqual([(event[STREAM_FIELD], event[TIMESTAMP_FIELD] - start_time)
+                      for event in events],
+                     [(streams[0], 0), (streams[0], 2), (streams[0], 4),
+                      (streams[1], 1), (streams[1], 3), (streams[1], 5)])
+    events = list(self.blocking_client.get_multi(streams, start_time,
+                                                 start_time + 5, merge=True))
+    self.assertEqual([event[TIMESTAMP_FIELD] - start_time for event in events],
+                     range(6))
+
   @kronos_client_test
   def test_inferred_schema(self):
     events = [{'a': 1, TIMESTAMP_FIELD: 1},